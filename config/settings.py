@@ -128,6 +128,8 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.SessionAuthentication',
     ],
+    'DEFAULT_PAGINATION_CLASS': 'config.pagination.KeysetCursorPagination',
+    'PAGE_SIZE': 50,
 }
 
 
@@ -147,3 +149,40 @@ CSRF_TRUSTED_ORIGINS = [
 ]
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    # Фото точек, комментариев и профилей: хранятся по хешу содержимого
+    'photos': {'BACKEND': 'config.storage.ContentAddressedStorage'},
+}
+
+# Кеш ответов публичной карты (pollution.response_cache). В продакшене —
+# Redis (REDIS_URL, нужен пакет redis), иначе память процесса.
+REDIS_URL = os.environ.get('REDIS_URL')
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'responses': (
+        {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': REDIS_URL}
+        if REDIS_URL else
+        {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'responses'}
+    ),
+}
+
+# Дисковый кеш векторных тайлов карты
+TILE_CACHE_DIR = os.path.join(BASE_DIR, 'tile_cache')
+
+# Потоков для фоновых задач в веб-процессе (отчёты, обработка фото). Задачи хранятся в БД:
+# их же выполняют manage.py run_export_jobs и manage.py process_photos, в том числе оставшиеся
+# после перезапуска веб-процесса. С BACKGROUND_WORKERS=0 работают только эти команды
+BACKGROUND_WORKERS = int(os.environ.get('BACKGROUND_WORKERS', '2'))
+
+# Задержка ленты синхронизации (pollution.sync), с: больше самой долгой пишущей транзакции
+SYNC_LAG_SECONDS = float(os.environ.get('SYNC_LAG_SECONDS', '2'))
+
+# Одновременных SSE-подключений к /api/pollutions/events/ на процесс (только под ASGI)
+EVENTS_MAX_CONNECTIONS = int(os.environ.get('EVENTS_MAX_CONNECTIONS', '1000'))
+
+# Асинхронные GET для списка/карточки точки и комментариев (pollution.async_reads).
+# Имеет смысл под ASGI; для WSGI-развёртывания можно выключить: ASYNC_READS=0
+ASYNC_READS = os.environ.get('ASYNC_READS', '1') != '0'
@@ -0,0 +1,108 @@
+"""
+Контентно-адресуемое хранилище фотографий.
+
+Файл сохраняется под именем ``photos/<ab>/<sha256><ext>``: одинаковые
+загрузки (фото точки, затем то же фото в комментарии) занимают место один
+раз, а содержимое по имени никогда не меняется, поэтому его можно отдавать
+с ``Cache-Control: immutable``. Число ссылок на файл хранится в
+``MediaBlob``: ``save`` увеличивает его, ``delete`` уменьшает и удаляет файл
+только после освобождения последней ссылки.
+
+Ссылка добавляется в текущей транзакции, поэтому модели с фото сохраняются
+атомарно (``AtomicSaveMixin``): если строка модели не записалась, откатывается
+и ссылка. Записанный файл при этом остаётся без ссылки и достаётся следующей
+загрузке с тем же содержимым.
+
+Хранилище общее для приложений (фото точек, комментариев и профилей).
+Файлы отдаёт веб-сервер или CDN с ``Cache-Control: immutable``; в режиме
+DEBUG — ``serve_blob``.
+"""
+import hashlib
+import os
+import re
+
+from django.apps import apps
+from django.core.files.storage import FileSystemStorage, storages
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils.deconstruct import deconstructible
+from django.views.static import serve
+
+BLOB_DIR = 'photos'
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+_BLOB_NAME = re.compile(rf'^{BLOB_DIR}/[0-9a-f]{{2}}/(?P<hash>[0-9a-f]{{64}})(\.[0-9a-z]+)?$')
+
+
+def content_hash(name):
+    """SHA-256 содержимого по имени файла хранилища или None для старых имён."""
+    match = _BLOB_NAME.match(name or '')
+    return match.group('hash') if match else None
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+
+    def __init__(self, **kwargs):
+        # Параллельная запись одного и того же содержимого не должна выдумывать новое имя
+        kwargs.setdefault('allow_overwrite', True)
+        super().__init__(**kwargs)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        digest = digest.hexdigest()
+        extension = os.path.splitext(name)[1].lower()
+        name = f'{BLOB_DIR}/{digest[:2]}/{digest}{extension}'
+
+        # Сначала ссылка, потом файл: параллельный delete не удалит его из-под нас
+        self._add_ref(name, 1)
+        if not self.exists(name):
+            name = self._save(name, content)
+        return name
+
+    def delete(self, name):
+        if not name:
+            return
+        if content_hash(name) is None:
+            super().delete(name)
+            return
+        self._add_ref(name, -1)
+        blob_model = apps.get_model('pollution', 'MediaBlob')
+        deleted, _ = blob_model.objects.filter(name=name, refs__lte=0).delete()
+        if deleted:
+            super().delete(name)
+
+    @staticmethod
+    def _add_ref(name, delta):
+        blobs = apps.get_model('pollution', 'MediaBlob').objects
+        if blobs.filter(name=name).update(refs=F('refs') + delta):
+            return
+        try:
+            with transaction.atomic():
+                blobs.create(name=name, refs=delta)
+        except IntegrityError:
+            # Строку успели создать параллельно
+            blobs.filter(name=name).update(refs=F('refs') + delta)
+
+
+class AtomicSaveMixin:
+    """Сохранение модели с файлом хранилища одной транзакцией со ссылкой на файл."""
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
+
+def photo_storage():
+    return storages['photos']
+
+
+def serve_blob(request, path):
+    """Отдача файлов хранилища с долгоживущим кешем (имя меняется вместе с содержимым)."""
+    response = serve(request, path, document_root=os.path.join(photo_storage().location, BLOB_DIR))
+    response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
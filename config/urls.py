@@ -17,7 +17,9 @@ Including another URLconf
 from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
+
+from config.storage import BLOB_DIR, serve_blob
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -25,5 +27,7 @@ urlpatterns = [
     path('api/users/', include('users.urls')),
 ]
 
+# В продакшене медиафайлы отдаёт веб-сервер или CDN, а не процессы Django
 if settings.DEBUG:
+    urlpatterns += [re_path(rf'^{settings.MEDIA_URL.strip("/")}/{BLOB_DIR}/(?P<path>.+)$', serve_blob)]
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -0,0 +1,143 @@
+"""
+Сроки реакции на сообщения о загрязнении (``points/analytics/``).
+
+Для точек, созданных в интервале, считаются два срока в часах: до начала
+работ (``started_at - created_at``) и до очистки (``cleaned_at - created_at``).
+Разности дат вычисляет БД, одна выборка ``values_list`` переводится в
+массивы NumPy, а процентили и гистограммы по группам считаются над
+массивами, без циклов по строкам в Python.
+
+Результат кешируется по интервалу, группировке и версии данных
+(``pollution.versions``): пока точки не менялись, повторный отчёт за тот же
+период — одно чтение из кеша. Повторные сообщения (``duplicate_of``) не
+учитываются.
+"""
+import hashlib
+import json
+
+import numpy as np
+from django.core.cache import cache
+from django.db.models import DateField, DurationField, ExpressionWrapper, F
+from django.db.models.functions import TruncWeek
+
+from . import exports, versions
+from .models import PollutionPoint
+
+# ?group_by= -> колонка выборки
+GROUP_FIELDS = {
+    'pollution_type': 'pollution_type',
+    'organization': 'handled_by_id',
+    'region': 'handled_by__region',
+    'week': 'week',
+}
+PERCENTILES = (50, 75, 90, 95)
+# Границы корзин гистограммы, часы; последняя корзина открыта справа
+BINS_HOURS = (0, 1, 3, 6, 12, 24, 48, 72, 168, 336, 720)
+CACHE_TIMEOUT = 60 * 60
+
+_EDGES = np.array(BINS_HOURS + (np.inf,), dtype=float)
+
+
+def window(params):
+    """Интервал [start, end) по параметрам AnalyticsParamsSerializer."""
+    start, end = params.get('from'), params.get('to')
+    if start is None and end is None:
+        start = exports.period_start(params['period'])
+    return start, end
+
+
+def report(params):
+    start, end = window(params)
+    group_by = params.get('group_by') or []
+    version, _ = versions.current()
+    raw = json.dumps([start and start.isoformat(), end and end.isoformat(), group_by])
+    key = f'analytics:{hashlib.sha1(raw.encode()).hexdigest()}:{version}'
+    result = cache.get(key)
+    if result is None:
+        result = {
+            'from': start,
+            'to': end,
+            'group_by': group_by,
+            'bins_hours': list(BINS_HOURS),
+            'groups': compute(start, end, group_by),
+        }
+        cache.set(key, result, CACHE_TIMEOUT)
+    return result
+
+
+def _since_created(field):
+    return ExpressionWrapper(F(field) - F('created_at'), output_field=DurationField())
+
+
+def _hours(column):
+    """Длительности (timedelta или None) -> часы, NaN для незавершённых."""
+    seconds = np.array(column, dtype='timedelta64[s]')
+    return np.where(np.isnat(seconds), np.nan, seconds.astype(float)) / 3600
+
+
+def _codes(column):
+    """Номер группы для каждого значения колонки и значения групп (None — своя группа)."""
+    values = np.array(column, dtype=object)
+    missing = np.equal(values, None)
+    labels, inverse = np.unique(values[~missing], return_inverse=True)
+    codes = np.full(len(values), len(labels))
+    codes[~missing] = inverse
+    return codes, [*labels, None]
+
+
+def _label(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def summary(hours):
+    """Число завершённых, среднее, процентили и гистограмма по корзинам BINS_HOURS."""
+    done = np.clip(hours[~np.isnan(hours)], 0, None)
+    result = {
+        'count': int(done.size),
+        'mean': None,
+        'percentiles': dict.fromkeys((f'p{p}' for p in PERCENTILES), None),
+        'histogram': np.histogram(done, bins=_EDGES)[0].tolist(),
+    }
+    if done.size:
+        result['mean'] = round(float(done.mean()), 2)
+        values = np.percentile(done, PERCENTILES)
+        result['percentiles'] = {f'p{p}': round(float(v), 2) for p, v in zip(PERCENTILES, values)}
+    return result
+
+
+def compute(start, end, group_by):
+    points = PollutionPoint.objects.filter(duplicate_of__isnull=True)
+    if start is not None:
+        points = points.filter(created_at__gte=start)
+    if end is not None:
+        points = points.filter(created_at__lt=end)
+    points = points.annotate(to_start=_since_created('started_at'), to_clean=_since_created('cleaned_at'))
+    if 'week' in group_by:
+        points = points.annotate(week=TruncWeek('created_at', output_field=DateField()))
+
+    rows = list(points.order_by().values_list('to_start', 'to_clean', *(GROUP_FIELDS[name] for name in group_by)))
+    if not rows:
+        return []
+    to_start, to_clean, *keys = zip(*rows)
+    to_start, to_clean = _hours(to_start), _hours(to_clean)
+
+    if keys:
+        codes, labels = zip(*(_codes(column) for column in keys))
+        groups, group_ids = np.unique(np.stack(codes, axis=1), axis=0, return_inverse=True)
+        group_ids = group_ids.ravel()
+    else:
+        labels, groups, group_ids = (), np.zeros((1, 0), dtype=int), np.zeros(len(rows), dtype=int)
+
+    # Строки группы подряд: одна сортировка и разбиение по границам групп
+    order = np.argsort(group_ids, kind='stable')
+    bounds = np.cumsum(np.bincount(group_ids, minlength=len(groups)))[:-1]
+    result = []
+    for group, start_hours, clean_hours in zip(groups, np.split(to_start[order], bounds),
+                                               np.split(to_clean[order], bounds)):
+        result.append({
+            'key': {name: _label(labels[i][code]) for i, (name, code) in enumerate(zip(group_by, group))},
+            'points': int(start_hours.size),
+            'time_to_start': summary(start_hours),
+            'time_to_clean': summary(clean_hours),
+        })
+    return result
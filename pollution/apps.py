@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class PollutionConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'pollution'
+
+    def ready(self):
+        # Подключаем обработчики сигналов об изменении точек
+        from . import clusters, events, images, search, signals, stats, sync, tiles, versions  # noqa: F401
+        images.connect()
+        versions.connect()
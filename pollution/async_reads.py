@@ -0,0 +1,135 @@
+"""
+Асинхронные GET для самых частых запросов карты: список точек (bbox/near),
+карточка точки и комментарии к точке.
+
+Под ASGI синхронный view DRF занимает поток на всё время запроса. Здесь
+данные читаются через async ORM, а разбор параметров, план запроса,
+пагинация и сериализация берутся у тех же viewset'ов, поэтому ответ
+совпадает с синхронным байт в байт (вместе с ETag и кешем ответов).
+
+Асинхронно обрабатывается только основной случай — JSON-ответ без ошибок.
+Запись, browsable API, ошибки (400/403/404) и HEAD передаются исходному
+view DRF. Подключение — ``route()`` в ``pollution.urls``, выключается
+настройкой ``ASYNC_READS`` (под WSGI асинхронный view только добавляет
+накладные расходы на event loop).
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist, SynchronousOnlyOperation
+from django.urls import re_path
+from rest_framework.exceptions import APIException
+from rest_framework.response import Response
+
+from . import response_cache, versions
+from .models import PollutionPoint
+from .serializers import CommentSerializer
+
+
+async def _prepare(sync_view, request, kwargs):
+    """Экземпляр viewset'а как в ``as_view()``/``dispatch()``; None, если ответ не JSON."""
+    view = sync_view.cls(**sync_view.initkwargs)
+    view.action_map = sync_view.actions
+    for method, action in sync_view.actions.items():
+        setattr(view, method, getattr(view, action))
+    if 'get' in sync_view.actions and 'head' not in sync_view.actions:
+        view.head = view.get
+    view.args, view.kwargs = (), kwargs
+    view.headers = view.default_response_headers
+    # Пользователь из сессии читается асинхронно, дальше DRF берёт его готовым
+    request.user = await request.auser()
+    view.request = view.initialize_request(request, **kwargs)
+    view.initial(view.request, **kwargs)
+    if view.request.accepted_renderer.format != 'json':
+        return None
+    return view
+
+
+def _render(view, data):
+    response = view.finalize_response(view.request, Response(data))
+    return response.render()
+
+
+async def _conditional(view, build, cache=False):
+    """
+    То же, что ``versions.conditional`` (и ``response_cache.cached`` при
+    ``cache``): 304 без обращения к данным или ответ корутины ``build``.
+    """
+    names = view.version_collections()
+    if names is None:
+        return None
+    version, modified = await versions.acurrent(*names)
+    validators, not_modified = versions.prepare(view.request, version, modified)
+    if not_modified is not None:
+        return not_modified
+    if cache:
+        return await response_cache.acached(view.request, names, version, modified, build)
+    return validators.stamp(await build())
+
+
+async def point_list(view):
+    async def build():
+        queryset = view.filter_queryset(view.get_queryset())
+        page = await view.paginator.apaginate_queryset(queryset, view.request, view=view)
+        return _render(view, view.get_paginated_response(view.get_serializer(page, many=True).data).data)
+
+    return await _conditional(view, build, cache=True)
+
+
+async def point_detail(view):
+    async def build():
+        point = await view.get_queryset().aget(pk=view.kwargs['pk'])
+        return _render(view, view.get_serializer(point).data)
+
+    return await _conditional(view, build)
+
+
+async def point_comments(view):
+    async def build():
+        point = await PollutionPoint.objects.aget(pk=view.kwargs['pk'])
+        comments = point.comments.select_related('author')
+        page = await view.paginator.apaginate_queryset(comments, view.request, view=view)
+        return _render(view, view.get_paginated_response(CommentSerializer(page, many=True).data).data)
+
+    return await _conditional(view, build)
+
+
+# Имя маршрута роутера -> асинхронная реализация GET
+READERS = {
+    'points-list': point_list,
+    'points-detail': point_detail,
+    'points-comments': point_comments,
+}
+
+
+def hybrid(sync_view, reader):
+    """GET — асинхронно, всё остальное и любые ошибки — синхронным view DRF."""
+    run_sync = sync_to_async(sync_view)
+
+    async def view(request, *args, **kwargs):
+        if request.method == 'GET':
+            try:
+                prepared = await _prepare(sync_view, request, kwargs)
+                response = await reader(prepared) if prepared is not None else None
+                if response is not None:
+                    return response
+            except (APIException, ObjectDoesNotExist, SynchronousOnlyOperation):
+                # Ошибку (и код, которому нужен синхронный ORM) обработает исходный view
+                pass
+        return await run_sync(request, *args, **kwargs)
+
+    # CSRF для сессий проверяет сам DRF, как и у исходного view
+    view.csrf_exempt = True
+    return view
+
+
+def route(patterns):
+    """Маршруты роутера с асинхронными GET для READERS."""
+    if not settings.ASYNC_READS:
+        return patterns
+    routed = []
+    for pattern in patterns:
+        if pattern.name in READERS:
+            view = hybrid(pattern.callback, READERS[pattern.name])
+            pattern = re_path(pattern.pattern.regex.pattern, view, name=pattern.name)
+        routed.append(pattern)
+    return routed
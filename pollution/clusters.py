@@ -0,0 +1,129 @@
+"""
+Серверная кластеризация точек для мелких масштабов карты.
+
+Иерархия — ячейки geohash точностью от 1 до ``MAX_PRECISION``. Для каждой
+ячейки, типа и статуса в ``ClusterCell`` хранится число точек и сумма
+координат (для центроида). Таблица обновляется инкрементально по сигналу
+``points_changed``, поэтому ответ строится из числа строк, ограниченного
+экраном, а не размером таблицы точек.
+
+Повторные сообщения (``duplicate_of``) в кластеры не входят, как и в список.
+"""
+from collections import defaultdict
+
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Substr
+from django.dispatch import receiver
+
+from . import geo, rollups
+from .models import ClusterCell, PollutionPoint
+from .signals import points_changed
+
+MAX_PRECISION = 8
+# Верхняя граница числа ячеек в ответе, если bbox слишком велик для масштаба
+MAX_RESPONSE_CELLS = 2048
+KEY_FIELDS = ('precision', 'cell', 'pollution_type', 'status')
+
+
+def precision_for_zoom(zoom):
+    """Точность geohash, при которой в тайл 256px попадает ~4×4 ячейки."""
+    return max(1, min(MAX_PRECISION, round((zoom + 2) * 2 / 5)))
+
+
+def _keys(state):
+    if state.duplicate_of_id is not None:
+        return []
+    return [
+        (precision, state.geohash[:precision], state.pollution_type, state.status)
+        for precision in range(1, MAX_PRECISION + 1)
+    ]
+
+
+def _values(state):
+    return {'count': 1, 'latitude_sum': state.latitude, 'longitude_sum': state.longitude}
+
+
+@receiver(points_changed)
+def update_clusters(sender, changes, **kwargs):
+    deltas = rollups.collect(changes, _keys, _values)
+    rollups.apply_deltas(ClusterCell, KEY_FIELDS, deltas)
+
+
+def rebuild(point_model=PollutionPoint, cell_model=ClusterCell):
+    """Полный пересчёт агрегатов (для миграций и восстановления)."""
+    cell_model.objects.all().delete()
+    for precision in range(1, MAX_PRECISION + 1):
+        rows = (
+            point_model.objects
+            .filter(duplicate_of__isnull=True)
+            .annotate(cell=Substr('geohash', 1, precision))
+            .values('cell', 'pollution_type', 'status')
+            .annotate(
+                count=Count('id'),
+                latitude_sum=Sum('latitude'),
+                longitude_sum=Sum('longitude'),
+            )
+            .order_by()
+        )
+        cell_model.objects.bulk_create(
+            [cell_model(precision=precision, **row) for row in rows.iterator()],
+            batch_size=1000,
+        )
+
+
+def clusters_in_bbox(bbox, zoom):
+    """Кластеры с центроидом в прямоугольнике для данного масштаба."""
+    min_lon, min_lat, max_lon, max_lat = bbox
+    precision = precision_for_zoom(zoom)
+    while precision > 1:
+        lat_step, lon_step = geo.cell_size(precision)
+        if ((max_lat - min_lat) / lat_step + 1) * ((max_lon - min_lon) / lon_step + 1) <= MAX_RESPONSE_CELLS:
+            break
+        precision -= 1
+    rows = ClusterCell.objects.filter(precision=precision, count__gt=0)
+
+    prefixes = geo.cover(min_lon, min_lat, max_lon, max_lat)
+    if prefixes:
+        cells = Q()
+        for prefix in prefixes:
+            # Ячейки крупнее префикса покрытия совпадают с его началом
+            if len(prefix) > precision:
+                cells |= Q(cell=prefix[:precision])
+            else:
+                lo, hi = geo.prefix_range(prefix)
+                cells |= Q(cell__gte=lo, cell__lt=hi)
+        rows = rows.filter(cells)
+
+    clusters = {}
+    for cell, pollution_type, status, count, lat_sum, lon_sum in rows.values_list(
+        'cell', 'pollution_type', 'status', 'count', 'latitude_sum', 'longitude_sum'
+    ):
+        cluster = clusters.get(cell)
+        if cluster is None:
+            cluster = clusters[cell] = {
+                'cell': cell,
+                'count': 0,
+                'latitude_sum': 0.0,
+                'longitude_sum': 0.0,
+                'pollution_types': defaultdict(int),
+                'statuses': defaultdict(int),
+            }
+        cluster['count'] += count
+        cluster['latitude_sum'] += lat_sum
+        cluster['longitude_sum'] += lon_sum
+        cluster['pollution_types'][pollution_type] += count
+        cluster['statuses'][status] += count
+
+    result = []
+    for cluster in clusters.values():
+        latitude = cluster.pop('latitude_sum') / cluster['count']
+        longitude = cluster.pop('longitude_sum') / cluster['count']
+        if not (min_lat <= latitude <= max_lat and min_lon <= longitude <= max_lon):
+            continue
+        cluster['latitude'] = latitude
+        cluster['longitude'] = longitude
+        cluster['pollution_types'] = dict(cluster['pollution_types'])
+        cluster['statuses'] = dict(cluster['statuses'])
+        result.append(cluster)
+    result.sort(key=lambda c: c['cell'])
+    return {'zoom': zoom, 'precision': precision, 'clusters': result}
@@ -0,0 +1,146 @@
+"""
+Поиск повторных сообщений о том же загрязнении при создании точки.
+
+Кандидаты — открытые точки того же типа в радиусе ``RADIUS_M`` за последние
+``WINDOW``: один запрос по индексу geohash (см. ``PollutionPointQuerySet.near``),
+обычно пустой, поэтому создание точки почти не замедляется. Фотографии
+сравниваются только при наличии кандидатов: сначала по хешу содержимого
+(загрузки без метаданных, в таком виде она попадёт в хранилище), затем по перцептивному хешу (dHash), который у точек считается лениво и
+сохраняется в ``photo_phash``.
+
+Сообщение без новой информации (без фото или с тем же фото) сливается с
+найденной точкой: растёт ``reports_count``, описание авторизованного
+пользователя добавляется комментарием. Иначе новая точка создаётся со
+ссылкой ``duplicate_of`` на исходную.
+"""
+import datetime
+import hashlib
+from typing import NamedTuple
+
+from django.db.models import F
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from config.storage import content_hash
+
+from . import images, versions
+from .models import Comment, PollutionPoint
+
+RADIUS_M = 25
+WINDOW = datetime.timedelta(hours=6)
+OPEN_STATUSES = ('new', 'in_progress')
+MAX_CANDIDATES = 5
+# Порог расстояния Хэмминга между 64-битными dHash
+PHASH_MAX_DISTANCE = 10
+
+
+class Match(NamedTuple):
+    point: PollutionPoint
+    # True — слить с точкой, False — создать новую со ссылкой на неё
+    merge: bool
+    photo_phash: str = ''
+
+
+def dhash(file):
+    """Перцептивный хеш изображения (64 бита, hex) или '' для нечитаемого файла."""
+    try:
+        position = file.tell()
+    except (AttributeError, OSError):
+        position = None
+    try:
+        with Image.open(file) as image:
+            image.draft('L', (64, 64))
+            image = ImageOps.exif_transpose(image).convert('L').resize((9, 8), Image.Resampling.BILINEAR)
+            pixels = image.tobytes()
+    except Exception:
+        return ''
+    finally:
+        if position is not None:
+            file.seek(position)
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return f'{bits:016x}'
+
+
+def _sha256(file):
+    """SHA-256 загрузки после удаления метаданных — как у файла в хранилище (см. images.photo_uploading)."""
+    try:
+        cleaned = images.strip_metadata(file)
+    except Exception:
+        cleaned = None
+    if cleaned is not None:
+        file.seek(0)
+        return hashlib.sha256(cleaned[0]).hexdigest()
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def _point_phash(point):
+    if not point.photo_phash and point.photo:
+        try:
+            with point.photo.open('rb') as file:
+                point.photo_phash = dhash(file)
+        except OSError:
+            return ''
+        if point.photo_phash:
+            PollutionPoint.objects.filter(pk=point.pk).update(photo_phash=point.photo_phash)
+    return point.photo_phash
+
+
+def _same_photo(sha256, phash, point):
+    if not point.photo:
+        return False
+    if content_hash(point.photo.name) == sha256:
+        return True
+    other = _point_phash(point)
+    return bool(phash and other) and (int(phash, 16) ^ int(other, 16)).bit_count() <= PHASH_MAX_DISTANCE
+
+
+def candidates(pollution_type, latitude, longitude):
+    return (
+        PollutionPoint.objects
+        .filter(
+            pollution_type=pollution_type,
+            status__in=OPEN_STATUSES,
+            duplicate_of__isnull=True,
+            created_at__gte=timezone.now() - WINDOW,
+        )
+        .near(latitude, longitude, RADIUS_M)
+        .only('id', 'photo', 'photo_phash', 'created_at')
+        .order_by('distance_sq', '-created_at')[:MAX_CANDIDATES]
+    )
+
+
+def find(pollution_type, latitude, longitude, photo=None, description='', can_comment=False):
+    """Найти точку, повтором которой является сообщение, или None."""
+    points = list(candidates(pollution_type, latitude, longitude))
+    if not points:
+        return None
+    # Описание не теряется при слиянии, только если его можно сохранить комментарием
+    description_kept = not description or can_comment
+
+    if not photo:
+        return Match(points[0], merge=description_kept)
+
+    sha256 = _sha256(photo)
+    phash = dhash(photo)
+    for point in points:
+        if _same_photo(sha256, phash, point):
+            return Match(point, merge=description_kept, photo_phash=phash)
+    return Match(points[0], merge=False, photo_phash=phash)
+
+
+def merge(point, user=None, description=''):
+    """Учесть повторное сообщение в существующей точке."""
+    PollutionPoint.objects.filter(pk=point.pk).update(
+        reports_count=F('reports_count') + 1, updated_at=timezone.now()
+    )
+    versions.bump()
+    if description and user is not None and user.is_authenticated:
+        Comment.objects.create(point=point, author=user, text=description)
@@ -0,0 +1,176 @@
+"""
+Живые обновления карты через Server-Sent Events (``/api/pollutions/events/``).
+
+Изменения точек (``points_changed``) и новые комментарии превращаются в
+события ``point.created``, ``point.status_changed``, ``point.deleted``,
+``comment.created`` и после коммита раздаются подписчикам через
+внутрипроцессный ``Broker``. Подписчик — асинхронный SSE-ответ со своей
+очередью и, при ``?bbox=``, областью: события вне неё ему не отправляются.
+
+Рассылка внутри одного процесса: событие получают только клиенты,
+подключённые к процессу, в котором зафиксировано изменение. При нескольких
+процессах (или изменениях из фоновых команд) клиенты других процессов его не
+увидят, поэтому поток — подсказка для обновления, а не замена ленты
+``points/changes/``; для полной доставки нужен внешний брокер.
+
+Поток работает только под ASGI: под WSGI каждое соединение занимало бы
+рабочий поток сервера. Число одновременных подписчиков процесса ограничено
+``MAX_SUBSCRIBERS`` (``EVENTS_MAX_CONNECTIONS``).
+"""
+import asyncio
+import itertools
+import json
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import Comment
+from .signals import points_changed
+
+QUEUE_SIZE = 1000
+KEEPALIVE_SECONDS = 15
+MAX_SUBSCRIBERS = getattr(settings, 'EVENTS_MAX_CONNECTIONS', 1000)
+
+
+class Subscriber:
+    def __init__(self, loop, bbox=None):
+        self.loop = loop
+        self.bbox = bbox
+        self.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.overflowed = False
+
+    def wants(self, event):
+        if self.bbox is None:
+            return True
+        min_lon, min_lat, max_lon, max_lat = self.bbox
+        return min_lat <= event['latitude'] <= max_lat and min_lon <= event['longitude'] <= max_lon
+
+    def _put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Клиент не успевает читать: он получит resync и перечитает карту
+            self.overflowed = True
+
+
+class Broker:
+    """Раздача событий из любых потоков подписчикам в их event loop."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._ids = itertools.count(1)
+
+    def __bool__(self):
+        return bool(self._subscribers)
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    def subscribe(self, bbox=None):
+        subscriber = Subscriber(asyncio.get_running_loop(), bbox)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, events):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for event in events:
+            event = {'id': next(self._ids), **event}
+            for subscriber in subscribers:
+                if subscriber.wants(event):
+                    try:
+                        subscriber.loop.call_soon_threadsafe(subscriber._put, event)
+                    except RuntimeError:
+                        # Event loop подписчика уже закрыт
+                        self.unsubscribe(subscriber)
+
+
+broker = Broker()
+
+
+def _point_event(kind, state):
+    return {
+        'type': kind,
+        'point': state.id,
+        'latitude': state.latitude,
+        'longitude': state.longitude,
+        'pollution_type': state.pollution_type,
+        'status': state.status,
+    }
+
+
+def _visible(state):
+    return None if state is None or state.duplicate_of_id is not None else state
+
+
+def _publish_on_commit(events):
+    if events:
+        transaction.on_commit(lambda: broker.publish(events))
+
+
+@receiver(points_changed)
+def point_events(sender, changes, **kwargs):
+    if not broker:
+        return
+    events = []
+    for old, new in changes:
+        # Повторные сообщения на карте не показываются
+        old, new = _visible(old), _visible(new)
+        if old is None and new is None:
+            continue
+        if old is None:
+            events.append(_point_event('point.created', new))
+        elif new is None:
+            events.append(_point_event('point.deleted', old))
+        elif old.status != new.status:
+            events.append(_point_event('point.status_changed', new))
+    _publish_on_commit(events)
+
+
+@receiver(post_save, sender=Comment)
+def comment_event(sender, instance, created, raw=False, **kwargs):
+    if raw or not created or not broker:
+        return
+    point = instance.point
+    _publish_on_commit([{
+        'type': 'comment.created',
+        'point': point.pk,
+        'comment': instance.pk,
+        'latitude': point.latitude,
+        'longitude': point.longitude,
+    }])
+
+
+def format_event(event):
+    data = json.dumps(event, ensure_ascii=False, separators=(',', ':'))
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {data}\n\n"
+
+
+async def stream(bbox=None):
+    """Поток SSE для одного клиента; подписка снимается при отключении."""
+    subscriber = broker.subscribe(bbox)
+    try:
+        # Клиенту сразу уходит ответ: соединение установлено
+        yield 'retry: 3000\n: connected\n\n'
+        while True:
+            try:
+                event = await asyncio.wait_for(subscriber.queue.get(), KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            yield format_event(event)
+            if subscriber.overflowed:
+                yield 'event: resync\ndata: {}\n\n'
+                return
+    finally:
+        broker.unsubscribe(subscriber)
+
@@ -0,0 +1,351 @@
+"""
+Построение отчётов по точкам загрязнения.
+
+Данные читаются одним проходом по ``values()``-запросу через
+``iterator(chunk_size=...)``: ни модели, ни весь набор строк в памяти не
+держатся, сводка по дням накапливается попутно.
+
+Форматы: ``xlsx`` — человекочитаемый отчёт, ``csv``/``geojson``/``parquet`` —
+машиночитаемые выгрузки с исходными кодами полей для аналитики.
+"""
+import csv
+import datetime
+import importlib.util
+import itertools
+import json
+import tempfile
+from collections import Counter
+from typing import Callable, NamedTuple
+
+import pandas as pd
+from django.db.models import QuerySet, Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import DailyStat, PollutionPoint
+from .xlsx import StreamingWorkbook
+
+CHUNK_SIZE = 2000
+# Размер порции, которой текстовые форматы отдаются в ответ
+BUFFER_SIZE = 64 * 1024
+
+REPORT_COLUMNS = [
+    'Дата создания',
+    'Тип загрязнения',
+    'Описание',
+    'Широта',
+    'Долгота',
+    'Статус',
+    'Организация',
+    'Дата начала работ',
+    'Дата очистки',
+    'Автор',
+]
+SUMMARY_COLUMNS = ['Дата создания', 'Статус', 'Количество']
+
+REPORT_FIELDS = [
+    'created_at',
+    'pollution_type',
+    'description',
+    'latitude',
+    'longitude',
+    'status',
+    'handled_by__name',
+    'started_at',
+    'cleaned_at',
+    'reporter__username',
+    'anonymous_name',
+]
+
+# Колонки машиночитаемых форматов: (имя колонки, поле values_list)
+DATA_COLUMNS = [
+    ('id', 'id'),
+    ('created_at', 'created_at'),
+    ('pollution_type', 'pollution_type'),
+    ('status', 'status'),
+    ('description', 'description'),
+    ('latitude', 'latitude'),
+    ('longitude', 'longitude'),
+    ('organization_id', 'handled_by_id'),
+    ('organization', 'handled_by__name'),
+    ('reporter', 'reporter__username'),
+    ('anonymous_name', 'anonymous_name'),
+    ('started_at', 'started_at'),
+    ('cleaned_at', 'cleaned_at'),
+]
+DATA_NAMES = [name for name, _ in DATA_COLUMNS]
+DATETIME_NAMES = ['created_at', 'started_at', 'cleaned_at']
+
+TYPE_LABELS = dict(PollutionPoint.TYPE_CHOICES)
+STATUS_LABELS = dict(PollutionPoint.STATUS_CHOICES)
+
+
+PERIODS = ('today', 'week', 'month', 'year')
+
+
+def period_start(period):
+    """Начало периода отчёта (полночь в текущем часовом поясе)."""
+    today = timezone.localdate()
+    if period == 'today':
+        start = today
+    elif period == 'week':
+        start = today - datetime.timedelta(days=7)
+    elif period == 'month':
+        start = today.replace(day=1)
+    elif period == 'year':
+        start = today.replace(month=1, day=1)
+    else:
+        raise ValueError(f"Unknown period: {period}")
+    return _midnight(start)
+
+
+def _midnight(day):
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+
+def _as_datetime(value):
+    if isinstance(value, str):
+        value = parse_datetime(value)
+    return value
+
+
+def filename(params, suffix=''):
+    name = 'custom' if params.get('from') or params.get('to') else params.get('period', 'today')
+    return f"pollution_report_{name}{suffix}.{FORMATS[params['format']].extension}"
+
+
+class ExportQuery(NamedTuple):
+    """Выборка отчёта: точки и, если фильтры это позволяют, строки DailyStat той же выборки."""
+    points: QuerySet
+    stats: QuerySet | None = None
+
+
+def build_query(params):
+    """
+    Выборка по нормализованным параметрам ExportParamsSerializer.
+
+    Интервал дат переводится в диапазон ``created_at >= start AND created_at < end``
+    без приведения колонки к дате, поэтому используется индекс по ``created_at``.
+    """
+    start = _as_datetime(params.get('from'))
+    end = _as_datetime(params.get('to'))
+    if start is None and end is None:
+        start = period_start(params.get('period', 'today'))
+
+    points = PollutionPoint.objects.all()
+    stats = DailyStat.objects.all()
+    if start is not None:
+        points = points.filter(created_at__gte=start)
+    if end is not None:
+        points = points.filter(created_at__lt=end)
+
+    # Статистика по дням подходит, только если границы интервала — полночь
+    for bound, lookup in ((start, 'day__gte'), (end, 'day__lt')):
+        if bound is None or stats is None:
+            continue
+        local = timezone.localtime(bound)
+        if local.time() == datetime.time.min:
+            stats = stats.filter(**{lookup: local.date()})
+        else:
+            stats = None
+
+    # Поля фильтров совпадают у PollutionPoint и DailyStat
+    for name, lookup in (('pollution_type', 'pollution_type__in'), ('status', 'status__in'),
+                         ('handled_by', 'handled_by_id')):
+        value = params.get(name)
+        if not value:
+            continue
+        points = points.filter(**{lookup: value})
+        if stats is not None:
+            stats = stats.filter(**{lookup: value})
+
+    if params.get('bbox'):
+        points = points.in_bbox(*params['bbox'])
+        stats = None
+    return ExportQuery(points=points, stats=stats)
+
+
+def _date(value):
+    return value.strftime('%Y-%m-%d') if value else ''
+
+
+def report_rows(queryset):
+    """Строки отчёта (значения в порядке ``REPORT_COLUMNS``)."""
+    rows = queryset.order_by('created_at', 'id').values_list(*REPORT_FIELDS)
+    for (created_at, pollution_type, description, latitude, longitude, status, organization,
+         started_at, cleaned_at, username, anonymous_name) in rows.iterator(chunk_size=CHUNK_SIZE):
+        yield (
+            _date(created_at),
+            TYPE_LABELS.get(pollution_type, pollution_type),
+            description or '',
+            latitude,
+            longitude,
+            STATUS_LABELS.get(status, status),
+            organization or '',
+            _date(started_at) if status in ('in_progress', 'cleaned') else '',
+            _date(cleaned_at) if status == 'cleaned' else '',
+            username or anonymous_name or 'Аноним',
+        )
+
+
+def daily_summary(stats):
+    """Сводка «По дням» из предрасчитанной статистики: {(дата, статус): количество}."""
+    summary = Counter()
+    for day, status, count in stats.values('day', 'status').annotate(total=Sum('count')).values_list(
+        'day', 'status', 'total'
+    ):
+        if count:
+            summary[(_date(day), STATUS_LABELS.get(status, status))] += count
+    return summary
+
+
+def xlsx_report(query):
+    """Excel-отчёт: лист «Детали» и сводка «По дням». Генератор байтов файла."""
+    workbook = StreamingWorkbook()
+    details = workbook.add_sheet('Детали', REPORT_COLUMNS)
+    if query.stats is not None:
+        summary = daily_summary(query.stats)
+        for row in report_rows(query.points):
+            details.append(row)
+    else:
+        summary = Counter()
+        for row in report_rows(query.points):
+            details.append(row)
+            summary[(row[0], row[5])] += 1
+
+    by_day = workbook.add_sheet('По дням', SUMMARY_COLUMNS)
+    for (day, status), count in sorted(summary.items()):
+        by_day.append((day, status, count))
+
+    yield from workbook.iter_bytes()
+
+
+def data_rows(queryset):
+    """Строки машиночитаемой выгрузки (значения в порядке ``DATA_COLUMNS``)."""
+    rows = queryset.order_by('created_at', 'id').values_list(*(field for _, field in DATA_COLUMNS))
+    return rows.iterator(chunk_size=CHUNK_SIZE)
+
+
+def _buffered(parts):
+    """Склеить мелкие строки в порции ~``BUFFER_SIZE`` байт."""
+    buffer = []
+    size = 0
+    for part in parts:
+        data = part.encode('utf-8')
+        buffer.append(data)
+        size += len(data)
+        if size >= BUFFER_SIZE:
+            yield b''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+class _Echo:
+    """Псевдофайл для csv.writer: writerow возвращает готовую строку."""
+
+    def write(self, value):
+        return value
+
+
+def _iso(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def csv_export(query):
+    writer = csv.writer(_Echo())
+
+    def lines():
+        yield writer.writerow(DATA_NAMES)
+        for row in data_rows(query.points):
+            yield writer.writerow([_iso(value) for value in row])
+
+    yield from _buffered(lines())
+
+
+def geojson_export(query):
+    def parts():
+        yield '{"type":"FeatureCollection","features":['
+        separator = ''
+        for row in data_rows(query.points):
+            properties = {name: _iso(value) for name, value in zip(DATA_NAMES, row)}
+            feature = {
+                'type': 'Feature',
+                'id': properties['id'],
+                'geometry': {
+                    'type': 'Point',
+                    'coordinates': [properties.pop('longitude'), properties.pop('latitude')],
+                },
+                'properties': properties,
+            }
+            yield separator + json.dumps(feature, ensure_ascii=False, separators=(',', ':'))
+            separator = ','
+        yield ']}'
+
+    yield from _buffered(parts())
+
+
+def parquet_available():
+    return importlib.util.find_spec('pyarrow') is not None
+
+
+def parquet_export(query):
+    """
+    Parquet пишется группами строк по ``CHUNK_SIZE``: каждая порция
+    превращается в колонки (DataFrame -> Arrow) целиком, без поэлементной
+    обработки, память ограничена одной порцией.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ('id', pa.int64()),
+        ('created_at', pa.timestamp('us', tz='UTC')),
+        ('pollution_type', pa.string()),
+        ('status', pa.string()),
+        ('description', pa.string()),
+        ('latitude', pa.float64()),
+        ('longitude', pa.float64()),
+        ('organization_id', pa.int64()),
+        ('organization', pa.string()),
+        ('reporter', pa.string()),
+        ('anonymous_name', pa.string()),
+        ('started_at', pa.timestamp('us', tz='UTC')),
+        ('cleaned_at', pa.timestamp('us', tz='UTC')),
+    ])
+
+    with tempfile.TemporaryFile() as output:
+        with pq.ParquetWriter(output, schema, compression='snappy') as writer:
+            rows = data_rows(query.points)
+            while True:
+                chunk = list(itertools.islice(rows, CHUNK_SIZE))
+                if not chunk:
+                    break
+                frame = pd.DataFrame.from_records(chunk, columns=DATA_NAMES)
+                for name in DATETIME_NAMES:
+                    frame[name] = pd.to_datetime(frame[name], utc=True)
+                writer.write_table(pa.Table.from_pandas(frame, schema=schema, preserve_index=False))
+
+        output.seek(0)
+        while True:
+            data = output.read(BUFFER_SIZE)
+            if not data:
+                break
+            yield data
+
+
+class ExportFormat(NamedTuple):
+    build: Callable
+    content_type: str
+    extension: str
+
+
+FORMATS = {
+    'xlsx': ExportFormat(
+        xlsx_report, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'
+    ),
+    'csv': ExportFormat(csv_export, 'text/csv; charset=utf-8', 'csv'),
+    'geojson': ExportFormat(geojson_export, 'application/geo+json', 'geojson'),
+    'parquet': ExportFormat(parquet_export, 'application/vnd.apache.parquet', 'parquet'),
+}
@@ -0,0 +1,122 @@
+"""
+Геопространственные утилиты: geohash, покрытие прямоугольника ячейками,
+расстояния на сфере.
+
+Geohash хранится в индексируемой колонке ``PollutionPoint.geohash``. Точки,
+лежащие рядом, имеют общий префикс, поэтому запрос по прямоугольнику
+сводится к нескольким диапазонным условиям ``geohash >= prefix AND
+geohash < prefix + '~'`` по B-tree индексу вместо полного сканирования.
+"""
+import math
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 12
+EARTH_RADIUS_M = 6371008.8
+
+# Максимальное число ячеек, которыми покрывается прямоугольник запроса.
+MAX_COVER_CELLS = 32
+
+
+def encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    """Geohash точки с заданной длиной."""
+    lat_lo, lat_hi = -90.0, 90.0
+    lon_lo, lon_hi = -180.0, 180.0
+    chars = []
+    bit = 0
+    ch = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_lo + lon_hi) / 2
+            if longitude >= mid:
+                ch = (ch << 1) | 1
+                lon_lo = mid
+            else:
+                ch <<= 1
+                lon_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if latitude >= mid:
+                ch = (ch << 1) | 1
+                lat_lo = mid
+            else:
+                ch <<= 1
+                lat_hi = mid
+        even = not even
+        bit += 1
+        if bit == 5:
+            chars.append(BASE32[ch])
+            bit = 0
+            ch = 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """Размер ячейки geohash в градусах: (высота по широте, ширина по долготе)."""
+    bits = precision * 5
+    lon_bits = (bits + 1) // 2
+    lat_bits = bits // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lon_bits)
+
+
+def cover(min_lon, min_lat, max_lon, max_lat, max_cells=MAX_COVER_CELLS):
+    """
+    Набор префиксов geohash, ячейки которых покрывают прямоугольник.
+
+    Выбирается самая мелкая точность, при которой число ячеек не превышает
+    ``max_cells``. Пустой список означает, что прямоугольник покрывает
+    заметную часть земного шара и фильтровать по индексу не имеет смысла.
+    """
+    best = []
+    for precision in range(1, GEOHASH_PRECISION + 1):
+        lat_step, lon_step = cell_size(precision)
+        rows = math.floor((max_lat + 90.0) / lat_step) - math.floor((min_lat + 90.0) / lat_step) + 1
+        cols = math.floor((max_lon + 180.0) / lon_step) - math.floor((min_lon + 180.0) / lon_step) + 1
+        if rows * cols > max_cells:
+            break
+        best = _cells(min_lon, min_lat, max_lon, max_lat, precision)
+    return best
+
+
+def _cells(min_lon, min_lat, max_lon, max_lat, precision):
+    lat_step, lon_step = cell_size(precision)
+    cells = set()
+    lat = min_lat
+    while True:
+        lon = min_lon
+        while True:
+            cells.add(encode(lat, lon, precision))
+            if lon >= max_lon:
+                break
+            lon = min(lon + lon_step, max_lon)
+        if lat >= max_lat:
+            break
+        lat = min(lat + lat_step, max_lat)
+    return sorted(cells)
+
+
+def prefix_range(prefix):
+    """Полуинтервал [lo, hi) значений geohash, начинающихся с ``prefix``."""
+    return prefix, prefix + '~'
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """Расстояние между двумя точками в метрах."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def radius_bbox(latitude, longitude, radius_m):
+    """Прямоугольник (min_lon, min_lat, max_lon, max_lat), описанный вокруг круга."""
+    dlat = math.degrees(radius_m / EARTH_RADIUS_M)
+    cos_lat = max(math.cos(math.radians(latitude)), 1e-6)
+    dlon = min(180.0, math.degrees(radius_m / (EARTH_RADIUS_M * cos_lat)))
+    return (
+        max(-180.0, longitude - dlon),
+        max(-90.0, latitude - dlat),
+        min(180.0, longitude + dlon),
+        min(90.0, latitude + dlat),
+    )
@@ -0,0 +1,128 @@
+"""
+Слой плотности загрязнений (``points/heatmap/``).
+
+Точки в области попадают в регулярную сетку ``cell_size`` градусов:
+координаты одной выборкой ``values_list`` переводятся в массивы NumPy и
+раскладываются по ячейкам ``histogram2d``. При ``half_life_days`` вклад
+точки убывает вдвое за каждый такой срок от даты создания.
+
+Область выравнивается по сетке, поэтому при сдвиге карты на целое число
+ячеек ответ совпадает и берётся из кеша. Ключ кеша включает версию данных
+(``pollution.versions``): новое сообщение делает старые сетки недоступными.
+Сетки с затуханием дополнительно пересчитываются раз в час.
+
+Ответ разреженный: номера непустых ячеек (построчно, первая строка — северная)
+и значения в них.
+"""
+import datetime
+import hashlib
+import json
+import math
+
+import numpy as np
+from django.core.cache import cache
+from django.db.models import DateTimeField, DurationField, ExpressionWrapper, F, Value
+from django.utils import timezone
+
+from . import versions
+from .models import PollutionPoint
+
+# Ячеек по большей стороне, если cell_size не задан
+DEFAULT_CELLS = 128
+MAX_CELLS = 256 * 256
+MIN_CELL_SIZE = 0.0001
+CACHE_TIMEOUT = 10 * 60
+DECAY_BUCKET = datetime.timedelta(hours=1)
+EPSILON = 1e-9
+
+
+class GridTooLarge(ValueError):
+    pass
+
+
+def default_cell_size(bbox):
+    """Размер ячейки из ряда 360 / 2^n, при котором по большей стороне не больше DEFAULT_CELLS ячеек."""
+    min_lon, min_lat, max_lon, max_lat = bbox
+    span = max(max_lon - min_lon, max_lat - min_lat)
+    cell_size = 360.0
+    while cell_size / 2 >= MIN_CELL_SIZE and span / (cell_size / 2) <= DEFAULT_CELLS:
+        cell_size /= 2
+    return cell_size
+
+
+def align(bbox, cell_size):
+    """Область, расширенная до границ ячеек, и размер сетки (строк, столбцов)."""
+    min_lon, min_lat, max_lon, max_lat = bbox
+    # Допуск на ошибку округления: 43.2 / 0.05 не должно давать лишнюю ячейку
+    west = max(-180.0, math.floor(min_lon / cell_size + EPSILON) * cell_size)
+    south = max(-90.0, math.floor(min_lat / cell_size + EPSILON) * cell_size)
+    cols = max(1, math.ceil((max_lon - west) / cell_size - EPSILON))
+    rows = max(1, math.ceil((max_lat - south) / cell_size - EPSILON))
+    if rows * cols > MAX_CELLS:
+        raise GridTooLarge(f"Слишком мелкая сетка для области: больше {MAX_CELLS} ячеек, увеличьте cell_size.")
+    aligned = (west, south, west + cols * cell_size, south + rows * cell_size)
+    return tuple(round(value, 10) for value in aligned), rows, cols
+
+
+def heatmap(bbox, cell_size=None, types=(), statuses=(), half_life_days=None):
+    cell_size = cell_size or default_cell_size(bbox)
+    aligned, rows, cols = align(bbox, cell_size)
+    now = None
+    if half_life_days:
+        now = timezone.now()
+        now -= datetime.timedelta(seconds=now.timestamp() % DECAY_BUCKET.total_seconds())
+
+    version, _ = versions.current()
+    raw = json.dumps([aligned, cell_size, sorted(types), sorted(statuses), half_life_days, now and now.isoformat()])
+    key = f'heatmap:{hashlib.sha1(raw.encode()).hexdigest()}:{version}'
+    result = cache.get(key)
+    if result is None:
+        result = compute(aligned, rows, cols, types, statuses, half_life_days, now)
+        result['cell_size'] = cell_size
+        cache.set(key, result, CACHE_TIMEOUT)
+    return result
+
+
+def compute(aligned, rows, cols, types=(), statuses=(), half_life_days=None, now=None):
+    west, south, east, north = aligned
+    points = PollutionPoint.objects.filter(duplicate_of__isnull=True).in_bbox(*aligned)
+    if types:
+        points = points.filter(pollution_type__in=types)
+    if statuses:
+        points = points.filter(status__in=statuses)
+
+    fields = ['latitude', 'longitude']
+    if half_life_days:
+        points = points.annotate(age=ExpressionWrapper(
+            Value(now, output_field=DateTimeField()) - F('created_at'), output_field=DurationField()
+        ))
+        fields.append('age')
+    data = list(points.order_by().values_list(*fields))
+
+    weights = None
+    if data and half_life_days:
+        latitude, longitude, age = zip(*data)
+        days = np.array(age, dtype='timedelta64[s]').astype(float) / 86400
+        weights = np.power(0.5, np.clip(days, 0, None) / half_life_days)
+        coordinates = np.column_stack([latitude, longitude])
+    else:
+        coordinates = np.array(data, dtype=float).reshape(-1, 2)
+
+    grid, _, _ = np.histogram2d(
+        coordinates[:, 0], coordinates[:, 1],
+        bins=[rows, cols], range=[[south, north], [west, east]], weights=weights,
+    )
+    # Первая строка — северная, как у растра
+    flat = grid[::-1].ravel()
+    indices = np.flatnonzero(flat)
+    values = flat[indices]
+    values = values.astype(int).tolist() if weights is None else np.round(values, 3).tolist()
+    return {
+        'bbox': list(aligned),
+        'rows': rows,
+        'cols': cols,
+        'total': len(data),
+        'max': max(values, default=0),
+        'indices': indices.tolist(),
+        'values': values,
+    }
@@ -0,0 +1,409 @@
+"""
+Обработка загруженных фотографий.
+
+После сохранения модели с новым фото (``PollutionPoint.photo``,
+``Comment.photo``, ``User.photo``) в фоновом пуле (см. ``jobs.submit``)
+строятся уменьшенные варианты без EXIF. Их пути записываются в
+``photo_variants`` вместе с именем исходного файла (ключ ``source``), по
+которому видно, для какого фото они построены. Запрос на создание при этом
+не ждёт декодирования изображения.
+
+Фото без вариантов стоит в очереди ``PhotoJob``, пока их не построят.
+Неудачная попытка откладывает следующую (``RETRY_DELAY``, удваивается), после
+``MAX_ATTEMPTS`` попыток задача остаётся в таблице с текстом ошибки.
+
+Ссылка на прежний файл (см. config.storage) освобождается после коммита,
+когда фото заменяют или убирают любым сохранением модели.
+
+Из самого загруженного файла EXIF и XMP (в них бывают координаты съёмки)
+удаляются до записи в хранилище. JPEG и PNG при этом не перекодируются,
+ориентация остаётся в EXIF; остальные форматы пересохраняются.
+
+Задачи выполняет фоновый пул веб-процесса (``BACKGROUND_WORKERS``) и
+``manage.py process_photos``; при ``BACKGROUND_WORKERS=0`` — только он.
+"""
+import datetime
+import io
+import logging
+import os
+import zlib
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils import timezone
+from django.db.models.signals import post_delete, post_save, pre_save
+from PIL import Image, ImageOps, features
+
+from . import jobs, versions
+from .models import PhotoJob
+
+logger = logging.getLogger(__name__)
+
+# Имя варианта -> максимальная сторона в пикселях
+VARIANTS = {
+    'thumb': 256,
+    'medium': 1024,
+    'full': 2048,
+}
+VARIANT_FORMAT = 'WEBP' if features.check('webp') else 'JPEG'
+VARIANT_EXTENSION = '.webp' if VARIANT_FORMAT == 'WEBP' else '.jpg'
+VARIANT_QUALITY = 82
+
+MAX_ATTEMPTS = 5
+RETRY_DELAY = datetime.timedelta(minutes=1)
+
+PHOTO_MODELS = ('pollution.PollutionPoint', 'pollution.Comment', settings.AUTH_USER_MODEL)
+
+_GPS_IFD = 0x8825
+_ORIENTATION = 0x0112
+# Формат загрузки -> формат копии без метаданных; остальные сохраняются в PNG
+CLEAN_FORMATS = {'JPEG': 'JPEG', 'MPO': 'JPEG', 'PNG': 'PNG', 'WEBP': 'WEBP'}
+CLEAN_EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp'}
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def _degrees(dms, ref):
+    degrees, minutes, seconds = (float(x) for x in dms)
+    value = degrees + minutes / 60 + seconds / 3600
+    return -value if ref in ('S', 'W') else value
+
+
+def gps_from_exif(file):
+    """
+    Координаты (latitude, longitude) из EXIF GPS или None. Читается только
+    заголовок файла, пиксели не декодируются.
+    """
+    try:
+        position = file.tell()
+    except (AttributeError, OSError):
+        position = None
+    try:
+        with Image.open(file) as image:
+            gps = image.getexif().get_ifd(_GPS_IFD)
+        if not gps or 2 not in gps or 4 not in gps:
+            return None
+        latitude = _degrees(gps[2], gps.get(1, 'N'))
+        longitude = _degrees(gps[4], gps.get(3, 'E'))
+    except Exception:
+        return None
+    finally:
+        if position is not None:
+            file.seek(position)
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return None
+    return latitude, longitude
+
+
+def _has_metadata(image):
+    return bool(image.getexif()) or any(key in image.info for key in ('exif', 'xmp', 'XML:com.adobe.xmp'))
+
+
+def _orientation(exif_data):
+    """Ориентация из EXIF, если она отличается от обычной, иначе None."""
+    exif = Image.Exif()
+    try:
+        exif.load(exif_data)
+        orientation = exif.get(_ORIENTATION)
+    except Exception:
+        return None
+    return orientation if orientation in range(2, 9) else None
+
+
+def _orientation_exif(orientation):
+    """EXIF только с ориентацией, как в сегменте APP1."""
+    exif = Image.Exif()
+    exif[_ORIENTATION] = orientation
+    return exif.tobytes()
+
+
+def _strip_jpeg(data):
+    """
+    JPEG без сегментов EXIF, XMP, IPTC и дополнительных кадров MPO. Сжатые
+    данные копируются как есть; ориентация остаётся в минимальном EXIF.
+    """
+    parts = [data[:2]]
+    position = 2
+    exif_written = False
+    while True:
+        if data[position] != 0xFF:
+            # Сжатые данные скана: 0xFF в них встречается только перед 0x00 и RSTn
+            end = data.index(b'\xff', position)
+            parts.append(data[position:end])
+            position = end
+            continue
+        marker = data[position + 1]
+        if marker == 0xFF:
+            position += 1
+            continue
+        if marker in (0x00, 0x01) or 0xD0 <= marker <= 0xD7:
+            parts.append(data[position:position + 2])
+            position += 2
+            continue
+        if marker == 0xD9:
+            # Всё после конца первого кадра (кадры MPO, приложенное видео) отбрасывается
+            parts.append(data[position:position + 2])
+            break
+        length = int.from_bytes(data[position + 2:position + 4], 'big')
+        segment = data[position:position + 2 + length]
+        if len(segment) < 4 or len(segment) != 2 + length:
+            raise ValueError("Truncated JPEG segment")
+        position += 2 + length
+        payload = segment[4:]
+        if marker == 0xE1 and payload.startswith(b'Exif\x00\x00'):
+            orientation = None if exif_written else _orientation(payload)
+            if orientation:
+                exif = _orientation_exif(orientation)
+                parts.append(b'\xff\xe1' + (len(exif) + 2).to_bytes(2, 'big') + exif)
+                exif_written = True
+        elif marker in (0xE1, 0xED) or (marker == 0xE2 and payload.startswith(b'MPF\x00')):
+            continue
+        else:
+            parts.append(segment)
+    return b''.join(parts)
+
+
+def _strip_png(data):
+    """PNG без eXIf и текстовых чанков (XMP, сырой EXIF); ориентация остаётся в минимальном eXIf."""
+    parts = [data[:len(_PNG_SIGNATURE)]]
+    position = len(_PNG_SIGNATURE)
+    while True:
+        length = int.from_bytes(data[position:position + 4], 'big')
+        kind = data[position + 4:position + 8]
+        chunk = data[position:position + 12 + length]
+        if len(chunk) != 12 + length:
+            raise ValueError("Truncated PNG chunk")
+        position += 12 + length
+        if kind == b'eXIf':
+            orientation = _orientation(chunk[8:-4])
+            if orientation:
+                body = b'eXIf' + _orientation_exif(orientation)[6:]
+                parts.append((len(body) - 4).to_bytes(4, 'big') + body + zlib.crc32(body).to_bytes(4, 'big'))
+        elif kind not in (b'tEXt', b'zTXt', b'iTXt'):
+            parts.append(chunk)
+        if kind == b'IEND':
+            return b''.join(parts)
+
+
+def _reencode(file):
+    """Копия без метаданных через декодирование; для форматов кроме JPEG и PNG."""
+    file.seek(0)
+    with Image.open(file) as image:
+        if not _has_metadata(image):
+            return None
+        target = CLEAN_FORMATS.get(image.format, 'PNG')
+        options = {}
+        if image.info.get('icc_profile'):
+            options['icc_profile'] = image.info['icc_profile']
+        image = ImageOps.exif_transpose(image)
+        if target == 'JPEG':
+            options['quality'] = 95
+            if image.mode not in ('RGB', 'L', 'CMYK'):
+                image = image.convert('RGB')
+        elif target == 'WEBP':
+            options['quality'] = 95
+        buffer = io.BytesIO()
+        image.save(buffer, target, **options)
+    return buffer.getvalue(), CLEAN_EXTENSIONS[target]
+
+
+def strip_metadata(file):
+    """
+    Байты и расширение копии изображения без EXIF/XMP или None, если
+    метаданных нет. JPEG и PNG не декодируются: из них вырезаются сегменты
+    с метаданными. Остальные форматы пересохраняются с применённой ориентацией.
+    """
+    file.seek(0)
+    data = file.read()
+    try:
+        if data.startswith(b'\xff\xd8'):
+            cleaned, extension = _strip_jpeg(data), '.jpg'
+        elif data.startswith(_PNG_SIGNATURE):
+            cleaned, extension = _strip_png(data), '.png'
+        else:
+            return _reencode(file)
+    except (IndexError, ValueError):
+        # Структура не разобрана (обрезанный файл и т. п.): пересохранение
+        return _reencode(file)
+    return None if cleaned == data else (cleaned, extension)
+
+
+def render_variants(source):
+    """Варианты изображения: {имя: байты}. EXIF не переносится, ориентация применяется."""
+    with Image.open(source) as image:
+        # Для JPEG декодирование сразу в уменьшенном масштабе
+        image.draft('RGB', (max(VARIANTS.values()),) * 2)
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        result = {}
+        for name, size in sorted(VARIANTS.items(), key=lambda item: -item[1]):
+            image.thumbnail((size, size), Image.Resampling.LANCZOS)
+            buffer = io.BytesIO()
+            image.save(buffer, VARIANT_FORMAT, quality=VARIANT_QUALITY)
+            result[name] = buffer.getvalue()
+    return result
+
+
+def process_photo(model_label, pk, field_name='photo'):
+    """Построить варианты фото объекта и сохранить их пути в ``photo_variants``."""
+    model = apps.get_model(model_label)
+    instance = model.objects.filter(pk=pk).only(field_name, 'photo_variants').first()
+    field_file = getattr(instance, field_name, None)
+    if not field_file:
+        _queued(model, pk).delete()
+        return
+    source_name = field_file.name
+    if instance.photo_variants.get('source') == source_name:
+        _queued(model, pk).filter(source=source_name).delete()
+        return
+
+    storage = field_file.storage
+    stem = os.path.splitext(source_name)[0]
+    with storage.open(source_name, 'rb') as source:
+        rendered = render_variants(source)
+    variants = {'source': source_name}
+    for name, data in rendered.items():
+        variants[name] = storage.save(f'{stem}_{name}{VARIANT_EXTENSION}', ContentFile(data))
+
+    with transaction.atomic():
+        # Фото могли заменить, пока строились варианты
+        current = (
+            model.objects.select_for_update()
+            .filter(pk=pk, **{field_name: source_name})
+            .values_list('photo_variants', flat=True)
+            .first()
+        )
+        if current is not None:
+            model.objects.filter(pk=pk).update(photo_variants=variants, **_touched(model))
+            versions.bump_object(model, pk)
+        _queued(model, pk).filter(source=source_name).delete()
+    # Освобождаются прежние варианты или, если фото заменили, только что построенные
+    release_variants(storage, variants if current is None else current)
+
+
+def _touched(model):
+    """update() не трогает auto_now: ссылки на варианты — видимое клиенту изменение (см. pollution.sync)."""
+    names = {field.name for field in model._meta.concrete_fields}
+    return {'updated_at': timezone.now()} if 'updated_at' in names else {}
+
+
+def release_variants(storage, variants):
+    for name, path in (variants or {}).items():
+        if name != 'source':
+            storage.delete(path)
+
+
+def _queued(model, pk):
+    return PhotoJob.objects.filter(model_label=model._meta.label, object_id=pk)
+
+
+def enqueue(model, pk, source):
+    """Поставить фото в очередь; задача по прежнему фото объекта заменяется."""
+    PhotoJob.objects.update_or_create(
+        model_label=model._meta.label, object_id=pk,
+        defaults={'source': source, 'attempts': 0, 'error': '', 'retry_at': timezone.now()},
+    )
+
+
+def process_pending(now=None):
+    """Построить варианты для фото из очереди, срок попытки которых подошёл; возвращает их число."""
+    now = now or timezone.now()
+    queue = (
+        PhotoJob.objects
+        .filter(attempts__lt=MAX_ATTEMPTS, retry_at__lte=now)
+        .order_by('retry_at', 'id')
+    )
+    done = 0
+    for job in list(queue):
+        try:
+            process_photo(job.model_label, job.object_id)
+        except Exception as exc:
+            logger.exception("Photo processing failed for %s %s", job.model_label, job.object_id)
+            # Фото могли заменить: тогда задача уже поставлена заново
+            PhotoJob.objects.filter(pk=job.pk, source=job.source, attempts=job.attempts).update(
+                attempts=job.attempts + 1, error=str(exc),
+                retry_at=timezone.now() + RETRY_DELAY * 2 ** job.attempts,
+            )
+            continue
+        done += 1
+    return done
+
+
+def photo_uploading(sender, instance, raw=False, **kwargs):
+    """Убрать метаданные из нового фото до записи в хранилище."""
+    photo = instance.photo
+    if raw or not photo or photo._committed:
+        return
+    try:
+        cleaned = strip_metadata(photo.file)
+    except Exception:
+        # Файл уже проверен ImageField; непрочитанный формат сохраняется как есть
+        logger.exception("Cannot strip metadata from %s", photo.name)
+        return
+    if cleaned is not None:
+        data, extension = cleaned
+        stem = os.path.splitext(os.path.basename(photo.name))[0]
+        instance.photo = ContentFile(data, name=f'{stem}{extension}')
+
+
+def photo_replacing(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Запомнить имя прежнего фото, если его заменяют или убирают."""
+    instance._replaced_photo = None
+    if raw or instance._state.adding or (update_fields is not None and 'photo' not in update_fields):
+        return
+    photo = instance.photo
+    # Новый файл ещё не сохранён в хранилище; сохранённый — то же фото
+    if photo and photo._committed:
+        return
+    old_name = sender.objects.filter(pk=instance.pk).values_list('photo', flat=True).first()
+    if old_name and old_name != photo.name:
+        instance._replaced_photo = old_name
+
+
+def photo_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    replaced = getattr(instance, '_replaced_photo', None)
+    if replaced:
+        instance._replaced_photo = None
+        storage = instance.photo.storage
+        # Ссылка на прежний файл освобождается, только если сохранение зафиксировано
+        transaction.on_commit(lambda: storage.delete(replaced))
+    variants = instance.photo_variants or {}
+    name = instance.photo.name if instance.photo else ''
+    if variants.get('source', '') == name:
+        return
+    if not name:
+        sender.objects.filter(pk=instance.pk).update(photo_variants={}, **_touched(sender))
+        versions.bump_object(sender, instance.pk)
+        release_variants(instance.photo.storage, variants)
+        instance.photo_variants = {}
+        _queued(sender, instance.pk).delete()
+        return
+    enqueue(sender, instance.pk, name)
+    jobs.submit(process_photo, sender._meta.label, instance.pk)
+
+
+def photo_deleted(sender, instance, **kwargs):
+    """Освободить ссылки на фото и его варианты (файл удаляется с последней ссылкой)."""
+    storage = instance.photo.storage
+    name = instance.photo.name if instance.photo else ''
+    _queued(sender, instance.pk).delete()
+
+    def release():
+        if name:
+            storage.delete(name)
+        release_variants(storage, instance.photo_variants)
+
+    transaction.on_commit(release)
+
+
+def connect():
+    for label in PHOTO_MODELS:
+        model = apps.get_model(label)
+        pre_save.connect(photo_uploading, sender=model, dispatch_uid=f'photo_uploading:{label}')
+        pre_save.connect(photo_replacing, sender=model, dispatch_uid=f'photo_replacing:{label}')
+        post_save.connect(photo_saved, sender=model, dispatch_uid=f'photo_variants:{label}')
+        post_delete.connect(photo_deleted, sender=model, dispatch_uid=f'photo_release:{label}')
@@ -0,0 +1,254 @@
+"""
+Массовая загрузка точек от организаций-партнёров (``points/bulk/``).
+
+Вход — JSON Lines, CSV или GeoJSON. Строки разбираются потоком, проверяются
+сериализатором порциями по ``CHUNK_SIZE`` и пишутся ``bulk_create`` — одна
+транзакция на порцию, поэтому ошибка в одной порции не откатывает уже
+записанные. Для каждой строки с ошибкой в ответ попадает её номер и текст.
+
+Строка не в UTF-8 — ошибка этой строки; в CSV после неё (и после ошибки
+разбора, например незакрытой кавычки) файл дальше не читается, уже
+разобранные строки записываются.
+
+Повторная загрузка не создаёт дублей: у строки может быть ключ ``key``
+(иначе он строится из заголовка ``Idempotency-Key`` и номера строки), а
+пара (автор, ключ) уникальна. Уже загруженные строки пропускаются.
+Слишком длинный Idempotency-Key заменяется его SHA-256.
+
+``bulk_create`` не вызывает ``save()`` и сигналы модели, поэтому geohash
+считается здесь же, а ``points_changed`` отправляется вручную.
+"""
+import codecs
+import csv
+import hashlib
+import json
+
+from django.db import IntegrityError, transaction
+
+from . import geo
+from .models import PollutionPoint
+from .serializers import BulkPointSerializer
+from .signals import points_changed
+
+CHUNK_SIZE = 500
+MAX_ROWS = 10000
+# Сколько раз перепроверять ключи после гонки с параллельной загрузкой
+WRITE_ATTEMPTS = 3
+# Длина SHA-256 в hex: длиннее заголовок Idempotency-Key заменяется хешем
+MAX_KEY_PREFIX = 64
+
+CONTENT_TYPES = {
+    'application/x-ndjson': 'jsonl',
+    'application/jsonl': 'jsonl',
+    'application/x-jsonlines': 'jsonl',
+    'text/csv': 'csv',
+    'application/geo+json': 'geojson',
+    'application/json': 'geojson',
+}
+
+
+class IngestError(Exception):
+    """Файл целиком не может быть разобран."""
+
+
+def detect_format(content_type, filename=''):
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    if content_type in CONTENT_TYPES:
+        return CONTENT_TYPES[content_type]
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    if extension in ('jsonl', 'ndjson'):
+        return 'jsonl'
+    if extension in ('csv', 'geojson'):
+        return extension
+    if extension == 'json':
+        return 'geojson'
+    return None
+
+
+def _error(message):
+    return {'non_field_errors': [message]}
+
+
+def _text(stream):
+    return codecs.getreader('utf-8-sig')(stream)
+
+
+def _decode(line, number):
+    # Строки декодируются по одной, чтобы ошибка кодировки была ошибкой строки;
+    # BOM допустим только в начале файла
+    return line.decode('utf-8-sig' if number == 1 else 'utf-8')
+
+
+def read_jsonl(stream):
+    for number, line in enumerate(stream, start=1):
+        try:
+            line = _decode(line, number)
+        except UnicodeDecodeError:
+            yield number, None, _error("Строка не в кодировке UTF-8.")
+            continue
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield number, None, _error("Некорректный JSON.")
+            continue
+        if not isinstance(row, dict):
+            yield number, None, _error("Ожидается JSON-объект.")
+            continue
+        yield number, row, None
+
+
+def read_csv(stream):
+    lines = (_decode(line, number) for number, line in enumerate(stream, start=1))
+    # strict: незакрытая кавычка — ошибка, а не поле до конца файла
+    reader = csv.DictReader(lines, strict=True)
+    # Номер строки — как в файле, заголовок первая строка
+    number = 1
+    try:
+        for number, row in enumerate(reader, start=2):
+            yield number, {name: value for name, value in row.items() if name and value != ''}, None
+    except UnicodeDecodeError:
+        yield number + 1, None, _error("Строка не в кодировке UTF-8, остальные строки не обработаны.")
+    except csv.Error as exc:
+        # После ошибки разбора границы строк неизвестны, продолжать нельзя
+        yield number + 1, None, _error(f"Некорректный CSV ({exc}), остальные строки не обработаны.")
+
+
+def read_geojson(stream):
+    try:
+        data = json.load(_text(stream))
+    except ValueError:
+        raise IngestError("Некорректный GeoJSON.")
+    if not isinstance(data, dict) or data.get('type') != 'FeatureCollection':
+        raise IngestError("Ожидается GeoJSON FeatureCollection.")
+    features = data.get('features')
+    if not isinstance(features, list):
+        raise IngestError("Поле features должно быть списком.")
+    for number, feature in enumerate(features, start=1):
+        if not isinstance(feature, dict):
+            yield number, None, _error("Ожидается объект Feature.")
+            continue
+        geometry = feature.get('geometry')
+        if not isinstance(geometry, dict):
+            geometry = {}
+        coordinates = geometry.get('coordinates')
+        if geometry.get('type') != 'Point' or not isinstance(coordinates, list) or len(coordinates) < 2:
+            yield number, None, _error("Ожидается геометрия Point.")
+            continue
+        properties = feature.get('properties')
+        if properties is not None and not isinstance(properties, dict):
+            yield number, None, _error("Поле properties должно быть объектом.")
+            continue
+        row = dict(properties or {})
+        row['longitude'], row['latitude'] = coordinates[0], coordinates[1]
+        if feature.get('id') is not None:
+            row.setdefault('key', str(feature['id']))
+        yield number, row, None
+
+
+READERS = {'jsonl': read_jsonl, 'csv': read_csv, 'geojson': read_geojson}
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class Report:
+    def __init__(self):
+        self.created = 0
+        self.skipped = 0
+        self.errors = []
+
+    def as_dict(self):
+        return {'created': self.created, 'skipped': self.skipped, 'errors': self.errors}
+
+
+def _key_prefix(idempotency_key):
+    # Ключ строки — «<заголовок>:<номер>» и должен уместиться в import_key (100 символов)
+    if idempotency_key and len(idempotency_key) > MAX_KEY_PREFIX:
+        return hashlib.sha256(idempotency_key.encode()).hexdigest()
+    return idempotency_key or None
+
+
+def ingest(stream, fmt, user, idempotency_key=None):
+    """Загрузить точки из потока; возвращает отчёт ``{created, skipped, errors}``."""
+    report = Report()
+    idempotency_key = _key_prefix(idempotency_key)
+    rows = READERS[fmt](stream)
+    total = 0
+    for chunk in _chunks(rows, CHUNK_SIZE):
+        if total + len(chunk) > MAX_ROWS:
+            chunk = chunk[:MAX_ROWS - total]
+            number = chunk[-1][0] + 1 if chunk else 1
+            report.errors.append({'row': number, 'errors': _error(
+                f"Не больше {MAX_ROWS} строк за одну загрузку, остальные строки не обработаны."
+            )})
+        total += len(chunk)
+        points = []
+        for number, row, error in chunk:
+            if error is None:
+                serializer = BulkPointSerializer(data=row)
+                if serializer.is_valid():
+                    points.append(_build(number, serializer.validated_data, user, idempotency_key))
+                    continue
+                error = serializer.errors
+            report.errors.append({'row': number, 'errors': error})
+        _write(points, user, report)
+        if total >= MAX_ROWS:
+            break
+    return report
+
+
+def _build(number, data, user, idempotency_key):
+    key = data.pop('key', None)
+    if key is None and idempotency_key:
+        key = f'{idempotency_key}:{number}'
+    point = PollutionPoint(reporter=user, import_key=key, **data)
+    point.geohash = geo.encode(point.latitude, point.longitude)
+    return point
+
+
+def _existing_keys(points, user):
+    keys = [point.import_key for point in points if point.import_key]
+    if not keys:
+        return set()
+    return set(PollutionPoint.objects.filter(reporter=user, import_key__in=keys).values_list('import_key', flat=True))
+
+
+def _write(points, user, report):
+    for attempt in range(WRITE_ATTEMPTS):
+        existing = _existing_keys(points, user)
+        # Повторяющиеся ключи внутри одной загрузки тоже пропускаются
+        fresh = []
+        for point in points:
+            if point.import_key:
+                if point.import_key in existing:
+                    continue
+                existing.add(point.import_key)
+            fresh.append(point)
+        try:
+            with transaction.atomic():
+                created = PollutionPoint.objects.bulk_create(fresh)
+                for point in created:
+                    point._saved_state = point.state()
+                if created:
+                    points_changed.send(
+                        sender=PollutionPoint, changes=[(None, point._saved_state) for point in created]
+                    )
+        except IntegrityError:
+            # Те же ключи успела записать параллельная загрузка — перепроверяем;
+            # если занятых ключей не появилось, это другое нарушение целостности
+            if attempt == WRITE_ATTEMPTS - 1 or not _existing_keys(fresh, user):
+                raise
+            continue
+        report.created += len(created)
+        report.skipped += len(points) - len(fresh)
+        return
@@ -0,0 +1,207 @@
+"""
+Фоновые задания построения отчётов.
+
+Очередь хранится в БД (таблица ``ExportJob``). Задание забирает тот, кто
+первым переведёт его из ``queued`` в ``running`` атомарным UPDATE, поэтому
+исполнителей может быть несколько:
+
+* пул потоков внутри веб-процесса (``BACKGROUND_WORKERS`` > 0), в который
+  задание отправляется сразу после коммита;
+* отдельный процесс ``manage.py run_export_jobs``.
+
+Исполнитель отмечает ``heartbeat_at`` во время построения. Задание в
+``running`` без отметки дольше ``STALE_AFTER`` (процесс упал или был
+перезапущен) переводится в ``failed``, и такой же запрос создаёт новое.
+
+Задание видно только его автору. Готовый файл сохраняется в
+``MEDIA_ROOT/exports/`` под неугадываемым именем и удаляется вместе с
+заданием через ``EXPORT_RETENTION`` (``manage.py prune_exports`` или
+``run_export_jobs``).
+"""
+import datetime
+import hashlib
+import json
+import logging
+import secrets
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files import File
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import exports
+from .models import ExportJob
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_INTERVAL = 30
+STALE_AFTER = datetime.timedelta(minutes=5)
+EXPORT_RETENTION = datetime.timedelta(days=7)
+
+_executor = None
+
+
+class JobLost(Exception):
+    """Задание признано зависшим и больше не принадлежит исполнителю."""
+
+
+def params_key(params, user=None):
+    # Задания разных пользователей не объединяются: результат видит только автор
+    owner = user.pk if user is not None else None
+    return hashlib.sha256(json.dumps([params, owner], sort_keys=True).encode()).hexdigest()
+
+
+def get_executor():
+    global _executor
+    workers = getattr(settings, 'BACKGROUND_WORKERS', 0)
+    if workers <= 0:
+        return None
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='background')
+    return _executor
+
+
+def submit(func, *args):
+    """
+    Выполнить ``func(*args)`` в фоновом пуле после коммита транзакции.
+    Возвращает False, если пул отключён.
+    """
+    executor = get_executor()
+    if executor is None:
+        return False
+
+    def task():
+        try:
+            func(*args)
+        except Exception:
+            logger.exception("Background task %s failed", getattr(func, '__name__', func))
+        finally:
+            close_old_connections()
+
+    transaction.on_commit(lambda: executor.submit(task))
+    return True
+
+
+def enqueue(params, user=None):
+    """
+    Поставить отчёт в очередь. Если такое же задание уже ждёт или
+    выполняется, возвращается оно: ``(job, created)``.
+    """
+    fail_stale()
+    key = params_key(params, user)
+    active = ExportJob.objects.filter(params_key=key, status__in=ExportJob.ACTIVE_STATUSES)
+    job = active.first()
+    if job is not None:
+        return job, False
+    try:
+        with transaction.atomic():
+            job = ExportJob.objects.create(params=params, params_key=key, created_by=user)
+    except IntegrityError:
+        # Параллельный запрос успел создать такое же задание
+        return active.get(), False
+    submit(run_job, job.pk)
+    return job, True
+
+
+def claim(job_id):
+    """Атомарно забрать задание из очереди; False, если его уже забрали."""
+    now = timezone.now()
+    return bool(
+        ExportJob.objects
+        .filter(pk=job_id, status='queued')
+        .update(status='running', started_at=now, heartbeat_at=now)
+    )
+
+
+def heartbeat(job_id):
+    """Отметить, что задание выполняется; JobLost, если его уже признали зависшим."""
+    if not ExportJob.objects.filter(pk=job_id, status='running').update(heartbeat_at=timezone.now()):
+        raise JobLost(job_id)
+
+
+def fail_stale(now=None):
+    """Перевести в failed задания, исполнитель которых перестал отмечаться; возвращает их число."""
+    now = now or timezone.now()
+    deadline = now - STALE_AFTER
+    # Задания, начатые до появления отметок, судятся по started_at
+    stale = Q(heartbeat_at__lt=deadline) | Q(heartbeat_at__isnull=True, started_at__lt=deadline)
+    return (
+        ExportJob.objects
+        .filter(stale, status='running')
+        .update(status='failed', error="Исполнитель задания не отвечал.", finished_at=now)
+    )
+
+
+def run_job(job_id):
+    """Выполнить задание; False, если его забрал другой исполнитель."""
+    if not claim(job_id):
+        return False
+    job = ExportJob.objects.get(pk=job_id)
+    params = job.params
+    fmt = exports.FORMATS[params['format']]
+    try:
+        with tempfile.TemporaryFile() as output:
+            beat = time.monotonic()
+            for chunk in fmt.build(exports.build_query(params)):
+                output.write(chunk)
+                if time.monotonic() - beat >= HEARTBEAT_INTERVAL:
+                    heartbeat(job_id)
+                    beat = time.monotonic()
+            output.seek(0)
+            # Случайный суффикс: ссылка на файл не угадывается по номеру задания
+            suffix = f'_{job.pk}_{secrets.token_urlsafe(12)}'
+            job.file.save(exports.filename(params, suffix=suffix), File(output), save=False)
+    except JobLost:
+        logger.warning("Export job %s was marked stale, result discarded", job_id)
+        return True
+    except Exception as exc:
+        logger.exception("Export job %s failed", job_id)
+        job.status = 'failed'
+        job.error = str(exc)
+    else:
+        job.status = 'done'
+    job.finished_at = timezone.now()
+    finished = ExportJob.objects.filter(pk=job_id, status='running').update(
+        status=job.status, file=job.file.name or '', error=job.error, finished_at=job.finished_at,
+    )
+    if not finished and job.file:
+        job.file.delete(save=False)
+    return True
+
+
+def prune(now=None):
+    """Удалить завершённые задания старше срока хранения вместе с файлами; возвращает их число."""
+    now = now or timezone.now()
+    expired = ExportJob.objects.filter(
+        status__in=('done', 'failed'), finished_at__lt=now - EXPORT_RETENTION,
+    )
+    deleted = 0
+    for job in expired.iterator():
+        if job.file:
+            job.file.delete(save=False)
+        job.delete()
+        deleted += 1
+    return deleted
+
+
+def run_pending(limit=None):
+    """Выполнить задания из очереди по порядку; возвращает число выполненных."""
+    fail_stale()
+    done = 0
+    while limit is None or done < limit:
+        job_id = (
+            ExportJob.objects
+            .filter(status='queued')
+            .order_by('created_at', 'id')
+            .values_list('id', flat=True)
+            .first()
+        )
+        if job_id is None:
+            break
+        if run_job(job_id):
+            done += 1
+    return done
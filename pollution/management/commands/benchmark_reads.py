@@ -0,0 +1,215 @@
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+
+from pollution.models import PollutionPoint
+
+HOST = 'localhost'
+DEFAULT_PATHS = ['/api/pollutions/points/?page_size=50', '/api/pollutions/points/{id}/']
+# Режим -> включены ли асинхронные GET (pollution.async_reads)
+MODES = {'wsgi': False, 'asgi-sync': False, 'asgi': True}
+SEED_NAME = 'benchmark'
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнить пропускную способность чтения карты под WSGI (пул потоков) и ASGI "
+        "(синхронные и асинхронные view). Каждый режим — отдельный процесс с ASYNC_READS=0/1; "
+        "медленные клиенты моделируются задержкой чтения ответа."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modes', default=','.join(MODES), help="Режимы через запятую: wsgi, asgi-sync, asgi.")
+        parser.add_argument('--requests', type=int, default=1000, help="Всего запросов в режиме.")
+        parser.add_argument('--clients', type=int, default=100, help="Одновременных клиентов.")
+        parser.add_argument('--threads', type=int, default=8, help="Потоков WSGI-сервера.")
+        parser.add_argument('--client-delay', type=float, default=50, help="Время чтения ответа клиентом, мс.")
+        parser.add_argument('--path', action='append', dest='paths',
+                            help="URL для запросов (можно повторять), {id} — случайная точка.")
+        parser.add_argument('--seed', type=int, default=0,
+                            help="Создать столько тестовых точек на время замера (удаляются в конце).")
+        parser.add_argument('--run-mode', choices=list(MODES), help="Внутренний: замер одного режима.")
+
+    def handle(self, *args, **options):
+        if options['run_mode']:
+            result = run(options['run_mode'], options)
+            self.stdout.write(json.dumps(result))
+            return
+
+        modes = [mode for mode in options['modes'].split(',') if mode]
+        unknown = set(modes) - set(MODES)
+        if unknown:
+            raise CommandError(f"Неизвестные режимы: {', '.join(sorted(unknown))}.")
+
+        seeded = seed(options['seed'])
+        try:
+            results = [self.run_process(mode, options) for mode in modes]
+        finally:
+            if seeded:
+                PollutionPoint.objects.filter(pk__in=seeded).delete()
+
+        self.stdout.write(f"{'режим':<10} {'запр/с':>8} {'p50, мс':>9} {'p95, мс':>9} {'ошибок':>7}")
+        for mode, result in zip(modes, results):
+            self.stdout.write(
+                f"{mode:<10} {result['rps']:>8.1f} {result['p50']:>9.1f} {result['p95']:>9.1f} {result['errors']:>7}"
+            )
+
+    def run_process(self, mode, options):
+        command = [sys.executable, sys.argv[0], 'benchmark_reads', '--run-mode', mode,
+                   '--requests', str(options['requests']), '--clients', str(options['clients']),
+                   '--threads', str(options['threads']), '--client-delay', str(options['client_delay'])]
+        for path in options['paths'] or []:
+            command += ['--path', path]
+        env = {**os.environ, 'ASYNC_READS': '1' if MODES[mode] else '0'}
+        output = subprocess.run(command, env=env, capture_output=True, text=True)
+        if output.returncode:
+            raise CommandError(f"Режим {mode} завершился с ошибкой:\n{output.stderr}")
+        return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def seed(count):
+    if count <= 0:
+        return []
+    rng = random.Random(0)
+    types = [choice for choice, _ in PollutionPoint.TYPE_CHOICES]
+    points = []
+    for _ in range(count):
+        # save() считает geohash и отправляет сигналы, как при обычном создании
+        point = PollutionPoint(latitude=rng.uniform(55.5, 56.0), longitude=rng.uniform(37.3, 37.9),
+                               pollution_type=rng.choice(types), anonymous_name=SEED_NAME)
+        point.save()
+        points.append(point.pk)
+    return points
+
+
+def _targets(paths, count):
+    ids = list(PollutionPoint.objects.values_list('pk', flat=True)[:1000])
+    if not ids:
+        raise CommandError("Нет точек для замера: добавьте данные или используйте --seed.")
+    rng = random.Random(1)
+    targets = []
+    for number in range(count):
+        path, _, query = paths[number % len(paths)].format(id=rng.choice(ids)).partition('?')
+        targets.append((path, query))
+    return targets
+
+
+def _summary(latencies, errors, elapsed):
+    latencies = sorted(latencies) or [0.0]
+    return {
+        'rps': len(latencies) / elapsed if elapsed else 0.0,
+        'p50': statistics.median(latencies) * 1000,
+        'p95': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000,
+        'errors': errors,
+    }
+
+
+def run(mode, options):
+    if settings.ASYNC_READS != MODES[mode]:
+        raise CommandError(f"Режим {mode} требует ASYNC_READS={int(MODES[mode])}.")
+    targets = _targets(options['paths'] or DEFAULT_PATHS, options['requests'])
+    delay = options['client_delay'] / 1000
+    if mode == 'wsgi':
+        return run_wsgi(targets, options['clients'], options['threads'], delay)
+    return asyncio.run(run_asgi(targets, options['clients'], delay))
+
+
+def run_wsgi(targets, clients, threads, delay):
+    """
+    Клиенты — потоки; сервер обслуживает не больше ``threads`` запросов сразу
+    и держит поток, пока клиент читает ответ (как gunicorn --threads).
+    """
+    handler = WSGIHandler()
+    workers = threading.BoundedSemaphore(threads)
+    pending = iter(targets)
+    lock = threading.Lock()
+    latencies, errors = [], []
+
+    def client():
+        while True:
+            with lock:
+                target = next(pending, None)
+            if target is None:
+                return
+            path, query = target
+            started = time.perf_counter()
+            with workers:
+                status = []
+                environ = {
+                    'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query, 'SCRIPT_NAME': '',
+                    'SERVER_NAME': HOST, 'SERVER_PORT': '80', 'HTTP_HOST': HOST, 'HTTP_ACCEPT': 'application/json',
+                    'wsgi.input': BytesIO(), 'wsgi.url_scheme': 'http', 'wsgi.errors': sys.stderr,
+                }
+                body = handler(environ, lambda line, headers, exc_info=None: status.append(line))
+                try:
+                    for _ in body:
+                        pass
+                    time.sleep(delay)
+                finally:
+                    body.close()
+            with lock:
+                latencies.append(time.perf_counter() - started)
+                if not status[0].startswith('200'):
+                    errors.append(status[0])
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        for _ in range(clients):
+            pool.submit(client)
+    return _summary(latencies, len(errors), time.perf_counter() - started)
+
+
+async def run_asgi(targets, clients, delay):
+    """Клиенты — корутины в одном event loop; чтение ответа не занимает поток."""
+    handler = ASGIHandler()
+    pending = iter(targets)
+    latencies, errors = [], []
+
+    async def client():
+        for path, query in pending:
+            status = []
+            messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+            done = asyncio.Event()
+
+            async def receive():
+                if messages:
+                    return messages.pop()
+                # Дальше сервер только ждёт отключения клиента
+                await done.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status.append(message['status'])
+                elif not message.get('more_body'):
+                    await asyncio.sleep(delay)
+                    done.set()
+
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+                'root_path': '', 'headers': [(b'host', HOST.encode()), (b'accept', b'application/json')],
+                'client': ('127.0.0.1', 0), 'server': (HOST, 80),
+            }
+            started = time.perf_counter()
+            await handler(scope, receive, send)
+            latencies.append(time.perf_counter() - started)
+            if status[0] != 200:
+                errors.append(status[0])
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    return _summary(latencies, len(errors), time.perf_counter() - started)
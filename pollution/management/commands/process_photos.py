@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from pollution import images
+
+
+class Command(BaseCommand):
+    help = (
+        "Обработчик очереди фото: строит недостающие варианты без EXIF. Нужен, когда фоновый "
+        "пул веб-процесса выключен (BACKGROUND_WORKERS=0), и для повторных попыток после ошибок."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Обработать очередь и завершиться.")
+        parser.add_argument('--interval', type=float, default=2.0, help="Пауза между опросами, с.")
+
+    def handle(self, *args, once=False, interval=2.0, **options):
+        while True:
+            done = images.process_pending()
+            if done or once:
+                self.stdout.write(f"Обработано фото: {done}")
+            if once:
+                break
+            time.sleep(interval)
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from pollution import jobs
+
+
+class Command(BaseCommand):
+    help = "Удалить завершённые фоновые отчёты старше срока хранения вместе с файлами."
+
+    def handle(self, *args, **options):
+        stale = jobs.fail_stale()
+        deleted = jobs.prune()
+        self.stdout.write(f"Зависших заданий: {stale}, удалено отчётов: {deleted}")
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from pollution import sync
+
+
+class Command(BaseCommand):
+    help = "Удалить устаревшие записи журнала удалений (ленты синхронизации)."
+
+    def handle(self, *args, **options):
+        deleted = sync.prune()
+        self.stdout.write(f"Удалено записей: {deleted}")
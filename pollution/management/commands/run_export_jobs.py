@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from pollution import jobs
+
+
+class Command(BaseCommand):
+    help = "Обработчик очереди фоновых отчётов (ExportJob)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Обработать очередь и завершиться.")
+        parser.add_argument('--interval', type=float, default=2.0, help="Пауза между опросами очереди, с.")
+
+    def handle(self, *args, once=False, interval=2.0, **options):
+        while True:
+            done = jobs.run_pending()
+            jobs.prune()
+            if done:
+                self.stdout.write(f"Выполнено заданий: {done}")
+            if once:
+                break
+            time.sleep(interval)
@@ -0,0 +1,77 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:06
+
+from django.conf import settings
+from django.db import migrations, models
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 12
+
+
+def encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    """Geohash точки (копия pollution.geo.encode на момент миграции)."""
+    lat_lo, lat_hi = -90.0, 90.0
+    lon_lo, lon_hi = -180.0, 180.0
+    chars = []
+    bit = 0
+    ch = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_lo + lon_hi) / 2
+            if longitude >= mid:
+                ch = (ch << 1) | 1
+                lon_lo = mid
+            else:
+                ch <<= 1
+                lon_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if latitude >= mid:
+                ch = (ch << 1) | 1
+                lat_lo = mid
+            else:
+                ch <<= 1
+                lat_hi = mid
+        even = not even
+        bit += 1
+        if bit == 5:
+            chars.append(BASE32[ch])
+            bit = 0
+            ch = 0
+    return ''.join(chars)
+
+
+def fill_geohash(apps, schema_editor):
+    PollutionPoint = apps.get_model('pollution', 'PollutionPoint')
+    points = PollutionPoint.objects.only('id', 'latitude', 'longitude')
+    batch = []
+    for point in points.iterator(chunk_size=2000):
+        point.geohash = encode(point.latitude, point.longitude)
+        batch.append(point)
+        if len(batch) >= 2000:
+            PollutionPoint.objects.bulk_update(batch, ['geohash'])
+            batch = []
+    if batch:
+        PollutionPoint.objects.bulk_update(batch, ['geohash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pollution', '0004_pollutionpoint_anonymous_name_and_more'),
+        ('users', '0004_user_photo'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pollutionpoint',
+            name='geohash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=12),
+        ),
+        migrations.AddIndex(
+            model_name='pollutionpoint',
+            index=models.Index(fields=['geohash', 'latitude', 'longitude'], name='pollution_geohash_idx'),
+        ),
+        migrations.RunPython(fill_geohash, migrations.RunPython.noop),
+    ]
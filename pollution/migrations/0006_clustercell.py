@@ -0,0 +1,51 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:07
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import Substr
+
+MAX_PRECISION = 8
+
+
+def build_clusters(apps, schema_editor):
+    PollutionPoint = apps.get_model('pollution', 'PollutionPoint')
+    ClusterCell = apps.get_model('pollution', 'ClusterCell')
+    for precision in range(1, MAX_PRECISION + 1):
+        rows = (
+            PollutionPoint.objects
+            .annotate(cell=Substr('geohash', 1, precision))
+            .values('cell', 'pollution_type', 'status')
+            .annotate(count=Count('id'), latitude_sum=Sum('latitude'), longitude_sum=Sum('longitude'))
+            .order_by()
+        )
+        ClusterCell.objects.bulk_create(
+            [ClusterCell(precision=precision, **row) for row in rows.iterator()],
+            batch_size=1000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pollution', '0005_pollutionpoint_geohash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClusterCell',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('precision', models.PositiveSmallIntegerField()),
+                ('cell', models.CharField(max_length=12)),
+                ('pollution_type', models.CharField(max_length=20)),
+                ('status', models.CharField(max_length=20)),
+                ('count', models.IntegerField(default=0)),
+                ('latitude_sum', models.FloatField(default=0)),
+                ('longitude_sum', models.FloatField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('precision', 'cell', 'pollution_type', 'status'), name='pollution_clustercell_unique')],
+            },
+        ),
+        migrations.RunPython(build_clusters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:11
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pollution', '0006_clustercell'),
+        ('users', '0004_user_photo'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['point', 'created_at', 'id'], name='pollution_comment_point_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pollutionpoint',
+            index=models.Index(fields=['created_at', 'id'], name='pollution_created_idx'),
+        ),
+    ]
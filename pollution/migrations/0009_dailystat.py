@@ -0,0 +1,45 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+
+
+def build_stats(apps, schema_editor):
+    PollutionPoint = apps.get_model('pollution', 'PollutionPoint')
+    DailyStat = apps.get_model('pollution', 'DailyStat')
+    rows = (
+        PollutionPoint.objects
+        .annotate(day=TruncDate('created_at'))
+        .values('day', 'pollution_type', 'status', 'handled_by_id')
+        .annotate(count=Count('id'))
+        .order_by()
+    )
+    DailyStat.objects.bulk_create([DailyStat(**row) for row in rows.iterator()], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pollution', '0008_exportjob'),
+        ('users', '0004_user_photo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('pollution_type', models.CharField(max_length=20)),
+                ('status', models.CharField(max_length=20)),
+                ('count', models.IntegerField(default=0)),
+                ('handled_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='users.organization')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('day', 'pollution_type', 'status', 'handled_by'), name='pollution_dailystat_unique')],
+            },
+        ),
+        migrations.RunPython(build_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pollution', '0009_dailystat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='photo_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='pollutionpoint',
+            name='photo_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:22
+
+import config.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pollution', '0010_photo_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('refs', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='comment',
+            name='photo',
+            field=models.ImageField(blank=True, null=True, storage=config.storage.photo_storage, upload_to='comment_photos/'),
+        ),
+        migrations.AlterField(
+            model_name='pollutionpoint',
+            name='photo',
+            field=models.ImageField(blank=True, null=True, storage=config.storage.photo_storage, upload_to='pollution_photos/'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pollution', '0011_media_blob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pollutionpoint',
+            name='duplicate_of',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='duplicates', to='pollution.pollutionpoint', verbose_name='Исходная точка, если это повторное сообщение'),
+        ),
+        migrations.AddField(
+            model_name='pollutionpoint',
+            name='photo_phash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=16),
+        ),
+        migrations.AddField(
+            model_name='pollutionpoint',
+            name='reports_count',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
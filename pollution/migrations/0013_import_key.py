@@ -0,0 +1,25 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:26
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pollution', '0012_duplicates'),
+        ('users', '0006_photo_storage'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pollutionpoint',
+            name='import_key',
+            field=models.CharField(blank=True, editable=False, max_length=100, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='pollutionpoint',
+            constraint=models.UniqueConstraint(condition=models.Q(('import_key__isnull', False)), fields=('reporter', 'import_key'), name='pollution_point_import_key_unique'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:30
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+
+def fill_comment_updated_at(apps, schema_editor):
+    apps.get_model('pollution', 'Comment').objects.update(updated_at=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pollution', '0013_import_key'),
+        ('users', '0006_photo_storage'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('point', 'Точка'), ('comment', 'Комментарий')], max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('deleted_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(fill_comment_updated_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['updated_at', 'id'], name='pollution_comment_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pollutionpoint',
+            index=models.Index(fields=['updated_at', 'id'], name='pollution_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['deleted_at', 'id'], name='pollution_tombstone_idx'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:43
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def build_reporter_stats(apps, schema_editor):
+    PollutionPoint = apps.get_model('pollution', 'PollutionPoint')
+    ReporterStat = apps.get_model('pollution', 'ReporterStat')
+    rows = (
+        PollutionPoint.objects
+        .filter(reporter__isnull=False)
+        .values('reporter_id', 'pollution_type', 'status')
+        .annotate(count=Count('id'))
+        .order_by()
+    )
+    ReporterStat.objects.bulk_create([ReporterStat(**row) for row in rows.iterator()], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pollution', '0015_collection_version'),
+        ('users', '0006_photo_storage'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReporterStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pollution_type', models.CharField(max_length=20)),
+                ('status', models.CharField(max_length=20)),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='pollutionpoint',
+            index=models.Index(fields=['reporter', 'created_at', 'id'], name='pollution_reporter_idx'),
+        ),
+        migrations.AddField(
+            model_name='reporterstat',
+            name='reporter',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='reporterstat',
+            constraint=models.UniqueConstraint(fields=('reporter', 'pollution_type', 'status'), name='pollution_reporterstat_unique'),
+        ),
+        migrations.RunPython(build_reporter_stats, migrations.RunPython.noop),
+    ]
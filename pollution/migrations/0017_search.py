@@ -0,0 +1,69 @@
+# Generated by Django 5.2.7 on 2026-10-18 12:10
+
+from collections import defaultdict
+
+from django.db import migrations
+
+# Модуль без зависимостей от моделей: документы должны совпадать с запросами
+# текущего стеммера, при его изменении индекс пересобирается search.rebuild()
+from pollution import stemming
+
+TABLE = 'pollution_search'
+BATCH_SIZE = 500
+
+
+def create_search_index(apps, schema_editor):
+    PollutionPoint = apps.get_model('pollution', 'PollutionPoint')
+    Comment = apps.get_model('pollution', 'Comment')
+    db = schema_editor.connection
+    if db.vendor == 'sqlite':
+        schema_editor.execute(f"CREATE VIRTUAL TABLE {TABLE} USING fts5(body, tokenize='unicode61')")
+    elif db.vendor == 'postgresql':
+        schema_editor.execute(
+            f"CREATE TABLE {TABLE} ("
+            f"point_id bigint PRIMARY KEY REFERENCES pollution_pollutionpoint (id) "
+            f"ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+            f"document tsvector NOT NULL)"
+        )
+        schema_editor.execute(f"CREATE INDEX {TABLE}_document_idx ON {TABLE} USING gin (document)")
+    else:
+        return
+
+    ids = list(PollutionPoint.objects.order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(ids), BATCH_SIZE):
+        batch = ids[start:start + BATCH_SIZE]
+        texts = defaultdict(list)
+        for pk, description in PollutionPoint.objects.filter(pk__in=batch).values_list('pk', 'description'):
+            texts[pk].append(description or '')
+        comments = Comment.objects.filter(point_id__in=batch).order_by('pk').values_list('point_id', 'text')
+        for point_id, text in comments:
+            if text:
+                texts[point_id].append(text)
+        documents = [(pk, '\n'.join(parts)) for pk, parts in texts.items()]
+        with db.cursor() as cursor:
+            if db.vendor == 'sqlite':
+                cursor.executemany(
+                    f"INSERT INTO {TABLE} (rowid, body) VALUES (%s, %s)",
+                    [(pk, ' '.join(stemming.stems(text))) for pk, text in documents],
+                )
+            else:
+                cursor.executemany(
+                    f"INSERT INTO {TABLE} (point_id, document) VALUES (%s, to_tsvector('russian', %s))",
+                    documents,
+                )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        schema_editor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pollution', '0016_reporter_stats'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
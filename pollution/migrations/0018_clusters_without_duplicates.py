@@ -0,0 +1,38 @@
+# Generated by Django 5.2.7 on 2026-10-18 14:05
+
+from django.db import migrations
+from django.db.models import Count, Sum
+from django.db.models.functions import Substr
+
+MAX_PRECISION = 8
+
+
+def rebuild_clusters(apps, schema_editor):
+    """Пересчитать кластеры без повторных сообщений (duplicate_of)."""
+    PollutionPoint = apps.get_model('pollution', 'PollutionPoint')
+    ClusterCell = apps.get_model('pollution', 'ClusterCell')
+    ClusterCell.objects.all().delete()
+    for precision in range(1, MAX_PRECISION + 1):
+        rows = (
+            PollutionPoint.objects
+            .filter(duplicate_of__isnull=True)
+            .annotate(cell=Substr('geohash', 1, precision))
+            .values('cell', 'pollution_type', 'status')
+            .annotate(count=Count('id'), latitude_sum=Sum('latitude'), longitude_sum=Sum('longitude'))
+            .order_by()
+        )
+        ClusterCell.objects.bulk_create(
+            [ClusterCell(precision=precision, **row) for row in rows.iterator()],
+            batch_size=1000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pollution', '0017_search'),
+    ]
+
+    operations = [
+        migrations.RunPython(rebuild_clusters, migrations.RunPython.noop),
+    ]
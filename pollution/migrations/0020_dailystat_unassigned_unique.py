@@ -0,0 +1,36 @@
+# Generated by Django 5.2.7 on 2026-10-18 10:46
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+
+
+def rebuild_stats(apps, schema_editor):
+    # Строки без организации могли задвоиться, счётчики по ним — разойтись: пересчёт
+    PollutionPoint = apps.get_model('pollution', 'PollutionPoint')
+    DailyStat = apps.get_model('pollution', 'DailyStat')
+    DailyStat.objects.all().delete()
+    rows = (
+        PollutionPoint.objects
+        .annotate(day=TruncDate('created_at'))
+        .values('day', 'pollution_type', 'status', 'handled_by_id')
+        .annotate(count=Count('id'))
+        .order_by()
+    )
+    DailyStat.objects.bulk_create([DailyStat(**row) for row in rows.iterator()], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pollution', '0019_exportjob_heartbeat'),
+        ('users', '0007_org_username_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(rebuild_stats, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='dailystat',
+            constraint=models.UniqueConstraint(condition=models.Q(('handled_by__isnull', True)), fields=('day', 'pollution_type', 'status'), name='pollution_dailystat_unassigned_unique'),
+        ),
+    ]
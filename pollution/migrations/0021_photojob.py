@@ -0,0 +1,47 @@
+# Generated by Django 5.2.7 on 2026-10-18 10:50
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def enqueue_pending(apps, schema_editor):
+    # Фото, варианты которых не построены или устарели, ставятся в очередь
+    PhotoJob = apps.get_model('pollution', 'PhotoJob')
+    for label in ('pollution.PollutionPoint', 'pollution.Comment', 'users.User'):
+        model = apps.get_model(label)
+        rows = model.objects.exclude(photo='').exclude(photo__isnull=True).values_list('pk', 'photo', 'photo_variants')
+        PhotoJob.objects.bulk_create(
+            [
+                PhotoJob(model_label=label, object_id=pk, source=photo)
+                for pk, photo, variants in rows.iterator()
+                if (variants or {}).get('source') != photo
+            ],
+            batch_size=1000,
+        )
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pollution', '0020_dailystat_unassigned_unique'),
+        ('users', '0005_user_photo_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PhotoJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_label', models.CharField(max_length=100)),
+                ('object_id', models.BigIntegerField()),
+                ('source', models.CharField(max_length=100)),
+                ('attempts', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('retry_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['retry_at', 'id'], name='pollution_photojob_queue_idx')],
+                'constraints': [models.UniqueConstraint(fields=('model_label', 'object_id'), name='pollution_photojob_object_unique')],
+            },
+        ),
+        migrations.RunPython(enqueue_pending, migrations.RunPython.noop),
+    ]
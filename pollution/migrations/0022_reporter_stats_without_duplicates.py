@@ -0,0 +1,30 @@
+# Generated by Django 5.2.7 on 2026-10-18 11:02
+
+from django.db import migrations
+from django.db.models import Count
+
+
+def rebuild_reporter_stats(apps, schema_editor):
+    # Повторные сообщения больше не входят в счётчики профиля: пересчёт
+    PollutionPoint = apps.get_model('pollution', 'PollutionPoint')
+    ReporterStat = apps.get_model('pollution', 'ReporterStat')
+    ReporterStat.objects.all().delete()
+    rows = (
+        PollutionPoint.objects
+        .filter(reporter__isnull=False, duplicate_of__isnull=True)
+        .values('reporter_id', 'pollution_type', 'status')
+        .annotate(count=Count('id'))
+        .order_by()
+    )
+    ReporterStat.objects.bulk_create([ReporterStat(**row) for row in rows.iterator()], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pollution', '0021_photojob'),
+    ]
+
+    operations = [
+        migrations.RunPython(rebuild_reporter_stats, migrations.RunPython.noop),
+    ]
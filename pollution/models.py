@@ -1,10 +1,88 @@
+import math
+from typing import NamedTuple
+
 from django.db import models
+from django.db.models import Count, ExpressionWrapper, F, FloatField, IntegerField, OuterRef, Prefetch, Q, \
+    Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 
 from config.settings import AUTH_USER_MODEL
+from config.storage import AtomicSaveMixin, photo_storage
 from users.models import Organization
 
+from . import geo
+
+
+class PointState(NamedTuple):
+    """Снимок полей точки, от которых зависят агрегаты и индексы карты."""
+    id: int
+    latitude: float
+    longitude: float
+    geohash: str
+    pollution_type: str
+    status: str
+    handled_by_id: int | None
+    reporter_id: int | None
+    created_at: object
+    duplicate_of_id: int | None
+
+
+class PollutionPointQuerySet(models.QuerySet):
+    def for_list(self):
+        """План запроса для списка: связи одним JOIN, число комментариев подзапросом."""
+        comments_count = (
+            Comment.objects
+            .filter(point=OuterRef('pk'))
+            .order_by()
+            .values('point')
+            .annotate(count=Count('id'))
+            .values('count')
+        )
+        return self.select_related('reporter', 'handled_by').annotate(
+            comments_count=Coalesce(Subquery(comments_count, output_field=IntegerField()), 0)
+        )
+
+    def with_details(self):
+        """План запроса для полного представления (PollutionPointSerializer)."""
+        return self.select_related('reporter', 'handled_by').prefetch_related(
+            Prefetch('comments', queryset=Comment.objects.select_related('author')),
+        )
+
+    def in_bbox(self, min_lon, min_lat, max_lon, max_lat):
+        """Точки внутри прямоугольника; отбор идёт по индексу geohash."""
+        queryset = self.filter(
+            latitude__gte=min_lat,
+            latitude__lte=max_lat,
+            longitude__gte=min_lon,
+            longitude__lte=max_lon,
+        )
+        prefixes = geo.cover(min_lon, min_lat, max_lon, max_lat)
+        if prefixes:
+            cells = Q()
+            for prefix in prefixes:
+                lo, hi = geo.prefix_range(prefix)
+                cells |= Q(geohash__gte=lo, geohash__lt=hi)
+            queryset = queryset.filter(cells)
+        return queryset
+
+    def near(self, latitude, longitude, radius_m):
+        """
+        Точки в радиусе ``radius_m`` метров. Сначала отбор по описанному
+        прямоугольнику, затем точная проверка в равнопромежуточной проекции
+        (только арифметика, без тригонометрии на стороне БД).
+        """
+        queryset = self.in_bbox(*geo.radius_bbox(latitude, longitude, radius_m))
+        k = math.cos(math.radians(latitude))
+        dlat = F('latitude') - Value(latitude)
+        dlon = (F('longitude') - Value(longitude)) * Value(k)
+        radius_deg = math.degrees(radius_m / geo.EARTH_RADIUS_M)
+        return queryset.annotate(
+            distance_sq=ExpressionWrapper(dlat * dlat + dlon * dlon, output_field=FloatField())
+        ).filter(distance_sq__lte=radius_deg * radius_deg)
+
 
-class PollutionPoint(models.Model):
+class PollutionPoint(AtomicSaveMixin, models.Model):
     """Точка загрязнения на карте."""
 
     TYPE_CHOICES = (
@@ -42,8 +120,24 @@ class PollutionPoint(models.Model):
     description = models.TextField(blank=True)
     latitude = models.FloatField()
     longitude = models.FloatField()
-    photo = models.ImageField(upload_to='pollution_photos/', blank=True, null=True)
+    geohash = models.CharField(max_length=geo.GEOHASH_PRECISION, blank=True, default='', editable=False)
+    photo = models.ImageField(upload_to='pollution_photos/', storage=photo_storage, blank=True, null=True)
+    photo_variants = models.JSONField(default=dict, blank=True, editable=False)
+    # Перцептивный хеш фото, считается при поиске дублей (см. pollution.duplicates)
+    photo_phash = models.CharField(max_length=16, blank=True, default='', editable=False)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='new')
+    duplicate_of = models.ForeignKey(
+        'self',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='duplicates',
+        verbose_name="Исходная точка, если это повторное сообщение"
+    )
+    # Сколько сообщений слито в точку (включая исходное)
+    reports_count = models.PositiveIntegerField(default=1)
+    # Ключ идемпотентности массовой загрузки (см. pollution.ingest)
+    import_key = models.CharField(max_length=100, null=True, blank=True, editable=False)
 
     started_at = models.DateTimeField(blank=True, null=True, verbose_name="Дата начала работ")
     cleaned_at = models.DateTimeField(blank=True, null=True, verbose_name="Дата очистки")
@@ -51,18 +145,261 @@ class PollutionPoint(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = PollutionPointQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Покрывающий индекс: диапазон по geohash + уточнение по координатам без чтения таблицы
+            models.Index(fields=['geohash', 'latitude', 'longitude'], name='pollution_geohash_idx'),
+            # Ключ курсорной пагинации и диапазонных выборок по дате
+            models.Index(fields=['created_at', 'id'], name='pollution_created_idx'),
+            # Лента изменений для синхронизации (см. pollution.sync)
+            models.Index(fields=['updated_at', 'id'], name='pollution_updated_idx'),
+            # Сообщения пользователя по страницам (?reporter=)
+            models.Index(fields=['reporter', 'created_at', 'id'], name='pollution_reporter_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['reporter', 'import_key'],
+                condition=Q(import_key__isnull=False),
+                name='pollution_point_import_key_unique',
+            ),
+        ]
+
+    # Состояние на момент загрузки из БД / последнего сохранения (см. pollution.signals)
+    _saved_state = None
+    # Проиндексированное описание (см. pollution.search)
+    _saved_description = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._saved_state = instance.state()
+        instance._saved_description = instance.__dict__.get('description')
+        return instance
+
+    def state(self):
+        return PointState(*(self.__dict__.get(field) for field in PointState._fields))
+
+    def save(self, *args, **kwargs):
+        self.geohash = geo.encode(self.latitude, self.longitude)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'latitude', 'longitude'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'geohash'}
+        super().save(*args, **kwargs)
+
     def __str__(self):
         name = self.reporter.username if self.reporter else self.anonymous_name or "Аноним"
         return f"{self.get_pollution_type_display()} ({self.latitude}, {self.longitude}) — {name}"
 
 
-class Comment(models.Model):
+class Comment(AtomicSaveMixin, models.Model):
     """Комментарий от пользователей (НКО, волонтёров и т.д.)"""
     point = models.ForeignKey(PollutionPoint, on_delete=models.CASCADE, related_name='comments')
     author = models.ForeignKey(AUTH_USER_MODEL, on_delete=models.CASCADE)
     text = models.TextField(blank=True)
-    photo = models.ImageField(upload_to='comment_photos/', blank=True, null=True)
+    photo = models.ImageField(upload_to='comment_photos/', storage=photo_storage, blank=True, null=True)
+    photo_variants = models.JSONField(default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['point', 'created_at', 'id'], name='pollution_comment_point_idx'),
+            models.Index(fields=['updated_at', 'id'], name='pollution_comment_updated_idx'),
+        ]
+
+    # Проиндексированный текст (см. pollution.search)
+    _saved_text = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._saved_text = instance.__dict__.get('text')
+        return instance
 
     def __str__(self):
         return f"Comment by {self.author.username} on point {self.point.id}"
+
+
+class ClusterCell(models.Model):
+    """
+    Агрегат точек в ячейке geohash заданной точности (иерархическая сетка
+    для кластеризации на мелких масштабах). Поддерживается инкрементально,
+    см. pollution.clusters.
+    """
+    precision = models.PositiveSmallIntegerField()
+    cell = models.CharField(max_length=geo.GEOHASH_PRECISION)
+    pollution_type = models.CharField(max_length=20)
+    status = models.CharField(max_length=20)
+    count = models.IntegerField(default=0)
+    latitude_sum = models.FloatField(default=0)
+    longitude_sum = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['precision', 'cell', 'pollution_type', 'status'],
+                name='pollution_clustercell_unique',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.cell} [{self.pollution_type}/{self.status}]: {self.count}"
+
+
+class ExportJob(models.Model):
+    """Фоновое построение отчёта (см. pollution.jobs)."""
+
+    STATUS_CHOICES = (
+        ('queued', 'В очереди'),
+        ('running', 'Выполняется'),
+        ('done', 'Готово'),
+        ('failed', 'Ошибка'),
+    )
+    ACTIVE_STATUSES = ('queued', 'running')
+
+    params = models.JSONField(default=dict)
+    # Хеш нормализованных параметров: одинаковые активные задания не дублируются
+    params_key = models.CharField(max_length=64)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    file = models.FileField(upload_to='exports/', blank=True, null=True)
+    error = models.TextField(blank=True)
+    created_by = models.ForeignKey(AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    # Последняя отметка исполнителя (см. pollution.jobs.fail_stale)
+    heartbeat_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['params_key'],
+                condition=Q(status__in=['queued', 'running']),
+                name='pollution_exportjob_active_unique',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='pollution_exportjob_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"Export #{self.pk} {self.params} [{self.status}]"
+
+
+class PhotoJob(models.Model):
+    """Фото, для которого ещё не построены варианты (см. pollution.images)."""
+    model_label = models.CharField(max_length=100)
+    object_id = models.BigIntegerField()
+    # Имя файла, для которого поставлена задача
+    source = models.CharField(max_length=100)
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    retry_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['model_label', 'object_id'], name='pollution_photojob_object_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['retry_at', 'id'], name='pollution_photojob_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.model_label} #{self.object_id} {self.source} [{self.attempts}]"
+
+
+class DailyStat(models.Model):
+    """
+    Число точек по дню создания × типу × статусу × организации.
+    Поддерживается инкрементально, см. pollution.stats.
+    """
+    day = models.DateField()
+    pollution_type = models.CharField(max_length=20)
+    status = models.CharField(max_length=20)
+    handled_by = models.ForeignKey(Organization, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['day', 'pollution_type', 'status', 'handled_by'],
+                name='pollution_dailystat_unique',
+            ),
+            # NULL не равен NULL: строки без организации уникальны по отдельному частичному индексу
+            models.UniqueConstraint(
+                fields=['day', 'pollution_type', 'status'],
+                condition=Q(handled_by__isnull=True),
+                name='pollution_dailystat_unassigned_unique',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.pollution_type}/{self.status}: {self.count}"
+
+
+class ReporterStat(models.Model):
+    """
+    Число точек пользователя по типу × статусу (счётчики профиля).
+    Поддерживается инкрементально, см. pollution.stats.
+    """
+    # Без ограничения в БД: каскадное удаление точек пользователя меняет счётчики
+    # в той же транзакции, строки убирает pollution.stats после её коммита
+    reporter = models.ForeignKey(
+        AUTH_USER_MODEL, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+'
+    )
+    pollution_type = models.CharField(max_length=20)
+    status = models.CharField(max_length=20)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['reporter', 'pollution_type', 'status'],
+                name='pollution_reporterstat_unique',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.reporter_id} {self.pollution_type}/{self.status}: {self.count}"
+
+
+class MediaBlob(models.Model):
+    """Число ссылок на файл контентно-адресуемого хранилища (см. config.storage)."""
+    name = models.CharField(max_length=100, unique=True)
+    refs = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name}: {self.refs}"
+
+
+class Tombstone(models.Model):
+    """Запись об удалённой точке или комментарии для ленты синхронизации (см. pollution.sync)."""
+
+    KIND_CHOICES = (
+        ('point', 'Точка'),
+        ('comment', 'Комментарий'),
+    )
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['deleted_at', 'id'], name='pollution_tombstone_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.object_id} deleted at {self.deleted_at}"
+
+
+class CollectionVersion(models.Model):
+    """Номер версии данных карты, растёт при каждой записи (см. pollution.versions)."""
+    name = models.CharField(max_length=50, unique=True)
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.name}: {self.version}"
@@ -0,0 +1,66 @@
+"""Разбор параметров запроса, общих для нескольких эндпоинтов."""
+from rest_framework import serializers
+
+DEFAULT_NEAR_RADIUS_M = 1000
+MAX_NEAR_RADIUS_M = 100_000
+
+
+def _error(param, message):
+    return serializers.ValidationError({param: message} if param else message)
+
+
+def parse_floats(value, count, param):
+    try:
+        numbers = [float(part) for part in value.split(',')]
+    except (AttributeError, ValueError):
+        numbers = []
+    if len(numbers) != count:
+        raise _error(param, f"Ожидается {count} числа через запятую.")
+    return numbers
+
+
+def parse_bbox(value, param='bbox'):
+    """
+    ?bbox=minLon,minLat,maxLon,maxLat
+    При ``param=None`` ошибка не привязывается к полю (для валидаторов сериализаторов).
+    """
+    min_lon, min_lat, max_lon, max_lat = parse_floats(value, 4, param)
+    if not (-180 <= min_lon <= max_lon <= 180 and -90 <= min_lat <= max_lat <= 90):
+        raise _error(param, "Некорректные границы прямоугольника.")
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def parse_near(params):
+    """?near=lat,lon&radius_m="""
+    latitude, longitude = parse_floats(params['near'], 2, 'near')
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise serializers.ValidationError({"near": "Некорректные координаты."})
+    try:
+        radius_m = float(params.get('radius_m', DEFAULT_NEAR_RADIUS_M))
+    except ValueError:
+        raise serializers.ValidationError({"radius_m": "Ожидается число."})
+    if not 0 < radius_m <= MAX_NEAR_RADIUS_M:
+        raise serializers.ValidationError({"radius_m": f"Радиус должен быть в пределах (0, {MAX_NEAR_RADIUS_M}]."})
+    return latitude, longitude, radius_m
+
+
+def parse_limit(params, default, maximum, param='limit'):
+    """?limit= — целое от 1, не больше ``maximum``."""
+    try:
+        limit = int(params.get(param, default))
+    except ValueError:
+        raise _error(param, "Ожидается целое число.")
+    if limit < 1:
+        raise _error(param, "Должно быть не меньше 1.")
+    return min(limit, maximum)
+
+
+def parse_id(value, param):
+    """Идентификатор объекта — положительное целое."""
+    try:
+        number = int(value)
+    except ValueError:
+        raise _error(param, "Ожидается целое число.")
+    if number < 1:
+        raise _error(param, "Должно быть не меньше 1.")
+    return number
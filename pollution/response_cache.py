@@ -0,0 +1,135 @@
+"""
+Кеш готовых ответов публичной карты.
+
+Список точек одинаков для всех анонимных посетителей, поэтому отрендеренный
+JSON кладётся в кеш ``responses`` (см. ``settings.CACHES``) под ключом из
+параметров запроса и версии данных (``pollution.versions``). Вместе с телом
+хранятся версия и время изменения, из которых при выдаче заново строятся
+ETag и Last-Modified. Запись в данные меняет версию, старые ключи просто
+перестают запрашиваться и истекают.
+
+Защита от лавины промахов: перестраивает ответ только тот, кто взял
+блокировку ``cache.add``; остальные ждут, пока ответ появится, и на каждом
+шаге перечитывают версию — если она сменилась, ждут (или строят) ответ уже
+для новой. Ответ предыдущей версии не отдаётся никогда.
+"""
+import asyncio
+import functools
+import hashlib
+import time
+
+from django.core.cache import caches
+from django.http import HttpResponse
+
+from . import versions
+
+CACHE_ALIAS = 'responses'
+TIMEOUT = 10 * 60
+LOCK_TIMEOUT = 10
+WAIT_INTERVAL = 0.05
+WAIT_TIMEOUT = 2
+
+
+def _params_key(request):
+    # В ответе абсолютные ссылки, поэтому хост и схема — часть ключа
+    query = sorted(request.query_params.lists())
+    raw = f'{request.scheme}://{request.get_host()}{request.path}?{query}'
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def _key(params, version, modified):
+    # Время изменения делает ключ уникальным и после пересоздания базы
+    return f'response:{params}:{version}:{modified.timestamp()}'
+
+
+def cacheable(request, user, renderer):
+    return request.method == 'GET' and not user.is_authenticated and renderer.format == 'json'
+
+
+def _entry(response, version, modified):
+    return {
+        'content': response.content,
+        'content_type': response['Content-Type'],
+        'version': version,
+        'modified': modified,
+    }
+
+
+def _response(entry, renderer):
+    response = HttpResponse(entry['content'], content_type=entry['content_type'])
+    return versions.Validators(entry['version'], entry['modified'], renderer).stamp(response)
+
+
+def cached(view_method):
+    """Кешировать JSON-ответ action'а для анонимных пользователей."""
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        renderer = getattr(request, 'accepted_renderer', None)
+        names = self.version_collections()
+        if not renderer or names is None or not cacheable(request, request.user, renderer):
+            return view_method(self, request, *args, **kwargs)
+        version, modified = versions.for_request(request, names)
+        if modified is None:
+            return view_method(self, request, *args, **kwargs)
+
+        cache = caches[CACHE_ALIAS]
+        params = _params_key(request)
+        deadline = time.monotonic() + WAIT_TIMEOUT
+        while True:
+            key = _key(params, version, modified)
+            entry = cache.get(key)
+            if entry is not None:
+                return _response(entry, renderer)
+            if cache.add(f'{key}:lock', 1, LOCK_TIMEOUT):
+                break
+            if time.monotonic() >= deadline:
+                # Не дождались — строим сами, не кешируя
+                return view_method(self, request, *args, **kwargs)
+            time.sleep(WAIT_INTERVAL)
+            version, modified = versions.current(*names)
+
+        try:
+            response = view_method(self, request, *args, **kwargs)
+            if response.status_code == 200:
+                response = self.finalize_response(request, response, *args, **kwargs)
+                response.render()
+                cache.set(key, _entry(response, version, modified), TIMEOUT)
+                response = versions.Validators(version, modified, renderer).stamp(response)
+        finally:
+            cache.delete(f'{key}:lock')
+        return response
+
+    return wrapper
+
+
+async def acached(request, names, version, modified, build):
+    """
+    Асинхронный вариант ``cached`` для pollution.async_reads: ``build`` —
+    корутина, возвращающая отрендеренный ответ.
+    """
+    renderer = request.accepted_renderer
+    if modified is None or not cacheable(request, request.user, renderer):
+        return versions.Validators(version, modified, renderer).stamp(await build())
+
+    cache = caches[CACHE_ALIAS]
+    params = _params_key(request)
+    deadline = time.monotonic() + WAIT_TIMEOUT
+    while True:
+        key = _key(params, version, modified)
+        entry = await cache.aget(key)
+        if entry is not None:
+            return _response(entry, renderer)
+        if await cache.aadd(f'{key}:lock', 1, LOCK_TIMEOUT):
+            break
+        if time.monotonic() >= deadline:
+            return versions.Validators(version, modified, renderer).stamp(await build())
+        await asyncio.sleep(WAIT_INTERVAL)
+        version, modified = await versions.acurrent(*names)
+
+    try:
+        response = await build()
+        if response.status_code == 200:
+            await cache.aset(key, _entry(response, version, modified), TIMEOUT)
+    finally:
+        await cache.adelete(f'{key}:lock')
+    return versions.Validators(version, modified, renderer).stamp(response)
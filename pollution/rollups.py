@@ -0,0 +1,102 @@
+"""
+Инкрементальные счётчики-агрегаты.
+
+Агрегатная таблица хранит строки вида ``(ключ..., count, ...)``. Изменения
+точек превращаются в приращения по ключам и применяются атомарным
+``UPDATE ... SET f = f + delta`` (или ``INSERT`` для нового ключа), так что
+чтение агрегата не требует пересчёта по всем точкам.
+"""
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+# С какого числа ключей приращения применяются пачкой (см. _apply_bulk)
+BULK_THRESHOLD = 50
+LOOKUP_BATCH = 500
+
+
+def collect(changes, keys_for, values_for):
+    """
+    Свести изменения точек в приращения.
+
+    ``keys_for(state)`` возвращает ключи агрегата, затронутые состоянием,
+    ``values_for(state)`` — словарь суммируемых значений (например, ``count``).
+    """
+    deltas = defaultdict(lambda: defaultdict(int))
+    for old, new in changes:
+        for state, sign in ((old, -1), (new, 1)):
+            if state is None:
+                continue
+            values = values_for(state)
+            for key in keys_for(state):
+                for field, value in values.items():
+                    deltas[key][field] += sign * value
+    return deltas
+
+
+def apply_deltas(model, key_fields, deltas):
+    """Применить приращения ``{ключ: {поле: delta}}`` к агрегатной модели."""
+    items = []
+    for key, values in deltas.items():
+        values = {field: value for field, value in values.items() if value}
+        if values:
+            items.append((tuple(key), values))
+    if len(items) > BULK_THRESHOLD and _apply_bulk(model, key_fields, items):
+        return
+    for key, values in items:
+        _apply(model, key_fields, key, values)
+
+
+def _apply(model, key_fields, key, values):
+    lookup = dict(zip(key_fields, key))
+    increments = {field: F(field) + value for field, value in values.items()}
+    if model.objects.filter(**lookup).update(**increments):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **values)
+    except IntegrityError:
+        # Строку успели создать параллельно
+        model.objects.filter(**lookup).update(**increments)
+
+
+def _apply_bulk(model, key_fields, items):
+    """
+    Массовые изменения (``bulk_create`` и ``update`` точек) затрагивают сотни
+    ключей: строки читаются пачками под блокировкой, существующие обновляются
+    одним ``bulk_update``, недостающие создаются одним ``bulk_create``.
+    Возвращает False, если так применить не удалось (тогда — по одному ключу).
+    """
+    # Строки ищутся по самому разнообразному полю ключа, точное сравнение — в Python.
+    # Поля с NULL не годятся: IN (...) не находит NULL.
+    indexes = [i for i in range(len(key_fields)) if all(key[i] is not None for key, _ in items)]
+    if not indexes:
+        return False
+    index = max(indexes, key=lambda i: len({key[i] for key, _ in items}))
+    lookup_values = sorted({key[index] for key, _ in items}, key=str)
+    fields = sorted({field for _, values in items for field in values})
+
+    try:
+        with transaction.atomic():
+            rows = {}
+            for start in range(0, len(lookup_values), LOOKUP_BATCH):
+                batch = lookup_values[start:start + LOOKUP_BATCH]
+                for row in model.objects.select_for_update().filter(**{f'{key_fields[index]}__in': batch}):
+                    rows[tuple(getattr(row, field) for field in key_fields)] = row
+
+            changed, missing = [], []
+            for key, values in items:
+                row = rows.get(key)
+                if row is None:
+                    missing.append(model(**dict(zip(key_fields, key)), **values))
+                    continue
+                for field, value in values.items():
+                    setattr(row, field, getattr(row, field) + value)
+                changed.append(row)
+            model.objects.bulk_update(changed, fields, batch_size=LOOKUP_BATCH)
+            model.objects.bulk_create(missing, batch_size=LOOKUP_BATCH)
+    except IntegrityError:
+        # Часть строк создали параллельно
+        return False
+    return True
@@ -0,0 +1,149 @@
+"""
+Полнотекстовый поиск точек по описанию и комментариям (``points/?q=``).
+
+Индекс — отдельная таблица ``pollution_search`` с одним документом на точку
+(описание и тексты всех комментариев):
+
+* SQLite — виртуальная таблица FTS5, ``rowid`` = id точки. Русской
+  морфологии в FTS5 нет, поэтому и документ, и запрос проходят через
+  стеммер Snowball (pollution.stemming); ранжирование — bm25.
+* PostgreSQL — ``tsvector`` с конфигурацией ``russian`` под GIN-индексом,
+  ранжирование — ``ts_rank``.
+
+На других СУБД поиск сводится к ``icontains`` без ранжирования.
+
+Документ пересобирается, только когда меняется его текст: описание точки
+или текст комментария (прежние значения запоминаются при загрузке из БД).
+Новые и удалённые точки, в том числе из массовой загрузки, индексируются
+по ``points_changed``.
+"""
+from collections import defaultdict
+
+from django.db import connection
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import stemming
+from .models import Comment, PollutionPoint
+from .signals import points_changed
+
+TABLE = 'pollution_search'
+BATCH_SIZE = 500
+
+
+def available(vendor=None):
+    return (vendor or connection.vendor) in ('sqlite', 'postgresql')
+
+
+def _documents(ids, point_model, comment_model):
+    texts = defaultdict(list)
+    for pk, description in point_model.objects.filter(pk__in=ids).values_list('pk', 'description'):
+        texts[pk].append(description or '')
+    for point_id, text in comment_model.objects.filter(point_id__in=ids).order_by('pk').values_list('point_id', 'text'):
+        if point_id in texts and text:
+            texts[point_id].append(text)
+    return {pk: '\n'.join(parts) for pk, parts in texts.items()}
+
+
+def index_points(ids, point_model=PollutionPoint, comment_model=Comment, db=None):
+    """Пересобрать документы точек ``ids``; документы удалённых точек удаляются."""
+    db = db or connection
+    if not available(db.vendor):
+        return
+    ids = list(ids)
+    for start in range(0, len(ids), BATCH_SIZE):
+        batch = ids[start:start + BATCH_SIZE]
+        documents = _documents(batch, point_model, comment_model)
+        with db.cursor() as cursor:
+            if db.vendor == 'sqlite':
+                cursor.executemany(f"DELETE FROM {TABLE} WHERE rowid = %s", [(pk,) for pk in batch])
+                cursor.executemany(
+                    f"INSERT INTO {TABLE} (rowid, body) VALUES (%s, %s)",
+                    [(pk, ' '.join(stemming.stems(text))) for pk, text in documents.items()],
+                )
+            else:
+                missing = [(pk,) for pk in batch if pk not in documents]
+                if missing:
+                    cursor.executemany(f"DELETE FROM {TABLE} WHERE point_id = %s", missing)
+                cursor.executemany(
+                    f"INSERT INTO {TABLE} (point_id, document) VALUES (%s, to_tsvector('russian', %s)) "
+                    f"ON CONFLICT (point_id) DO UPDATE SET document = EXCLUDED.document",
+                    list(documents.items()),
+                )
+
+
+def rebuild(point_model=PollutionPoint, comment_model=Comment, db=None):
+    """Полная переиндексация (для восстановления индекса)."""
+    ids = point_model.objects.order_by('pk').values_list('pk', flat=True)
+    index_points(ids.iterator(), point_model, comment_model, db)
+
+
+def match_query(text):
+    """Запрос FTS5 из основ слов; None, если в тексте нет слов."""
+    terms = stemming.stems(text)
+    # Основы состоят только из букв и цифр; префикс — для недописанного слова
+    return ' '.join(f'"{term}"*' for term in terms) or None
+
+
+def filter_queryset(queryset, text):
+    """Точки, подходящие под запрос, с аннотацией ``search_rank`` (меньше — релевантнее)."""
+    table = PollutionPoint._meta.db_table
+    vendor = connection.vendor
+    if vendor == 'sqlite':
+        query = match_query(text)
+        if query is None:
+            return queryset.none().annotate(search_rank=Value(0.0))
+        matches = RawSQL(f"SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s", [query])
+        rank = RawSQL(
+            f'(SELECT rank FROM {TABLE} WHERE {TABLE} MATCH %s AND rowid = "{table}"."id")', [query],
+            output_field=FloatField(),
+        )
+    elif vendor == 'postgresql':
+        tsquery = "websearch_to_tsquery('russian', %s)"
+        matches = RawSQL(f"SELECT point_id FROM {TABLE} WHERE document @@ {tsquery}", [text])
+        rank = RawSQL(
+            f'(SELECT -ts_rank(document, {tsquery}) FROM {TABLE} WHERE point_id = "{table}"."id")', [text],
+            output_field=FloatField(),
+        )
+    else:
+        return queryset.filter(Q(description__icontains=text) | Q(comments__text__icontains=text)).distinct()
+    return queryset.filter(pk__in=matches).annotate(search_rank=rank)
+
+
+@receiver(post_save, sender=PollutionPoint)
+def point_saved(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    # Новые точки индексируются по points_changed, вместе с массовой загрузкой;
+    # смена статуса и счётчиков документ не меняет
+    if raw or (update_fields is not None and 'description' not in update_fields):
+        return
+    # Неизвестное прежнее описание (None) — переиндексировать
+    old = instance.description if created else instance._saved_description
+    instance._saved_description = instance.description
+    if old != instance.description:
+        index_points([instance.pk])
+
+
+@receiver(points_changed)
+def points_created_or_deleted(sender, changes, **kwargs):
+    ids = [(new or old).id for old, new in changes if old is None or new is None]
+    if ids:
+        index_points(ids)
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields is not None and 'text' not in update_fields):
+        return
+    # Неизвестный прежний текст (None) — переиндексировать
+    old = '' if created else instance._saved_text
+    instance._saved_text = instance.text
+    if old != instance.text:
+        index_points([instance.point_id])
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    if instance.text:
+        index_points([instance.point_id])
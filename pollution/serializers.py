@@ -1,20 +1,33 @@
 from rest_framework import serializers
-from .models import PollutionPoint, Comment
-from users.serializers import UserSerializer, OrganizationSerializer
+from . import analytics, exports, heatmap, images
+from .params import parse_bbox
+from .models import PollutionPoint, Comment, ExportJob
+from users.serializers import UserSerializer, OrganizationSerializer, UserShortSerializer, \
+    OrganizationShortSerializer, PhotoVariantsField
 
 
 class CommentSerializer(serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
+    photo_variants = PhotoVariantsField()
 
     class Meta:
         model = Comment
-        fields = ['id', 'author', 'text', 'photo', 'created_at']
+        fields = ['id', 'author', 'text', 'photo', 'photo_variants', 'created_at', 'updated_at']
+
+
+class SyncCommentSerializer(CommentSerializer):
+    """Комментарий в ленте изменений: с идентификатором точки."""
+
+    class Meta(CommentSerializer.Meta):
+        fields = ['id', 'point'] + CommentSerializer.Meta.fields[1:]
+        read_only_fields = fields
 
 
 class PollutionPointSerializer(serializers.ModelSerializer):
     reporter = UserSerializer(read_only=True)
     handled_by = OrganizationSerializer(read_only=True)
     comments = CommentSerializer(many=True, read_only=True)
+    photo_variants = PhotoVariantsField()
 
     anonymous_name = serializers.CharField(required=False, allow_blank=True)
 
@@ -29,21 +42,85 @@ class PollutionPointSerializer(serializers.ModelSerializer):
             'latitude',
             'longitude',
             'photo',
+            'photo_variants',
             'status',
             'handled_by',
+            'duplicate_of',
+            'reports_count',
             'created_at',
             'updated_at',
             'comments',
         ]
+        extra_kwargs = {
+            'latitude': {'required': False},
+            'longitude': {'required': False},
+        }
         read_only_fields = [
             'reporter',
             'status',
             'handled_by',
+            'duplicate_of',
+            'reports_count',
             'created_at',
             'updated_at',
             'comments',
         ]
 
+    def validate(self, attrs):
+        if self.instance is not None:
+            return attrs
+        if attrs.get('latitude') is None or attrs.get('longitude') is None:
+            # Координаты не переданы — берём их из EXIF GPS фотографии
+            location = images.gps_from_exif(attrs['photo']) if attrs.get('photo') else None
+            if location is None:
+                raise serializers.ValidationError(
+                    "Укажите latitude и longitude или загрузите фото с геометкой."
+                )
+            attrs['latitude'], attrs['longitude'] = location
+        return attrs
+
+
+class PollutionPointListSerializer(serializers.ModelSerializer):
+    """
+    Представление точки для списка: без комментариев и участников организации.
+    Ожидает queryset из PollutionPoint.objects.for_list().
+    """
+    reporter = UserShortSerializer(read_only=True)
+    handled_by = OrganizationShortSerializer(read_only=True)
+    comments_count = serializers.IntegerField(read_only=True)
+    photo_variants = PhotoVariantsField()
+
+    class Meta:
+        model = PollutionPoint
+        fields = [
+            'id',
+            'reporter',
+            'anonymous_name',
+            'pollution_type',
+            'description',
+            'latitude',
+            'longitude',
+            'photo',
+            'photo_variants',
+            'status',
+            'handled_by',
+            'duplicate_of',
+            'reports_count',
+            'created_at',
+            'updated_at',
+            'comments_count',
+        ]
+        read_only_fields = fields
+
+
+class BulkPointSerializer(serializers.Serializer):
+    """Строка массовой загрузки (см. pollution.ingest)."""
+    key = serializers.CharField(max_length=100, required=False)
+    pollution_type = serializers.ChoiceField(choices=PollutionPoint.TYPE_CHOICES)
+    description = serializers.CharField(required=False, allow_blank=True, default='')
+    latitude = serializers.FloatField(min_value=-90, max_value=90)
+    longitude = serializers.FloatField(min_value=-180, max_value=180)
+
 
 class PollutionStatusSerializer(serializers.Serializer):
     STATUS_CHOICES = [
@@ -51,3 +128,118 @@ class PollutionStatusSerializer(serializers.Serializer):
         ('cleaned', 'Очищено'),
     ]
     status = serializers.ChoiceField(choices=STATUS_CHOICES)
+
+
+class BulkStatusSerializer(serializers.Serializer):
+    """Массовая смена статуса: список ``ids`` или область ``bbox``."""
+    MAX_POINTS = 1000
+
+    status = serializers.ChoiceField(choices=PollutionStatusSerializer.STATUS_CHOICES)
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), required=False, allow_empty=False, max_length=MAX_POINTS
+    )
+    bbox = serializers.CharField(required=False)
+
+    def validate_bbox(self, value):
+        return list(parse_bbox(value, param=None))
+
+    def validate(self, attrs):
+        if not attrs.get('ids') and not attrs.get('bbox'):
+            raise serializers.ValidationError("Укажите ids или bbox.")
+        return attrs
+
+
+class IntervalParamsSerializer(serializers.Serializer):
+    """Интервал по дате создания: либо ``period``, либо ``from``/``to`` (полуинтервал [from, to))."""
+    period = serializers.ChoiceField(
+        choices=exports.PERIODS, default='today',
+        error_messages={'invalid_choice': "Неверный параметр period. Используйте: today, week, month, year."},
+    )
+    date_from = serializers.DateTimeField(required=False)
+    date_to = serializers.DateTimeField(required=False)
+
+    def get_fields(self):
+        # from — зарезервированное слово, поэтому поля объявлены как date_from/date_to
+        fields = super().get_fields()
+        fields['from'] = fields.pop('date_from')
+        fields['to'] = fields.pop('date_to')
+        return fields
+
+    def validate(self, attrs):
+        if attrs.get('from') and attrs.get('to') and attrs['from'] >= attrs['to']:
+            raise serializers.ValidationError({"to": "Должно быть позже from."})
+        return attrs
+
+
+class ExportParamsSerializer(IntervalParamsSerializer):
+    """Параметры отчёта: интервал, формат файла и фильтры."""
+    format = serializers.ChoiceField(
+        choices=list(exports.FORMATS), default='xlsx',
+        error_messages={'invalid_choice': "Неверный параметр format. Используйте: xlsx, csv, geojson, parquet."},
+    )
+    pollution_type = serializers.MultipleChoiceField(choices=PollutionPoint.TYPE_CHOICES, required=False)
+    status = serializers.MultipleChoiceField(choices=PollutionPoint.STATUS_CHOICES, required=False)
+    handled_by = serializers.IntegerField(required=False, min_value=1)
+    bbox = serializers.CharField(required=False)
+
+    def validate_format(self, value):
+        if value == 'parquet' and not exports.parquet_available():
+            raise serializers.ValidationError("Выгрузка в Parquet недоступна: не установлен pyarrow.")
+        return value
+
+    def validate_bbox(self, value):
+        return list(parse_bbox(value, param=None))
+
+    @property
+    def params(self):
+        """Нормализованные параметры (JSON-совместимые, для хранения и дедупликации заданий)."""
+        data = dict(self.validated_data)
+        for name in ('from', 'to'):
+            if data.get(name):
+                data[name] = data[name].isoformat()
+        for name in ('pollution_type', 'status'):
+            if name in data:
+                data[name] = sorted(data[name])
+        return data
+
+
+class AnalyticsParamsSerializer(IntervalParamsSerializer):
+    """Параметры points/analytics/: интервал (по умолчанию — текущий год) и ``group_by``."""
+    period = serializers.ChoiceField(
+        choices=exports.PERIODS, default='year',
+        error_messages={'invalid_choice': "Неверный параметр period. Используйте: today, week, month, year."},
+    )
+    group_by = serializers.CharField(required=False, default='')
+
+    def validate_group_by(self, value):
+        names = list(dict.fromkeys(name for name in value.split(',') if name))
+        if any(name not in analytics.GROUP_FIELDS for name in names):
+            raise serializers.ValidationError(f"Допустимые значения: {', '.join(analytics.GROUP_FIELDS)}.")
+        return names
+
+
+class HeatmapParamsSerializer(serializers.Serializer):
+    """Параметры points/heatmap/; type и status можно повторять."""
+    bbox = serializers.CharField(default='-180,-90,180,90')
+    cell_size = serializers.FloatField(required=False, min_value=heatmap.MIN_CELL_SIZE, max_value=90)
+    type = serializers.MultipleChoiceField(choices=PollutionPoint.TYPE_CHOICES, required=False)
+    status = serializers.MultipleChoiceField(choices=PollutionPoint.STATUS_CHOICES, required=False)
+    half_life_days = serializers.FloatField(required=False, min_value=0.01)
+
+    def validate_bbox(self, value):
+        return parse_bbox(value, param=None)
+
+
+class ExportJobSerializer(serializers.ModelSerializer):
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ExportJob
+        fields = ['id', 'params', 'status', 'error', 'download_url', 'created_at', 'started_at', 'finished_at']
+        read_only_fields = fields
+
+    def get_download_url(self, obj):
+        if obj.status != 'done' or not obj.file:
+            return None
+        request = self.context.get('request')
+        return request.build_absolute_uri(obj.file.url) if request else obj.file.url
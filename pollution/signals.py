@@ -0,0 +1,56 @@
+"""
+Единая точка оповещения об изменениях точек загрязнения.
+
+``points_changed`` отправляется с ``changes`` — списком пар
+``(old_state, new_state)`` из ``PointState``; ``None`` слева означает создание,
+справа — удаление. Обычные ``save()``/``delete()`` переводятся в него
+автоматически, массовые операции (``bulk_create``, ``update``) отправляют его
+сами. На сигнал подписаны инкрементальные агрегаты: кластеры, статистика и т.д.
+"""
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+
+from .models import PollutionPoint
+
+points_changed = Signal()
+
+
+@receiver(post_save, sender=PollutionPoint)
+def point_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    old = None if created else instance._saved_state
+    new = instance.state()
+    instance._saved_state = new
+    if old != new:
+        points_changed.send(sender=PollutionPoint, changes=[(old, new)])
+
+
+@receiver(post_delete, sender=PollutionPoint)
+def point_deleted(sender, instance, **kwargs):
+    old = instance._saved_state or instance.state()
+    instance._saved_state = None
+    points_changed.send(sender=PollutionPoint, changes=[(old, None)])
+
+
+@receiver(pre_delete, sender=PollutionPoint)
+def point_deleting(sender, instance, **kwargs):
+    """
+    Повторные сообщения удаляемой точки становятся самостоятельными. SET_NULL
+    при удалении обходит save() и сигналы, поэтому ссылка снимается здесь.
+    """
+    promoted = list(PollutionPoint.objects.filter(duplicate_of=instance.pk))
+    if not promoted:
+        return
+    # updated_at — чтобы точки попали в ленту синхронизации (см. pollution.sync)
+    PollutionPoint.objects.filter(pk__in=[point.pk for point in promoted]).update(
+        duplicate_of=None, updated_at=timezone.now()
+    )
+    changes = []
+    for point in promoted:
+        old = point._saved_state
+        point.duplicate_of_id = None
+        point._saved_state = point.state()
+        changes.append((old, point._saved_state))
+    points_changed.send(sender=PollutionPoint, changes=changes)
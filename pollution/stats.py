@@ -0,0 +1,163 @@
+"""
+Суточная статистика по точкам загрязнения.
+
+``DailyStat`` хранит число точек по дню создания, типу, статусу и
+обрабатывающей организации и обновляется инкрементально по сигналу
+``points_changed``. Дашборды и сводка отчёта читают O(дней) строк вместо
+пересчёта по всем точкам. Строки без организации уникальны по отдельному
+частичному индексу, при удалении организации её строки сливаются с ними.
+
+``ReporterStat`` — то же по автору точки (тип × статус), из него собираются
+счётчики профиля без чтения самих точек. Повторные сообщения (``duplicate_of``)
+в нём не считаются, как и в списке точек, на который ведёт профиль.
+"""
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, DurationField, ExpressionWrapper, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.db.models.signals import post_delete, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from users.models import Organization
+
+from . import rollups
+from .models import DailyStat, PollutionPoint, ReporterStat
+from .signals import points_changed
+
+KEY_FIELDS = ('day', 'pollution_type', 'status', 'handled_by_id')
+REPORTER_KEY_FIELDS = ('reporter_id', 'pollution_type', 'status')
+
+# Допустимые измерения ?group_by= и соответствующие поля DailyStat
+GROUP_FIELDS = {
+    'day': ['day'],
+    'pollution_type': ['pollution_type'],
+    'status': ['status'],
+    'organization': ['handled_by_id', 'handled_by__name'],
+}
+
+
+def _keys(state):
+    return [(timezone.localdate(state.created_at), state.pollution_type, state.status, state.handled_by_id)]
+
+
+def _values(state):
+    return {'count': 1}
+
+
+@receiver(points_changed)
+def update_daily_stats(sender, changes, **kwargs):
+    deltas = rollups.collect(changes, _keys, _values)
+    rollups.apply_deltas(DailyStat, KEY_FIELDS, deltas)
+
+
+def _reporter_keys(state):
+    if state.reporter_id is None or state.duplicate_of_id is not None:
+        return []
+    return [(state.reporter_id, state.pollution_type, state.status)]
+
+
+@receiver(points_changed)
+def update_reporter_stats(sender, changes, **kwargs):
+    deltas = rollups.collect(changes, _reporter_keys, _values)
+    rollups.apply_deltas(ReporterStat, REPORTER_KEY_FIELDS, deltas)
+
+
+@receiver(pre_delete, sender=Organization)
+def organization_deleting(sender, instance, **kwargs):
+    # Точки организации останутся без неё (SET_NULL, без points_changed):
+    # её строки переносятся в строки «без организации» до обнуления ссылок
+    rows = DailyStat.objects.filter(handled_by=instance.pk)
+    deltas = {
+        (day, pollution_type, status, None): {'count': count}
+        for day, pollution_type, status, count in rows.values_list('day', 'pollution_type', 'status', 'count')
+    }
+    rows.delete()
+    rollups.apply_deltas(DailyStat, KEY_FIELDS, deltas)
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def reporter_deleted(sender, instance, **kwargs):
+    # После коммита: каскадно удаляемые точки пользователя ещё меняют счётчики
+    user_id = instance.pk
+    transaction.on_commit(lambda: ReporterStat.objects.filter(reporter_id=user_id).delete())
+
+
+def rebuild(point_model=PollutionPoint, stat_model=DailyStat):
+    """Полный пересчёт статистики (для миграций и восстановления)."""
+    stat_model.objects.all().delete()
+    rows = (
+        point_model.objects
+        .annotate(day=TruncDate('created_at'))
+        .values('day', 'pollution_type', 'status', 'handled_by_id')
+        .annotate(count=Count('id'))
+        .order_by()
+    )
+    stat_model.objects.bulk_create([stat_model(**row) for row in rows.iterator()], batch_size=1000)
+
+
+def rebuild_reporters(point_model=PollutionPoint, stat_model=ReporterStat):
+    """Полный пересчёт счётчиков пользователей."""
+    stat_model.objects.all().delete()
+    rows = (
+        point_model.objects
+        .filter(reporter__isnull=False, duplicate_of__isnull=True)
+        .values('reporter_id', 'pollution_type', 'status')
+        .annotate(count=Count('id'))
+        .order_by()
+    )
+    stat_model.objects.bulk_create([stat_model(**row) for row in rows.iterator()], batch_size=1000)
+
+
+def reporter_summary(user_id):
+    """Счётчики точек пользователя: ``{total, by_status, by_type}`` (все значения, включая нули)."""
+    by_status = {status: 0 for status, _ in PollutionPoint.STATUS_CHOICES}
+    by_type = {pollution_type: 0 for pollution_type, _ in PollutionPoint.TYPE_CHOICES}
+    rows = ReporterStat.objects.filter(reporter_id=user_id, count__gt=0).values_list('pollution_type', 'status', 'count')
+    for pollution_type, status, count in rows:
+        by_status[status] = by_status.get(status, 0) + count
+        by_type[pollution_type] = by_type.get(pollution_type, 0) + count
+    return {'total': sum(by_status.values()), 'by_status': by_status, 'by_type': by_type}
+
+
+def organization_workload(organization_id):
+    """
+    Нагрузка организации: число точек по статусам и медиана времени от начала
+    работ до очистки (часы). Считается в БД: счётчики одним агрегатом, медиана —
+    выборкой середины упорядоченных длительностей.
+    """
+    points = PollutionPoint.objects.filter(handled_by_id=organization_id)
+    finished = Q(status='cleaned', started_at__isnull=False, cleaned_at__isnull=False)
+    counts = points.aggregate(
+        open=Count('id', filter=Q(status='new')),
+        in_progress=Count('id', filter=Q(status='in_progress')),
+        cleaned=Count('id', filter=Q(status='cleaned')),
+        timed=Count('id', filter=finished),
+    )
+    timed = counts.pop('timed')
+    median = None
+    if timed:
+        durations = (
+            points.filter(finished)
+            .annotate(duration=ExpressionWrapper(F('cleaned_at') - F('started_at'), output_field=DurationField()))
+            .order_by('duration')
+            .values_list('duration', flat=True)
+        )
+        # Одно значение для нечётного числа, два средних — для чётного
+        middle = list(durations[(timed - 1) // 2:timed // 2 + 1])
+        median = round(sum(middle, datetime.timedelta()).total_seconds() / len(middle) / 3600, 2)
+    return {**counts, 'median_cleanup_hours': median}
+
+
+def grouped(queryset, group_by):
+    """Суммы ``count`` по измерениям ``group_by`` (ключи ``GROUP_FIELDS``)."""
+    fields = [field for name in group_by for field in GROUP_FIELDS[name]]
+    return (
+        queryset
+        .values(*fields)
+        .annotate(total=Sum('count'))
+        .filter(total__gt=0)
+        .order_by(*fields)
+    )
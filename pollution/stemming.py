@@ -0,0 +1,99 @@
+"""
+Стеммер русского языка (алгоритм Snowball) для полнотекстового поиска на
+SQLite, где у FTS5 нет русской морфологии (см. pollution.search). На
+PostgreSQL то же делает конфигурация ``russian``.
+"""
+import re
+
+VOWELS = 'аеиоуыэюя'
+
+PERFECTIVE_GERUND = (('в', 'вши', 'вшись'), ('ив', 'ивши', 'ившись', 'ыв', 'ывши', 'ывшись'))
+ADJECTIVE = (
+    'ее', 'ие', 'ые', 'ое', 'ими', 'ыми', 'ей', 'ий', 'ый', 'ой', 'ем', 'им', 'ым', 'ом',
+    'его', 'ого', 'ему', 'ому', 'их', 'ых', 'ую', 'юю', 'ая', 'яя', 'ою', 'ею',
+)
+PARTICIPLE = (('ем', 'нн', 'вш', 'ющ', 'щ'), ('ивш', 'ывш', 'ующ'))
+REFLEXIVE = ('ся', 'сь')
+VERB = (
+    ('ла', 'на', 'ете', 'йте', 'ли', 'й', 'л', 'ем', 'н', 'ло', 'но', 'ет', 'ют', 'ны', 'ть', 'ешь', 'нно'),
+    ('ила', 'ыла', 'ена', 'ейте', 'уйте', 'ите', 'или', 'ыли', 'ей', 'уй', 'ил', 'ыл', 'им', 'ым', 'ен',
+     'ило', 'ыло', 'ено', 'ят', 'ует', 'уют', 'ит', 'ыт', 'ены', 'ить', 'ыть', 'ишь', 'ую', 'ю'),
+)
+NOUN = (
+    'а', 'ев', 'ов', 'ие', 'ье', 'е', 'иями', 'ями', 'ами', 'еи', 'ии', 'и', 'ией', 'ей', 'ой', 'ий', 'й',
+    'иям', 'ям', 'ием', 'ем', 'ам', 'ом', 'о', 'у', 'ах', 'иях', 'ях', 'ы', 'ь', 'ию', 'ью', 'ю', 'ия', 'ья', 'я',
+)
+SUPERLATIVE = ('ейш', 'ейше')
+DERIVATIONAL = ('ост', 'ость')
+
+_WORD = re.compile(r'\w+')
+
+
+def _by_length(endings):
+    return sorted(endings, key=len, reverse=True)
+
+
+def _strip(word, start, endings, after_a=False):
+    """Отрезать самое длинное окончание из ``endings``, лежащее в word[start:]; None, если его нет."""
+    for ending in _by_length(endings):
+        if not word.endswith(ending) or len(word) - len(ending) < start:
+            continue
+        # Окончания первой группы допустимы только после «а» или «я» (тоже внутри области)
+        if after_a and (len(word) - len(ending) - 1 < start or word[-len(ending) - 1] not in 'ая'):
+            continue
+        return word[:-len(ending)]
+    return None
+
+
+def _strip_grouped(word, start, groups):
+    first, second = groups
+    candidates = [_strip(word, start, first, after_a=True), _strip(word, start, second)]
+    candidates = [stem for stem in candidates if stem is not None]
+    # Из двух групп выбирается более длинное окончание, то есть более короткая основа
+    return min(candidates, key=len) if candidates else None
+
+
+def _region_after_vowel_consonant(word, start):
+    for i in range(start + 1, len(word)):
+        if word[i] not in VOWELS and word[i - 1] in VOWELS:
+            return i + 1
+    return len(word)
+
+
+def stem(word):
+    word = word.lower().replace('ё', 'е')
+    rv = next((i + 1 for i, char in enumerate(word) if char in VOWELS), len(word))
+    r1 = _region_after_vowel_consonant(word, 0)
+    r2 = _region_after_vowel_consonant(word, r1)
+
+    # Шаг 1
+    stemmed = _strip_grouped(word, rv, PERFECTIVE_GERUND)
+    if stemmed is not None:
+        word = stemmed
+    else:
+        word = _strip(word, rv, REFLEXIVE) or word
+        adjective = _strip(word, rv, ADJECTIVE)
+        if adjective is not None:
+            word = _strip_grouped(adjective, rv, PARTICIPLE) or adjective
+        else:
+            word = _strip_grouped(word, rv, VERB) or _strip(word, rv, NOUN) or word
+    # Шаг 2
+    if word.endswith('и') and len(word) - 1 >= rv:
+        word = word[:-1]
+    # Шаг 3
+    word = _strip(word, r2, DERIVATIONAL) or word
+    # Шаг 4
+    if word.endswith('нн') and len(word) - 1 > rv:
+        word = word[:-1]
+    else:
+        superlative = _strip(word, rv, SUPERLATIVE)
+        if superlative is not None:
+            word = superlative[:-1] if superlative.endswith('нн') else superlative
+        elif word.endswith('ь') and len(word) - 1 >= rv:
+            word = word[:-1]
+    return word
+
+
+def stems(text):
+    """Основы слов текста по порядку."""
+    return [stem(word) for word in _WORD.findall(text or '')]
@@ -0,0 +1,141 @@
+"""
+Лента изменений для офлайн-клиентов (``points/changes/?since=<token>``).
+
+Три потока читаются по составным индексам в порядке ``(время, id)``:
+точки и комментарии по ``updated_at``, удаления — по журналу ``Tombstone``.
+Токен хранит позицию в каждом потоке, поэтому следующий запрос отдаёт только
+то, что изменилось после неё, а объём ответа пропорционален числу изменений.
+
+В ленту попадают только строки старше ``LAG``: транзакция, которая записала
+время раньше, а закоммитилась позже, не проскочит мимо уже выданного токена.
+Ограничение: если между ``updated_at`` и коммитом прошло больше ``LAG`` (долгая
+транзакция, ожидание блокировки), строка окажется позади уже выданных
+токенов, и клиенты получат её только при следующем изменении или полной
+синхронизации. Поэтому ``LAG`` (``SYNC_LAG_SECONDS``) должен превышать
+длительность самой долгой пишущей транзакции. Последовательность вместо
+времени этого не исправит: номер тоже выдаётся до коммита.
+Журнал удалений хранится ``TOMBSTONE_RETENTION``; более старый токен
+отвергается, и клиент выполняет полную синхронизацию (запрос без since).
+
+Изменения, записанные через ``update()``, должны сами выставлять
+``updated_at`` — иначе они в ленту не попадут.
+
+Повторные сообщения (``duplicate_of``) в ленту не попадают, как и в список.
+"""
+import base64
+import datetime
+import json
+
+from django.conf import settings
+from django.db.models import Q
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Comment, PollutionPoint, Tombstone
+
+LAG = datetime.timedelta(seconds=getattr(settings, 'SYNC_LAG_SECONDS', 2))
+TOMBSTONE_RETENTION = datetime.timedelta(days=30)
+DEFAULT_LIMIT = 500
+MAX_LIMIT = 2000
+
+STREAMS = ('points', 'comments', 'deleted')
+
+
+class InvalidToken(ValueError):
+    pass
+
+
+class ExpiredToken(InvalidToken):
+    pass
+
+
+@receiver(post_delete, sender=PollutionPoint)
+def point_deleted(sender, instance, **kwargs):
+    Tombstone.objects.create(kind='point', object_id=instance.pk)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    Tombstone.objects.create(kind='comment', object_id=instance.pk)
+
+
+def prune(now=None):
+    """Удалить записи журнала старше срока хранения; возвращает их число."""
+    now = now or timezone.now()
+    deleted, _ = Tombstone.objects.filter(deleted_at__lt=now - TOMBSTONE_RETENTION).delete()
+    return deleted
+
+
+def encode_token(positions):
+    data = json.dumps([positions[stream] for stream in STREAMS], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(data).decode('ascii')
+
+
+def decode_token(token):
+    try:
+        data = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+        positions = {}
+        for stream, (moment, pk) in zip(STREAMS, data, strict=True):
+            moment = parse_datetime(moment)
+            if moment is None or not isinstance(pk, int):
+                raise ValueError
+            positions[stream] = (moment, pk)
+    except (TypeError, ValueError, UnicodeError):
+        raise InvalidToken("Некорректный токен синхронизации.")
+    if positions['deleted'][0] < timezone.now() - TOMBSTONE_RETENTION:
+        raise ExpiredToken("Токен устарел, выполните полную синхронизацию.")
+    return positions
+
+
+def _after(field, position):
+    moment, pk = position
+    return Q(**{f'{field}__gt': moment}) | Q(**{field: moment, 'pk__gt': pk})
+
+
+def _read(queryset, field, position, horizon, limit):
+    """Порция потока после ``position``; возвращает (строки, новая позиция, есть ли ещё)."""
+    queryset = queryset.filter(**{f'{field}__lt': horizon})
+    if position is not None:
+        queryset = queryset.filter(_after(field, position))
+    rows = list(queryset.order_by(field, 'pk')[:limit + 1])
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        return rows, (getattr(last, field), last.pk), True
+    # Всё, что старше горизонта, выдано
+    return rows, (horizon, 0), False
+
+
+def changes(token=None, limit=DEFAULT_LIMIT):
+    """
+    Изменения после токена: ``{points, comments, deleted, positions, has_more}``.
+    Без токена — полная выгрузка без удалений (журнал начинается с текущего момента).
+    """
+    horizon = timezone.now() - LAG
+    if token:
+        positions = decode_token(token)
+    else:
+        positions = {'points': None, 'comments': None, 'deleted': (horizon, 0)}
+
+    points, positions['points'], more_points = _read(
+        PollutionPoint.objects.for_list().filter(duplicate_of__isnull=True), 'updated_at', positions['points'], horizon, limit
+    )
+    comments, positions['comments'], more_comments = _read(
+        Comment.objects.select_related('author'), 'updated_at', positions['comments'], horizon, limit
+    )
+    tombstones, positions['deleted'], more_deleted = _read(
+        Tombstone.objects.all(), 'deleted_at', positions['deleted'], horizon, limit
+    )
+    deleted = {'points': [], 'comments': []}
+    for tombstone in tombstones:
+        deleted[f'{tombstone.kind}s'].append(tombstone.object_id)
+
+    return {
+        'points': points,
+        'comments': comments,
+        'deleted': deleted,
+        'positions': {stream: [moment.isoformat(), pk] for stream, (moment, pk) in positions.items()},
+        'has_more': more_points or more_comments or more_deleted,
+    }
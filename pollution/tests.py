@@ -1,3 +1,1877 @@
-from django.test import TestCase
+import asyncio
+import base64
+import codecs
+import csv
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.core.exceptions import SynchronousOnlyOperation
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Sum
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
+import openpyxl
+from PIL import Image, ImageOps, PngImagePlugin
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+
+from config.pagination import KeysetCursorPagination
+from pollution import (
+    analytics, clusters, duplicates, events, exports, geo, heatmap, images, ingest, jobs, response_cache, search, stats, stemming,
+    sync, tiles, versions,
+)
+from pollution.models import (
+    ClusterCell, CollectionVersion, DailyStat, ExportJob, MediaBlob, PhotoJob, PollutionPoint, Comment, Tombstone,
+)
+from pollution.serializers import BulkStatusSerializer
+from pollution.views import PollutionPointViewSet
+from users.models import User, Organization
+
+
+class QueryCountTestCase(TestCase):
+    """
+    Регрессионные тесты на N+1: число запросов эндпоинта не должно зависеть
+    от объёма данных.
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.organization = Organization.objects.create(name='Чистый берег')
+        self.user = User.objects.create_user('operator', password='secret', organization=self.organization)
+        self.client.force_authenticate(self.user)
+        self.point = self.add_points(1)[0]
+
+    def add_points(self, count):
+        points = []
+        for i in range(count):
+            n = PollutionPoint.objects.count()
+            organization = Organization.objects.create(name=f'org-{n}')
+            User.objects.create_user(f'member-{n}', organization=organization)
+            reporter = User.objects.create_user(f'reporter-{n}', organization=organization)
+            point = PollutionPoint.objects.create(
+                reporter=reporter,
+                handled_by=organization,
+                pollution_type='trash',
+                latitude=55.7 + i * 0.001,
+                longitude=37.6 + i * 0.001,
+            )
+            for j in range(2):
+                author = User.objects.create_user(f'author-{n}-{j}')
+                Comment.objects.create(point=point, author=author, text='Всё ещё грязно')
+            points.append(point)
+        return points
+
+    def add_comments(self, point, count):
+        for i in range(count):
+            author = User.objects.create_user(f'extra-author-{point.pk}-{i}')
+            Comment.objects.create(point=point, author=author, text='Подтверждаю')
+
+    def assertConstantQueries(self, request, grow):
+        with CaptureQueriesContext(connection) as small:
+            response = request()
+        self.assertLess(response.status_code, 400)
+        grow()
+        with CaptureQueriesContext(connection) as large:
+            response = request()
+        self.assertLess(response.status_code, 400)
+        self.assertEqual(
+            len(small), len(large),
+            "\n".join(query['sql'] for query in large.captured_queries),
+        )
+
+
+class PollutionPointViewSetQueryCountTests(QueryCountTestCase):
+
+    def test_list(self):
+        self.assertConstantQueries(
+            lambda: self.client.get('/api/pollutions/points/'),
+            lambda: self.add_points(5),
+        )
+
+    def test_list_bbox(self):
+        self.assertConstantQueries(
+            lambda: self.client.get('/api/pollutions/points/?bbox=37,55,38,56'),
+            lambda: self.add_points(5),
+        )
+
+    def test_retrieve(self):
+        self.assertConstantQueries(
+            lambda: self.client.get(f'/api/pollutions/points/{self.point.pk}/'),
+            lambda: self.add_comments(self.point, 5),
+        )
+
+    def test_partial_update(self):
+        # Каждый раз новое описание: документ поиска пересобирается в обоих запросах
+        descriptions = iter(['upd', 'upd again'])
+        self.assertConstantQueries(
+            lambda: self.client.patch(f'/api/pollutions/points/{self.point.pk}/', {'description': next(descriptions)}),
+            lambda: self.add_comments(self.point, 5),
+        )
+
+    def test_set_status(self):
+        def request():
+            return self.client.patch(f'/api/pollutions/points/{self.point.pk}/set-status/', {'status': 'cleaned'})
+
+        def reset():
+            point = PollutionPoint.objects.get(pk=self.point.pk)
+            point.status = 'new'
+            point.save()
+
+        # Прогрев: строки агрегатов для нового состояния уже существуют
+        request()
+        reset()
+        self.assertConstantQueries(request, lambda: (self.add_comments(self.point, 5), reset()))
+
+    def test_comments(self):
+        self.assertConstantQueries(
+            lambda: self.client.get(f'/api/pollutions/points/{self.point.pk}/comments/'),
+            lambda: self.add_comments(self.point, 5),
+        )
+
+    def test_clusters(self):
+        self.assertConstantQueries(
+            lambda: self.client.get('/api/pollutions/points/clusters/?zoom=10'),
+            lambda: self.add_points(5),
+        )
+
+    def test_export(self):
+        def request():
+            response = self.client.get('/api/pollutions/points/export/?period=today')
+            b''.join(response.streaming_content)
+            return response
+
+        self.assertConstantQueries(request, lambda: self.add_points(5))
+
+
+class CommentViewSetQueryCountTests(QueryCountTestCase):
+
+    def test_retrieve(self):
+        # Список points/{id}/comments/ обслуживает действие PollutionPointViewSet.comments
+        comment = self.point.comments.first()
+        self.assertConstantQueries(
+            lambda: self.client.get(f'/api/pollutions/points/{self.point.pk}/comments/{comment.pk}/'),
+            lambda: self.add_comments(self.point, 5),
+        )
+
+
+@override_settings(TILE_CACHE_DIR=tempfile.mkdtemp())
+class PointTileQueryCountTests(QueryCountTestCase):
+
+    def test_tile(self):
+        z = 8
+        x, y = tiles.tile_for(55.7, 37.6, z)
+
+        def request():
+            tiles.invalidate([self.point.state()])
+            return self.client.get(f'/api/pollutions/tiles/{z}/{x}/{y}.mvt')
+
+        self.assertConstantQueries(request, lambda: self.add_points(5))
+
+
+class BulkIngestTests(TestCase):
+    url = '/api/pollutions/points/bulk/'
+
+    def setUp(self):
+        self.client = APIClient()
+        self.organization = Organization.objects.create(name='Партнёр')
+        self.user = User.objects.create_user('partner', organization=self.organization)
+        self.client.force_authenticate(self.user)
+
+    def upload(self, body, content_type, **headers):
+        response = self.client.generic('POST', self.url, body.encode(), content_type, headers=headers)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_jsonl(self):
+        body = '\n'.join([
+            '{"pollution_type": "oil", "latitude": 55.7, "longitude": 37.6}',
+            '',
+            '[1, 2]',
+            '{"pollution_type": "lava", "latitude": 55.7, "longitude": 37.6}',
+            '{"pollution_type": "trash", "latitude": 55.8, "longitude": 37.7, "description": "Свалка"}',
+        ])
+        report = self.upload(body, 'application/x-ndjson')
+        self.assertEqual(report['created'], 2)
+        self.assertEqual([error['row'] for error in report['errors']], [3, 4])
+        point = PollutionPoint.objects.get(description='Свалка')
+        self.assertEqual(point.reporter, self.user)
+        self.assertTrue(point.geohash)
+
+    def test_csv(self):
+        body = 'pollution_type,latitude,longitude,description\noil,55.7,37.6,\ntrash,север,37.6,x\n'
+        report = self.upload(body, 'text/csv')
+        self.assertEqual(report['created'], 1)
+        self.assertEqual([error['row'] for error in report['errors']], [3])
+
+    def test_geojson(self):
+        point = {'type': 'Point', 'coordinates': [37.6, 55.7]}
+        body = json.dumps({'type': 'FeatureCollection', 'features': [
+            {'type': 'Feature', 'id': 'a', 'geometry': point, 'properties': {'pollution_type': 'oil'}},
+            5,
+            {'type': 'Feature', 'geometry': 5, 'properties': {'pollution_type': 'oil'}},
+            {'type': 'Feature', 'geometry': {'type': 'LineString', 'coordinates': [[0, 0], [1, 1]]}},
+            {'type': 'Feature', 'geometry': point, 'properties': [1]},
+        ]})
+        report = self.upload(body, 'application/geo+json')
+        self.assertEqual(report['created'], 1)
+        self.assertEqual([error['row'] for error in report['errors']], [2, 3, 4, 5])
+        self.assertEqual(PollutionPoint.objects.get().import_key, 'a')
+
+    def test_geojson_features_not_list(self):
+        body = json.dumps({'type': 'FeatureCollection', 'features': {'a': 1}})
+        response = self.client.generic('POST', self.url, body.encode(), 'application/geo+json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_idempotent_retry(self):
+        body = '{"pollution_type": "oil", "latitude": 55.7, "longitude": 37.6}\n' * 3
+        first = self.upload(body, 'application/x-ndjson', **{'Idempotency-Key': 'upload-1'})
+        second = self.upload(body, 'application/x-ndjson', **{'Idempotency-Key': 'upload-1'})
+        self.assertEqual((first['created'], first['skipped']), (3, 0))
+        self.assertEqual((second['created'], second['skipped']), (0, 3))
+        self.assertEqual(PollutionPoint.objects.count(), 3)
+
+    def test_long_idempotency_key(self):
+        body = '{"pollution_type": "oil", "latitude": 55.7, "longitude": 37.6}\n'
+        key = 'k' * 500
+        self.upload(body, 'application/x-ndjson', **{'Idempotency-Key': key})
+        report = self.upload(body, 'application/x-ndjson', **{'Idempotency-Key': key})
+        self.assertEqual(report['skipped'], 1)
+        self.assertLessEqual(len(PollutionPoint.objects.get().import_key), 100)
+
+    def test_unrelated_integrity_error(self):
+        points = [ingest._build(1, {'pollution_type': 'oil', 'latitude': 55.7, 'longitude': 37.6}, self.user, None)]
+        error = IntegrityError('NOT NULL constraint failed: pollution_pollutionpoint.latitude')
+        with mock.patch.object(PollutionPoint.objects, 'bulk_create', side_effect=error) as bulk_create:
+            with self.assertRaises(IntegrityError):
+                ingest._write(points, self.user, ingest.Report())
+        self.assertEqual(bulk_create.call_count, 1)
+
+    def stale_keys(self, *results):
+        """_existing_keys, у которого проверка перед записью не видит ключей параллельной загрузки."""
+        existing_keys = ingest._existing_keys
+        results = iter(results)
+
+        def side_effect(*args):
+            result = next(results, None)
+            return existing_keys(*args) if result is None else result
+        return mock.patch.object(ingest, '_existing_keys', side_effect=side_effect)
+
+    def test_import_key_race_retries(self):
+        PollutionPoint.objects.create(reporter=self.user, import_key='k', pollution_type='oil',
+                                      latitude=55.7, longitude=37.6)
+        point = ingest._build(1, {'pollution_type': 'oil', 'latitude': 55.7, 'longitude': 37.6, 'key': 'k'},
+                              self.user, None)
+        report = ingest.Report()
+        bulk_create = PollutionPoint.objects.bulk_create
+        with self.stale_keys(set()), \
+                mock.patch.object(PollutionPoint.objects, 'bulk_create', wraps=bulk_create) as patched:
+            ingest._write([point], self.user, report)
+        self.assertEqual(patched.call_count, 2)
+        self.assertEqual((report.created, report.skipped), (0, 1))
+        self.assertEqual(PollutionPoint.objects.count(), 1)
+
+    def test_import_key_race_is_bounded(self):
+        PollutionPoint.objects.create(reporter=self.user, import_key='k', pollution_type='oil',
+                                      latitude=55.7, longitude=37.6)
+        point = ingest._build(1, {'pollution_type': 'oil', 'latitude': 55.7, 'longitude': 37.6, 'key': 'k'},
+                              self.user, None)
+        bulk_create = PollutionPoint.objects.bulk_create
+        # Перед каждой попыткой ключ «ещё не виден», после ошибки — виден
+        with self.stale_keys(*[result for _ in range(ingest.WRITE_ATTEMPTS) for result in (set(), None)]), \
+                mock.patch.object(PollutionPoint.objects, 'bulk_create', wraps=bulk_create) as patched:
+            with self.assertRaises(IntegrityError):
+                ingest._write([point], self.user, ingest.Report())
+        self.assertEqual(patched.call_count, ingest.WRITE_ATTEMPTS)
+
+    def test_invalid_utf8(self):
+        row = '{"pollution_type": "oil", "latitude": 55.7, "longitude": 37.6, "description": "%s"}\n'
+        body = (row % 'a').encode() + (row % 'b').encode('cp1251').replace(b'"b"', '"Пятно"'.encode('cp1251'))
+        body += (row % 'c').encode()
+        response = self.client.generic('POST', self.url, codecs.BOM_UTF8 + body, 'application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        report = response.json()
+        self.assertEqual(report['created'], 2)
+        self.assertEqual([error['row'] for error in report['errors']], [2])
+
+        body = 'pollution_type,latitude,longitude,description\noil,55.7,37.6,a\noil,55.7,37.6,Пятно\n'
+        response = self.client.generic('POST', self.url, body.encode('cp1251'), 'text/csv')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['created'], 1)
+        self.assertEqual([error['row'] for error in response.json()['errors']], [3])
+
+        response = self.client.generic('POST', self.url, '{"type": "Пятно"}'.encode('cp1251'), 'application/geo+json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_malformed_csv(self):
+        report = self.upload('pollution_type,latitude,longitude,description\n'
+                             'oil,55.7,37.6,a\noil,55.7,37.6,"не закрыта\n', 'text/csv')
+        self.assertEqual(report['created'], 1)
+        self.assertEqual([error['row'] for error in report['errors']], [3])
+
+        huge = 'x' * (csv.field_size_limit() + 1)
+        report = self.upload(f'pollution_type,latitude,longitude,description\noil,55.7,37.6,{huge}\n', 'text/csv')
+        self.assertEqual(report['created'], 0)
+        self.assertEqual([error['row'] for error in report['errors']], [2])
+
+
+def image_file(name, seed):
+    """PNG из случайных пикселей: разные seed — непохожие фото, одинаковые — один файл."""
+    buffer = io.BytesIO()
+    Image.frombytes('RGB', (32, 32), random.Random(seed).randbytes(32 * 32 * 3)).save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), BACKGROUND_WORKERS=0)
+class PhotoStorageTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user('reporter')
+        self.client.force_authenticate(self.user)
+
+    def blob_refs(self, name):
+        return MediaBlob.objects.filter(name=name).values_list('refs', flat=True).first()
+
+    def test_replace_photo_releases_old_blob(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/pollutions/points/', {
+                'pollution_type': 'trash', 'latitude': 55.7, 'longitude': 37.6, 'photo': image_file('a.png', 1),
+            }, format='multipart')
+        point = PollutionPoint.objects.get(pk=response.json()['id'])
+        old_name = point.photo.name
+        self.assertEqual(self.blob_refs(old_name), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(f'/api/pollutions/points/{point.pk}/', {
+                'photo': image_file('b.png', 2),
+            }, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        point.refresh_from_db()
+        self.assertNotEqual(point.photo.name, old_name)
+        self.assertIsNone(self.blob_refs(old_name))
+        self.assertFalse(point.photo.storage.exists(old_name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            point.delete()
+        self.assertFalse(MediaBlob.objects.exists())
+
+    def test_shared_blob_survives_replacement(self):
+        point = PollutionPoint.objects.create(pollution_type='oil', latitude=55.7, longitude=37.6,
+                                              photo=image_file('a.png', 1))
+        comment = Comment.objects.create(point=point, author=self.user, photo=image_file('copy.png', 1))
+        self.assertEqual(comment.photo.name, point.photo.name)
+        self.assertEqual(self.blob_refs(point.photo.name), 2)
+
+        shared = point.photo.name
+        with self.captureOnCommitCallbacks(execute=True):
+            point.photo = image_file('b.png', 2)
+            point.save()
+        self.assertEqual(self.blob_refs(shared), 1)
+        self.assertTrue(comment.photo.storage.exists(shared))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            comment.photo = None
+            comment.save()
+        self.assertIsNone(self.blob_refs(shared))
+
+    def test_failed_save_rolls_back_blob_ref(self):
+        with mock.patch.object(PollutionPoint, '_do_insert', side_effect=IntegrityError("boom")):
+            with self.assertRaises(IntegrityError):
+                PollutionPoint.objects.create(pollution_type='oil', latitude=55.7, longitude=37.6,
+                                              photo=image_file('a.png', 1))
+        self.assertFalse(MediaBlob.objects.exists())
+        # Оставшийся файл достаётся следующей такой же загрузке
+        point = PollutionPoint.objects.create(pollution_type='oil', latitude=55.7, longitude=37.6,
+                                              photo=image_file('a.png', 1))
+        self.assertEqual(self.blob_refs(point.photo.name), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            point.delete()
+        self.assertFalse(point.photo.storage.exists(point.photo.name))
+
+    @override_settings(DEBUG=False)
+    def test_blobs_not_served_by_django(self):
+        point = PollutionPoint.objects.create(pollution_type='oil', latitude=55.7, longitude=37.6,
+                                              photo=image_file('a.png', 1))
+        self.assertEqual(self.client.get(point.photo.url).status_code, 404)
+
+
+def _varint(data, offset):
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if byte < 0x80:
+            return value, offset
+
+
+def _message(data):
+    """Поля protobuf-сообщения: [(номер, значение)], значение — int или bytes."""
+    fields, offset = [], 0
+    while offset < len(data):
+        key, offset = _varint(data, offset)
+        number, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, offset = _varint(data, offset)
+        else:
+            length, offset = _varint(data, offset)
+            value, offset = data[offset:offset + length], offset + length
+        fields.append((number, value))
+    return fields
+
+
+def _packed(data):
+    values, offset = [], 0
+    while offset < len(data):
+        value, offset = _varint(data, offset)
+        values.append(value)
+    return values
+
+
+def decode_tile(data):
+    """Минимальный разбор MVT: {имя слоя: {'extent', 'features': [{id, tags, type, geometry}]}}."""
+    layers = {}
+    for number, layer_data in _message(data):
+        assert number == 3
+        layer = {'features': [], 'keys': [], 'values': []}
+        name = None
+        for field, value in _message(layer_data):
+            if field == 1:
+                name = value.decode()
+            elif field == 2:
+                feature = {}
+                for feature_field, feature_value in _message(value):
+                    if feature_field in (2, 4):
+                        feature_value = _packed(feature_value)
+                    feature[{1: 'id', 2: 'tags', 3: 'type', 4: 'geometry'}[feature_field]] = feature_value
+                layer['features'].append(feature)
+            elif field == 3:
+                layer['keys'].append(value.decode())
+            elif field == 4:
+                layer['values'].append(_message(value)[0][1].decode())
+            elif field == 5:
+                layer['extent'] = value
+            elif field == 15:
+                layer['version'] = value
+        for feature in layer['features']:
+            tags = feature['tags']
+            feature['properties'] = {
+                layer['keys'][tags[i]]: layer['values'][tags[i + 1]] for i in range(0, len(tags), 2)
+            }
+        layers[name] = layer
+    return layers
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), BACKGROUND_WORKERS=0, TILE_CACHE_DIR=tempfile.mkdtemp())
+class DuplicateReportTests(TestCase):
+    url = '/api/pollutions/points/'
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user('reporter')
+        self.client.force_authenticate(self.user)
+        self.original = PollutionPoint.objects.create(
+            pollution_type='oil', latitude=55.7, longitude=37.6, photo=image_file('a.png', 1),
+        )
+
+    def report(self, **data):
+        data = {'pollution_type': 'oil', 'latitude': 55.70005, 'longitude': 37.60005, **data}
+        return self.client.post(self.url, data, format='multipart')
+
+    def cluster_count(self):
+        result = clusters.clusters_in_bbox((37, 55, 38, 56), 10)
+        return sum(cluster['count'] for cluster in result['clusters'])
+
+    def test_merge(self):
+        response = self.report(description='Пятно растёт')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['id'], self.original.pk)
+        self.original.refresh_from_db()
+        self.assertEqual(self.original.reports_count, 2)
+        self.assertEqual(PollutionPoint.objects.count(), 1)
+        self.assertEqual(list(self.original.comments.values_list('text', flat=True)), ['Пятно растёт'])
+
+    def test_same_photo_merges(self):
+        response = self.report(photo=image_file('again.png', 1))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(PollutionPoint.objects.count(), 1)
+
+    def test_same_photo_with_metadata_matches_stored_file(self):
+        original = PollutionPoint.objects.create(
+            pollution_type='trash', latitude=55.7, longitude=37.6, photo=gps_jpeg('gps.jpg'),
+        )
+        # Совпадение по хешу содержимого: снимок точки не декодируется
+        with mock.patch.object(duplicates, '_point_phash') as point_phash:
+            response = self.report(pollution_type='trash', photo=gps_jpeg('again.jpg'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['id'], original.pk)
+        point_phash.assert_not_called()
+
+    def test_link_and_exclusion(self):
+        response = self.report(photo=image_file('other.png', 2))
+        self.assertEqual(response.status_code, 201)
+        duplicate = PollutionPoint.objects.get(pk=response.json()['id'])
+        self.assertEqual(duplicate.duplicate_of, self.original)
+
+        listed = [point['id'] for point in self.client.get(self.url).json()['results']]
+        self.assertEqual(listed, [self.original.pk])
+        listed = [point['id'] for point in self.client.get(self.url, {'duplicates': 1}).json()['results']]
+        self.assertCountEqual(listed, [self.original.pk, duplicate.pk])
+
+        self.assertEqual(self.cluster_count(), 1)
+        z = 16
+        x, y = tiles.tile_for(55.7, 37.6, z)
+        features = decode_tile(tiles.render_tile(z, x, y))['pollution']['features']
+        self.assertEqual([feature['id'] for feature in features], [self.original.pk])
+
+        later = timezone.now() + sync.LAG * 2
+        with mock.patch('pollution.sync.timezone.now', return_value=later):
+            feed = sync.changes()
+        self.assertEqual([point.pk for point in feed['points']], [self.original.pk])
+
+    def test_delete_original_promotes_duplicate(self):
+        duplicate = PollutionPoint.objects.get(pk=self.report(photo=image_file('other.png', 2)).json()['id'])
+        self.original.delete()
+        duplicate.refresh_from_db()
+        self.assertIsNone(duplicate.duplicate_of)
+        self.assertEqual(self.cluster_count(), 1)
+        listed = [point['id'] for point in self.client.get(self.url).json()['results']]
+        self.assertEqual(listed, [duplicate.pk])
+
+    def test_rebuild_matches_incremental(self):
+        self.report(photo=image_file('other.png', 2))
+        incremental = clusters.clusters_in_bbox((37, 55, 38, 56), 10)
+        clusters.rebuild()
+        self.assertEqual(clusters.clusters_in_bbox((37, 55, 38, 56), 10), incremental)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), BACKGROUND_WORKERS=0)
+class ExportJobTests(TestCase):
+    url = '/api/pollutions/points/export-jobs/'
+    params = {'period': 'year', 'format': 'csv'}
+
+    def setUp(self):
+        self.client = APIClient()
+        self.owner = User.objects.create_user('owner')
+        self.other = User.objects.create_user('other')
+        PollutionPoint.objects.create(pollution_type='oil', latitude=55.7, longitude=37.6)
+
+    def enqueue(self, user):
+        self.client.force_authenticate(user)
+        return self.client.post(self.url, self.params, format='json')
+
+    def test_requires_authentication(self):
+        self.assertIn(self.client.post(self.url, self.params, format='json').status_code, (401, 403))
+        self.assertFalse(ExportJob.objects.exists())
+
+    def test_jobs_are_scoped_to_owner(self):
+        first = self.enqueue(self.owner)
+        self.assertEqual(first.status_code, 202)
+        self.assertEqual(self.enqueue(self.owner).json()['id'], first.json()['id'])
+        other = self.enqueue(self.other)
+        self.assertEqual(other.status_code, 202)
+        self.assertNotEqual(other.json()['id'], first.json()['id'])
+
+        job_url = f"{self.url}{first.json()['id']}/"
+        self.assertEqual(self.client.get(job_url).status_code, 404)
+        self.client.force_authenticate(self.owner)
+        self.assertEqual(self.client.get(job_url).json()['status'], 'queued')
+
+    def test_run_and_download(self):
+        job_id = self.enqueue(self.owner).json()['id']
+        self.assertEqual(jobs.run_pending(), 1)
+        data = self.client.get(f'{self.url}{job_id}/').json()
+        self.assertEqual(data['status'], 'done')
+        self.assertRegex(data['download_url'], rf'_{job_id}_[\w-]{{16}}\.csv$')
+
+    def test_run_pending_counts_only_claimed(self):
+        job_id = self.enqueue(self.owner).json()['id']
+        self.assertTrue(jobs.claim(job_id))
+        self.assertFalse(jobs.run_job(job_id))
+        self.assertEqual(jobs.run_pending(), 0)
+
+    def test_stale_running_job_is_failed(self):
+        job_id = self.enqueue(self.owner).json()['id']
+        jobs.claim(job_id)
+        ExportJob.objects.filter(pk=job_id).update(heartbeat_at=timezone.now() - jobs.STALE_AFTER * 2)
+
+        response = self.enqueue(self.owner)
+        self.assertEqual(response.status_code, 202)
+        self.assertNotEqual(response.json()['id'], job_id)
+        self.assertEqual(ExportJob.objects.get(pk=job_id).status, 'failed')
+
+        # Зависший исполнитель не перезаписывает итог
+        with self.assertRaises(jobs.JobLost):
+            jobs.heartbeat(job_id)
+
+    def test_prune_deletes_expired_files(self):
+        job_id = self.enqueue(self.owner).json()['id']
+        jobs.run_pending()
+        job = ExportJob.objects.get(pk=job_id)
+        storage, name = job.file.storage, job.file.name
+        self.assertTrue(storage.exists(name))
+
+        self.assertEqual(jobs.prune(), 0)
+        self.assertEqual(jobs.prune(timezone.now() + jobs.EXPORT_RETENTION * 2), 1)
+        self.assertFalse(ExportJob.objects.exists())
+        self.assertFalse(storage.exists(name))
+
+
+def gps_jpeg(name, orientation=1, size=(40, 20)):
+    """JPEG с EXIF: координаты 55°42′N 37°36′E и ориентация."""
+    image = Image.frombytes('RGB', size, random.Random(3).randbytes(size[0] * size[1] * 3))
+    exif = image.getexif()
+    exif[0x0112] = orientation
+    exif[0x010f] = 'Camera'
+    exif.get_ifd(0x8825).update({1: 'N', 2: (55.0, 42.0, 0.0), 3: 'E', 4: (37.0, 36.0, 0.0)})
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', exif=exif)
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), BACKGROUND_WORKERS=0)
+class PhotoPrivacyTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('reporter'))
+
+    def test_original_is_stored_without_exif(self):
+        response = self.client.post('/api/pollutions/points/', {
+            'pollution_type': 'trash', 'photo': gps_jpeg('gps.jpg'),
+        }, format='multipart')
+        self.assertEqual(response.status_code, 201, response.content)
+        point = PollutionPoint.objects.get(pk=response.json()['id'])
+        # Координаты взяты из EXIF до его удаления
+        self.assertAlmostEqual(point.latitude, 55.7)
+        self.assertAlmostEqual(point.longitude, 37.6)
+        with point.photo.open('rb') as file:
+            self.assertIsNone(images.gps_from_exif(file))
+            file.seek(0)
+            with Image.open(file) as stored:
+                self.assertEqual(dict(stored.getexif()), {})
+                self.assertEqual(stored.size, (40, 20))
+                # Сжатые данные не перекодированы
+                with Image.open(gps_jpeg('gps.jpg')) as original:
+                    self.assertEqual(stored.tobytes(), original.tobytes())
+
+    def test_orientation_is_kept(self):
+        point = PollutionPoint.objects.create(
+            pollution_type='oil', latitude=55.7, longitude=37.6, photo=gps_jpeg('rotated.jpg', orientation=6),
+        )
+        with point.photo.open('rb') as file, Image.open(file) as stored:
+            self.assertEqual(dict(stored.getexif()), {0x0112: 6})
+            self.assertEqual(ImageOps.exif_transpose(stored).size, (20, 40))
+
+    def test_png_metadata_is_stripped(self):
+        image = Image.frombytes('RGB', (8, 8), random.Random(4).randbytes(8 * 8 * 3))
+        exif = image.getexif()
+        exif.get_ifd(0x8825).update({1: 'N', 2: (55.0, 42.0, 0.0), 3: 'E', 4: (37.0, 36.0, 0.0)})
+        info = PngImagePlugin.PngInfo()
+        info.add_itxt('XML:com.adobe.xmp', '<x:xmpmeta/>')
+        buffer = io.BytesIO()
+        image.save(buffer, 'PNG', exif=exif, pnginfo=info)
+        upload = SimpleUploadedFile('gps.png', buffer.getvalue(), content_type='image/png')
+        point = PollutionPoint.objects.create(pollution_type='oil', latitude=55.7, longitude=37.6, photo=upload)
+        with point.photo.open('rb') as file:
+            content = file.read()
+        self.assertNotIn(b'eXIf', content)
+        self.assertNotIn(b'xmpmeta', content)
+        with Image.open(io.BytesIO(content)) as stored:
+            self.assertEqual(stored.tobytes(), image.tobytes())
+
+    def test_clean_photo_is_kept_as_is(self):
+        upload = image_file('clean.png', 5)
+        content = upload.read()
+        upload.seek(0)
+        point = PollutionPoint.objects.create(pollution_type='oil', latitude=55.7, longitude=37.6, photo=upload)
+        with point.photo.open('rb') as file:
+            self.assertEqual(file.read(), content)
+
+    def test_process_pending(self):
+        point = PollutionPoint.objects.create(
+            pollution_type='oil', latitude=55.7, longitude=37.6, photo=image_file('a.png', 1),
+        )
+        PollutionPoint.objects.create(pollution_type='oil', latitude=55.7, longitude=37.6)
+        self.assertEqual(images.process_pending(), 1)
+        point.refresh_from_db()
+        self.assertEqual(point.photo_variants['source'], point.photo.name)
+        self.assertEqual(set(point.photo_variants), {'source', *images.VARIANTS})
+        self.assertFalse(PhotoJob.objects.exists())
+        self.assertEqual(images.process_pending(), 0)
+
+    def test_failed_photo_is_retried_later(self):
+        point = PollutionPoint.objects.create(
+            pollution_type='oil', latitude=55.7, longitude=37.6, photo=image_file('a.png', 1),
+        )
+        with mock.patch.object(images, 'render_variants', side_effect=OSError("broken")) as render, \
+                self.assertLogs('pollution.images', 'ERROR'):
+            self.assertEqual(images.process_pending(), 0)
+            job = PhotoJob.objects.get()
+            self.assertEqual((job.attempts, job.error), (1, "broken"))
+            # До срока повторной попытки фото не трогается
+            self.assertEqual(images.process_pending(), 0)
+            self.assertEqual(render.call_count, 1)
+            later = timezone.now()
+            for _ in range(images.MAX_ATTEMPTS):
+                later += images.RETRY_DELAY * 2 ** images.MAX_ATTEMPTS
+                images.process_pending(later)
+            self.assertEqual(render.call_count, images.MAX_ATTEMPTS)
+        self.assertEqual(PhotoJob.objects.get().attempts, images.MAX_ATTEMPTS)
+
+        # Новое фото ставится в очередь заново
+        point.photo = image_file('b.png', 2)
+        point.save()
+        self.assertEqual(images.process_pending(), 1)
+        self.assertFalse(PhotoJob.objects.exists())
+
+
+class ConditionalRequestTests(TestCase):
+    url = '/api/pollutions/points/'
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user('reporter', password='secret')
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.point = PollutionPoint.objects.create(
+                reporter=self.user, pollution_type='oil', latitude=55.7, longitude=37.6,
+            )
+            self.other = PollutionPoint.objects.create(pollution_type='trash', latitude=55.8, longitude=37.7)
+            self.comment = Comment.objects.create(point=self.point, author=self.user, text='Грязно')
+
+    def etag(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def etags(self):
+        urls = [self.url]
+        for point in (self.point, self.other):
+            urls += [f'{self.url}{point.pk}/', f'{self.url}{point.pk}/comments/']
+        return {url: self.etag(url) for url in urls}
+
+    def test_if_none_match(self):
+        etag = self.etag(self.url)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            PollutionPoint.objects.create(pollution_type='oil', latitude=55.9, longitude=37.8)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertNotEqual(self.etag(self.url), etag)
+
+    def test_comment_edit_changes_only_its_point(self):
+        before = self.etags()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.comment.text = 'Убрали'
+            self.comment.save()
+        after = self.etags()
+        changed = {url for url in before if before[url] != after[url]}
+        self.assertEqual(changed, {f'{self.url}{self.point.pk}/', f'{self.url}{self.point.pk}/comments/'})
+
+    def test_new_comment_changes_list(self):
+        before = self.etags()
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(point=self.other, author=self.user, text='И здесь')
+        after = self.etags()
+        self.assertNotEqual(before[self.url], after[self.url])
+        self.assertNotEqual(before[f'{self.url}{self.other.pk}/comments/'], after[f'{self.url}{self.other.pk}/comments/'])
+        self.assertEqual(before[f'{self.url}{self.point.pk}/comments/'], after[f'{self.url}{self.point.pk}/comments/'])
+
+    def test_user_saves_outside_payload_keep_versions(self):
+        before = self.etags()
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.create_user('newcomer')
+            self.user.set_password('changed')
+            self.user.save()
+            self.user.last_login = timezone.now()
+            self.user.save(update_fields=['last_login'])
+        self.assertEqual(self.etags(), before)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.username = 'renamed'
+            self.user.save()
+        after = self.etags()
+        self.assertTrue(all(before[url] != after[url] for url in before))
+
+    def test_if_modified_since(self):
+        CollectionVersion.objects.update(updated_at=timezone.now() - timedelta(seconds=10))
+        response = self.client.get(self.url)
+        last_modified = response['Last-Modified']
+
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+        # If-None-Match важнее If-Modified-Since
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified, HTTP_IF_NONE_MATCH='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_no_last_modified_within_current_second(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            PollutionPoint.objects.create(pollution_type='oil', latitude=55.9, longitude=37.8)
+        response = self.client.get(self.url)
+        self.assertFalse(response.has_header('Last-Modified'))
+        # Запись в ту же секунду не должна прятаться за If-Modified-Since
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60))
+        self.assertEqual(response.status_code, 200)
+
+
+class ResponseCacheTests(TestCase):
+    """Синхронный view со ``response_cache.cached`` (асинхронный путь — AsyncReadTests)."""
+    url = '/api/pollutions/points/'
+    view = staticmethod(PollutionPointViewSet.as_view({'get': 'list'}))
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        caches[response_cache.CACHE_ALIAS].clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            PollutionPoint.objects.create(pollution_type='oil', latitude=55.7, longitude=37.6)
+        CollectionVersion.objects.update(updated_at=timezone.now() - timedelta(seconds=10))
+
+    def current_key(self):
+        version, modified = versions.current(*versions.POINT_LIST)
+        return response_cache._key(self.params, version, modified), f'"{version}-json"'
+
+    def get(self, **headers):
+        response = self.view(self.factory.get(self.url, **headers))
+        return response.render() if hasattr(response, 'render') else response
+
+    def prime(self):
+        with mock.patch.object(response_cache, '_params_key', wraps=response_cache._params_key) as params_key:
+            response = self.get()
+        self.params = response_cache._params_key(params_key.call_args.args[0])
+        return response
+
+    def test_miss_then_hit(self):
+        miss = self.prime()
+        self.assertEqual(miss.status_code, 200)
+        key, etag = self.current_key()
+        self.assertIsNotNone(caches[response_cache.CACHE_ALIAS].get(key))
+
+        with CaptureQueriesContext(connection) as queries:
+            hit = self.get()
+        self.assertFalse(any('pollution_pollutionpoint' in query['sql'] for query in queries))
+        self.assertEqual(hit.content, miss.content)
+        for header in ('ETag', 'Last-Modified', 'Cache-Control'):
+            self.assertEqual(hit[header], miss[header])
+        self.assertEqual(hit['ETag'], etag)
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_write_misses(self):
+        first = self.prime()
+        with self.captureOnCommitCallbacks(execute=True):
+            PollutionPoint.objects.create(pollution_type='trash', latitude=55.8, longitude=37.7)
+        second = self.get()
+        self.assertNotEqual(second['ETag'], first['ETag'])
+        self.assertEqual(len(json.loads(second.content)['results']), 2)
+
+    def test_waiter_does_not_serve_previous_version(self):
+        first = self.prime()
+        with self.captureOnCommitCallbacks(execute=True):
+            PollutionPoint.objects.create(pollution_type='trash', latitude=55.8, longitude=37.7)
+        key, etag = self.current_key()
+        cache = caches[response_cache.CACHE_ALIAS]
+        # Ответ новой версии строит другой процесс, который так и не закончил
+        cache.add(f'{key}:lock', 1)
+        with mock.patch.object(response_cache, 'WAIT_TIMEOUT', 0.2):
+            response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], etag)
+        self.assertNotEqual(response.content, first.content)
+        self.assertIsNone(cache.get(key))
+
+    def test_waiter_rechecks_version(self):
+        self.prime()
+        with self.captureOnCommitCallbacks(execute=True):
+            PollutionPoint.objects.create(pollution_type='trash', latitude=55.8, longitude=37.7)
+        key, _ = self.current_key()
+        cache = caches[response_cache.CACHE_ALIAS]
+        cache.add(f'{key}:lock', 1)
+
+        def write(seconds):
+            # Пока ждали, данные снова изменились
+            versions.increment(*versions.POINT_LIST)
+
+        with mock.patch.object(response_cache.time, 'sleep', side_effect=write):
+            response = self.get()
+        new_key, etag = self.current_key()
+        self.assertNotEqual(new_key, key)
+        self.assertEqual(response['ETag'], etag)
+        self.assertIsNotNone(cache.get(new_key))
+
+
+class AsyncReadTests(TestCase):
+    """GET списка, карточки и комментариев через pollution.async_reads."""
+    url = '/api/pollutions/points/'
+
+    def setUp(self):
+        self.client = APIClient()
+        self.factory = APIRequestFactory()
+        self.user = User.objects.create_user('reader')
+        caches[response_cache.CACHE_ALIAS].clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.point = PollutionPoint.objects.create(
+                reporter=self.user, pollution_type='oil', latitude=55.7, longitude=37.6,
+            )
+            Comment.objects.create(point=self.point, author=self.user, text='Грязно')
+        CollectionVersion.objects.update(updated_at=timezone.now() - timedelta(seconds=10))
+
+    def async_only(self):
+        # Синхронный путь читает версию через current(), асинхронный — через acurrent()
+        return mock.patch.object(versions, 'current', side_effect=AssertionError('sync path'))
+
+    def sync_get(self, actions, url, **kwargs):
+        request = self.factory.get(url)
+        force_authenticate(request, self.user)
+        view = PollutionPointViewSet.as_view(actions)
+        return view(request, **kwargs).render()
+
+    def test_matches_sync_view(self):
+        self.client.force_authenticate(self.user)
+        cases = [
+            ({'get': 'list'}, self.url, {}),
+            ({'get': 'retrieve'}, f'{self.url}{self.point.pk}/', {'pk': str(self.point.pk)}),
+            ({'get': 'comments'}, f'{self.url}{self.point.pk}/comments/', {'pk': str(self.point.pk)}),
+        ]
+        for actions, url, kwargs in cases:
+            expected = self.sync_get(actions, url, **kwargs)
+            with self.async_only():
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+            self.assertEqual(response.content, expected.content, url)
+            self.assertEqual(response['ETag'], expected['ETag'], url)
+            self.assertEqual(response['Last-Modified'], expected['Last-Modified'], url)
+
+            with self.async_only():
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=expected['ETag'])
+            self.assertEqual(response.status_code, 304, url)
+
+    def test_errors_fall_back_to_sync_view(self):
+        self.assertEqual(self.client.get(f'{self.url}999999/').status_code, 404)
+        self.assertEqual(self.client.get(f'{self.url}{self.point.pk}/comments/').status_code, 403)
+
+    def test_synchronous_only_falls_back(self):
+        expected = self.client.get(self.url)
+        caches[response_cache.CACHE_ALIAS].clear()
+        with mock.patch.object(versions, 'acurrent', side_effect=SynchronousOnlyOperation):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, expected.content)
+
+    def test_cache_hit(self):
+        miss = self.client.get(self.url)
+        with self.async_only(), CaptureQueriesContext(connection) as queries:
+            hit = self.client.get(self.url)
+        self.assertFalse(any('pollution_pollutionpoint' in query['sql'] for query in queries))
+        self.assertEqual(hit.content, miss.content)
+        for header in ('ETag', 'Last-Modified', 'Cache-Control'):
+            self.assertEqual(hit[header], miss[header])
+
+    def test_waiter_rechecks_version(self):
+        with mock.patch.object(response_cache, '_params_key', wraps=response_cache._params_key) as params_key:
+            self.client.get(self.url)
+        params = response_cache._params_key(params_key.call_args.args[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            PollutionPoint.objects.create(pollution_type='trash', latitude=55.8, longitude=37.7)
+        cache = caches[response_cache.CACHE_ALIAS]
+        cache.add(f'{response_cache._key(params, *versions.current(*versions.POINT_LIST))}:lock', 1)
+
+        async def write(seconds):
+            # Пока ждали, данные снова изменились
+            await sync_to_async(versions.increment)(*versions.POINT_LIST)
+
+        with mock.patch.object(response_cache.asyncio, 'sleep', side_effect=write):
+            response = self.client.get(self.url)
+        version, modified = versions.current(*versions.POINT_LIST)
+        self.assertEqual(response['ETag'], f'"{version}-json"')
+        self.assertIsNotNone(cache.get(response_cache._key(params, version, modified)))
+
+
+class StemmingTests(TestCase):
+    # Ожидаемые основы — вывод эталонного стеммера Snowball (russian)
+    CASES = [
+        ('загрязнение', 'загрязнен'), ('загрязнений', 'загрязнен'), ('мусором', 'мусор'),
+        ('свалки', 'свалк'), ('нефтяными', 'нефтян'), ('пятна', 'пятн'), ('разлив', 'разл'),
+        ('разливом', 'разлив'), ('выбросы', 'выброс'), ('химических', 'химическ'), ('отходов', 'отход'),
+        ('берегу', 'берег'), ('реки', 'рек'), ('убрали', 'убра'), ('убирают', 'убира'),
+        ('убравшись', 'убра'), ('волонтеров', 'волонтер'), ('организации', 'организац'),
+        ('прекраснейший', 'прекрасн'), ('сильнейшая', 'сильн'), ('красивость', 'красив'),
+        ('вызывающий', 'вызыва'), ('бегущая', 'бегущ'), ('отравленной', 'отравлен'), ('запах', 'зап'),
+        ('пахнет', 'пахнет'), ('горящие', 'горя'), ('сожгли', 'сожгл'), ('покрышками', 'покрышк'),
+        ('канализационный', 'канализацион'), ('сток', 'сток'), ('важнее', 'важн'), ('вазы', 'ваз'),
+    ]
+
+    def test_snowball_output(self):
+        for word, expected in self.CASES:
+            self.assertEqual(stemming.stem(word), expected, word)
+
+    def test_case_and_yo(self):
+        self.assertEqual(stemming.stem('ЁЛКА'), 'елк')
+        self.assertEqual(stemming.stems('Нефтяное ПЯТНО, у берега!'), ['нефтян', 'пятн', 'у', 'берег'])
+        self.assertEqual(stemming.stems(''), [])
+
+
+class SearchIndexTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('reporter')
+        self.point = PollutionPoint.objects.create(
+            pollution_type='oil', latitude=55.7, longitude=37.6, description='Нефтяное пятно у берега',
+        )
+        self.comment = Comment.objects.create(point=self.point, author=self.user, text='Разлив мусора')
+
+    def search(self, text):
+        client = APIClient()
+        response = client.get('/api/pollutions/points/', {'q': text})
+        return [point['id'] for point in response.json()['results']]
+
+    def test_search(self):
+        self.assertEqual(self.search('пятна'), [self.point.pk])
+        self.assertEqual(self.search('мусором'), [self.point.pk])
+        self.assertEqual(self.search('свалка'), [])
+
+    def test_reindex_only_on_text_change(self):
+        point = PollutionPoint.objects.get(pk=self.point.pk)
+        comment = Comment.objects.get(pk=self.comment.pk)
+        with mock.patch.object(search, 'index_points') as index_points:
+            point.status = 'in_progress'
+            point.save()
+            point.reports_count += 1
+            point.save(update_fields=['reports_count'])
+            comment.save()
+            Comment.objects.create(point=point, author=self.user, text='')
+            self.assertEqual(index_points.call_count, 0)
+
+            point.description = 'Свалка'
+            point.save()
+            comment.text = 'Убрали'
+            comment.save()
+            Comment.objects.create(point=point, author=self.user, text='Снова грязно')
+            comment.delete()
+        self.assertEqual(index_points.call_count, 4)
+
+    def test_edits_are_searchable(self):
+        point = PollutionPoint.objects.get(pk=self.point.pk)
+        point.description = 'Свалка покрышек'
+        point.save()
+        self.assertEqual(self.search('свалки'), [self.point.pk])
+        self.assertEqual(self.search('пятно'), [])
+
+
+def _unzigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+class TileTests(TestCase):
+
+    def setUp(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir, ignore_errors=True)
+        self.enterContext(override_settings(TILE_CACHE_DIR=cache_dir))
+        self.client = APIClient()
+        self.user = User.objects.create_user('operator')
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.points = [
+                PollutionPoint.objects.create(pollution_type='oil', latitude=55.7 + i * 0.01, longitude=37.6)
+                for i in range(3)
+            ]
+        self.z = 12
+        self.tile = tiles.tile_for(55.7, 37.6, self.z)
+        self.far = tiles.tile_for(-33.9, 151.2, self.z)
+
+    def cached(self, tile, z=None):
+        return os.path.exists(tiles.cache_path(z or self.z, *tile))
+
+    def test_encode_decode(self):
+        z, (x, y) = self.z, self.tile
+        points = [(7, 55.7, 37.6, 'oil', 'new'), (9, 55.701, 37.601, 'trash', 'cleaned')]
+        layer = decode_tile(tiles.encode_tile(z, x, y, points))['pollution']
+        self.assertEqual((layer['version'], layer['extent']), (2, tiles.EXTENT))
+        self.assertEqual([feature['id'] for feature in layer['features']], [7, 9])
+        self.assertEqual(layer['features'][1]['properties'], {'pollution_type': 'trash', 'status': 'cleaned'})
+        for feature, (_, latitude, longitude, *_) in zip(layer['features'], points):
+            self.assertEqual(feature['type'], 1)
+            command, px, py = feature['geometry']
+            self.assertEqual(command, (1 << 3) | 1)
+            fx, fy = tiles.project(latitude, longitude, z)
+            self.assertEqual((_unzigzag(px), _unzigzag(py)), (round((fx - x) * tiles.EXTENT), round((fy - y) * tiles.EXTENT)))
+
+    def test_render_and_cache(self):
+        response = self.client.get(f'/api/pollutions/tiles/{self.z}/{self.tile[0]}/{self.tile[1]}.mvt')
+        self.assertEqual(response.status_code, 200)
+        ids = [feature['id'] for feature in decode_tile(response.content)['pollution']['features']]
+        self.assertEqual(ids, [point.pk for point in self.points if tiles.tile_for(point.latitude, 37.6, self.z) == self.tile])
+        self.assertTrue(self.cached(self.tile))
+
+    def test_empty_tile_is_not_cached(self):
+        response = self.client.get(f'/api/pollutions/tiles/{self.z}/{self.far[0]}/{self.far[1]}.mvt')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(decode_tile(response.content)['pollution']['features'], [])
+        self.assertEqual(os.listdir(tiles.cache_dir()), [])
+
+    def test_deep_zoom_is_not_cached(self):
+        z = tiles.CACHE_MAX_ZOOM + 1
+        x, y = tiles.tile_for(55.7, 37.6, z)
+        response = self.client.get(f'/api/pollutions/tiles/{z}/{x}/{y}.mvt')
+        self.assertEqual(len(decode_tile(response.content)['pollution']['features']), 1)
+        self.assertFalse(self.cached((x, y), z))
+
+    def test_invalidated_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            PollutionPoint.objects.create(pollution_type='oil', latitude=-33.9, longitude=151.2)
+        tiles.get_tile(self.z, *self.tile)
+        tiles.get_tile(self.z, *self.far)
+        with self.captureOnCommitCallbacks(execute=True):
+            point = self.points[0]
+            point.status = 'cleaned'
+            point.save()
+            # До коммита тайл не трогаем
+            self.assertTrue(self.cached(self.tile))
+        self.assertFalse(self.cached(self.tile))
+        self.assertTrue(self.cached(self.far))
+
+    def test_bulk_invalidates_once(self):
+        with mock.patch.object(tiles, 'invalidate', wraps=tiles.invalidate) as invalidate:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(
+                    '/api/pollutions/points/bulk-set-status/',
+                    {'status': 'cleaned', 'ids': [point.pk for point in self.points]}, format='json',
+                )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(invalidate.call_count, 1)
+
+    def test_only_cached_zooms(self):
+        tiles.get_tile(self.z, *self.tile)
+        with mock.patch.object(tiles, 'cache_path', wraps=tiles.cache_path) as cache_path:
+            tiles.invalidate([self.points[0].state()])
+        self.assertEqual({call.args[0] for call in cache_path.call_args_list}, {self.z})
+
+    def test_render_racing_commit_is_not_kept(self):
+        render = tiles.render_tile
+
+        def render_then_commit(z, x, y):
+            # Тайл нарисован по старым данным, а изменение зафиксировано до записи файла
+            data = render(z, x, y)
+            with self.captureOnCommitCallbacks(execute=True):
+                point = self.points[0]
+                point.status = 'cleaned'
+                point.save()
+            return data
+
+        with mock.patch.object(tiles, 'render_tile', side_effect=render_then_commit):
+            tiles.get_tile(self.z, *self.tile)
+        self.assertFalse(self.cached(self.tile))
+        layer = decode_tile(tiles.get_tile(self.z, *self.tile))['pollution']
+        statuses = {feature['id']: feature['properties']['status'] for feature in layer['features']}
+        self.assertEqual(statuses[self.points[0].pk], 'cleaned')
+
+
+class GeoClusterTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        rng = random.Random(2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.points = [
+                PollutionPoint.objects.create(
+                    pollution_type=rng.choice(['trash', 'oil']),
+                    latitude=rng.uniform(55.5, 56.0), longitude=rng.uniform(37.3, 37.9),
+                )
+                for _ in range(60)
+            ]
+
+    def test_geohash(self):
+        # Эталонные значения geohash.org
+        self.assertEqual(geo.encode(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        self.assertEqual(geo.encode(42.6, -5.6, 5), 'ezs42')
+        self.assertEqual(self.points[0].geohash, geo.encode(self.points[0].latitude, self.points[0].longitude))
+
+    def test_cover_contains_points(self):
+        bbox = (37.45, 55.6, 37.7, 55.8)
+        prefixes = geo.cover(*bbox)
+        self.assertTrue(0 < len(prefixes) <= geo.MAX_COVER_CELLS)
+        for point in self.points:
+            if bbox[1] <= point.latitude <= bbox[3] and bbox[0] <= point.longitude <= bbox[2]:
+                self.assertTrue(any(point.geohash.startswith(prefix) for prefix in prefixes))
+
+    def test_in_bbox_matches_scan(self):
+        for bbox in [(37.45, 55.6, 37.7, 55.8), (37.3, 55.5, 37.9, 56.0), (-180, -90, 180, 90), (10, 10, 11, 11)]:
+            expected = {
+                point.pk for point in self.points
+                if bbox[1] <= point.latitude <= bbox[3] and bbox[0] <= point.longitude <= bbox[2]
+            }
+            self.assertEqual(set(PollutionPoint.objects.in_bbox(*bbox).values_list('pk', flat=True)), expected, bbox)
+
+    def test_near_matches_haversine(self):
+        center = (55.75, 37.6)
+        for radius in (2000, 10000, 30000):
+            found = set(PollutionPoint.objects.near(*center, radius).values_list('pk', flat=True))
+            for point in self.points:
+                distance = geo.haversine_m(*center, point.latitude, point.longitude)
+                # Равнопромежуточная проекция: погрешность на таких расстояниях — доли процента
+                if distance < radius * 0.99:
+                    self.assertIn(point.pk, found, distance)
+                elif distance > radius * 1.01:
+                    self.assertNotIn(point.pk, found, distance)
+
+    def test_list_viewport(self):
+        url = '/api/pollutions/points/'
+
+        def listed(**params):
+            response = self.client.get(url, {'page_size': 100, **params})
+            self.assertEqual(response.status_code, 200)
+            return {point['id'] for point in response.json()['results']}
+
+        bbox = (37.45, 55.6, 37.7, 55.8)
+        inside = set(PollutionPoint.objects.in_bbox(*bbox).values_list('pk', flat=True))
+        self.assertTrue(0 < len(inside) < len(self.points))
+        self.assertEqual(listed(bbox=','.join(map(str, bbox))), inside)
+        nearby = set(PollutionPoint.objects.near(55.75, 37.6, 5000).values_list('pk', flat=True))
+        self.assertTrue(0 < len(nearby) < len(self.points))
+        self.assertEqual(listed(near='55.75,37.6', radius_m=5000), nearby)
+        for params in ({'bbox': '37,55,38'}, {'bbox': '38,55,37,56'}, {'near': '95,37'},
+                       {'near': '55.75,37.6', 'radius_m': 0}, {'near': '55.75,37.6', 'radius_m': 'far'}):
+            self.assertEqual(self.client.get(url, params).status_code, 400, params)
+
+    def test_clusters(self):
+        response = self.client.get('/api/pollutions/points/clusters/', {'bbox': '37,55,38,57', 'zoom': 6})
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        self.assertEqual(sum(cluster['count'] for cluster in result['clusters']), len(self.points))
+        for cluster in result['clusters']:
+            self.assertEqual(sum(cluster['pollution_types'].values()), cluster['count'])
+            members = [point for point in self.points if point.geohash.startswith(cluster['cell'])]
+            self.assertEqual(len(members), cluster['count'])
+            self.assertAlmostEqual(cluster['latitude'], sum(p.latitude for p in members) / len(members))
+
+    def test_invalid_params(self):
+        for params in ({'bbox': '37,55,38,57'}, {'bbox': '37,55,38,57', 'zoom': 23}, {'bbox': '38,55,37,57', 'zoom': 5}):
+            self.assertEqual(self.client.get('/api/pollutions/points/clusters/', params).status_code, 400, params)
+
+    def test_incremental_matches_rebuild(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for point in self.points[:10]:
+                point.status = 'cleaned'
+                point.latitude += 0.05
+                point.save()
+            for point in self.points[10:15]:
+                point.delete()
+
+        def snapshot():
+            return sorted(
+                ClusterCell.objects.filter(count__gt=0)
+                .values_list('precision', 'cell', 'pollution_type', 'status', 'count')
+            )
+
+        incremental = snapshot()
+        clusters.rebuild()
+        self.assertEqual(snapshot(), incremental)
+
+
+class CursorPaginationTests(TestCase):
+    url = '/api/pollutions/points/'
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user('reader')
+        self.client.force_authenticate(self.user)
+        self.points = [
+            PollutionPoint.objects.create(pollution_type='oil', latitude=55.7, longitude=37.6) for _ in range(7)
+        ]
+        # Одинаковое время создания: порядок внутри группы задаёт id
+        same = timezone.now()
+        PollutionPoint.objects.filter(pk__in=[p.pk for p in self.points[2:5]]).update(created_at=same)
+
+    def walk(self, url, params):
+        ids, pages = [], 0
+        response = self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            ids += [item['id'] for item in data['results']]
+            pages += 1
+            if not data['next']:
+                return ids, pages
+            response = self.client.get(data['next'])
+
+    def test_walk_points(self):
+        ids, pages = self.walk(self.url, {'page_size': 3})
+        expected = list(PollutionPoint.objects.order_by('-created_at', '-id').values_list('pk', flat=True))
+        self.assertEqual(ids, expected)
+        self.assertEqual(pages, 3)
+
+    def test_walk_comments(self):
+        point = self.points[0]
+        comments = [Comment.objects.create(point=point, author=self.user, text=str(i)) for i in range(5)]
+        ids, pages = self.walk(f'{self.url}{point.pk}/comments/', {'page_size': 2})
+        self.assertEqual(ids, [comment.pk for comment in reversed(comments)])
+        self.assertEqual(pages, 3)
+
+    def test_page_size_bounds(self):
+        self.assertEqual(len(self.client.get(self.url, {'page_size': 0}).json()['results']), 7)
+        self.assertEqual(len(self.client.get(self.url, {'page_size': 'x'}).json()['results']), 7)
+        with mock.patch.object(KeysetCursorPagination, 'max_page_size', 4):
+            self.assertEqual(len(self.client.get(self.url, {'page_size': 100}).json()['results']), 4)
+
+    def test_invalid_cursor(self):
+        def token(value):
+            return base64.urlsafe_b64encode(json.dumps(value).encode()).decode()
+
+        for cursor in ['%%%', 'bm90LWpzb24=', token({'a': 1}), token([1]), token(['not-a-date', 1])]:
+            response = self.client.get(self.url, {'cursor': cursor})
+            self.assertEqual(response.status_code, 404, cursor)
+
+
+class ExportTests(TestCase):
+    url = '/api/pollutions/points/export/'
+
+    def setUp(self):
+        self.client = APIClient()
+        self.organization = Organization.objects.create(name='Чистый берег')
+        self.user = User.objects.create_user('reporter')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.points = [
+                PollutionPoint.objects.create(
+                    reporter=self.user, pollution_type='oil', latitude=55.7, longitude=37.6, description='Пятно',
+                ),
+                PollutionPoint.objects.create(
+                    anonymous_name='Гость', pollution_type='trash', latitude=55.8, longitude=37.7,
+                    handled_by=self.organization, status='cleaned',
+                    started_at=timezone.now(), cleaned_at=timezone.now(),
+                ),
+            ]
+
+    def export(self, **params):
+        response = self.client.get(self.url, {'period': 'today', **params})
+        self.assertEqual(response.status_code, 200, getattr(response, 'data', None))
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def test_xlsx(self):
+        workbook = openpyxl.load_workbook(io.BytesIO(self.export(format='xlsx')))
+        self.assertEqual(workbook.sheetnames, ['Детали', 'По дням'])
+        details = list(workbook['Детали'].values)
+        self.assertEqual(list(details[0]), exports.REPORT_COLUMNS)
+        self.assertEqual([row[1] for row in details[1:]], [exports.TYPE_LABELS['oil'], exports.TYPE_LABELS['trash']])
+        self.assertEqual([row[9] for row in details[1:]], ['reporter', 'Гость'])
+        self.assertEqual(details[2][6], 'Чистый берег')
+        self.assertTrue(workbook['Детали'].column_dimensions['A'].width)
+
+        summary = list(workbook['По дням'].values)
+        self.assertEqual(list(summary[0]), exports.SUMMARY_COLUMNS)
+        self.assertEqual(sum(row[2] for row in summary[1:]), 2)
+
+    def test_xlsx_without_daily_stats(self):
+        # bbox не сводится к DailyStat: сводка считается по строкам
+        workbook = openpyxl.load_workbook(io.BytesIO(self.export(format='xlsx', bbox='37.5,55.6,37.65,55.75')))
+        self.assertEqual(len(list(workbook['Детали'].values)), 2)
+        self.assertEqual([row[2] for row in list(workbook['По дням'].values)[1:]], [1])
+
+    def test_csv(self):
+        response = self.client.get(self.url, {'period': 'today', 'format': 'csv'})
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('.csv"', response['Content-Disposition'])
+        rows = list(csv.DictReader(io.StringIO(self.export(format='csv').decode())))
+        self.assertEqual([row['id'] for row in rows], [str(point.pk) for point in self.points])
+        self.assertEqual(rows[0]['pollution_type'], 'oil')
+        self.assertEqual(rows[1]['organization_id'], str(self.organization.pk))
+        self.assertEqual(float(rows[0]['latitude']), 55.7)
+        self.assertEqual(rows[0]['started_at'], '')
+
+    def test_geojson(self):
+        data = json.loads(self.export(format='geojson'))
+        self.assertEqual(data['type'], 'FeatureCollection')
+        feature = data['features'][1]
+        self.assertEqual(feature['id'], self.points[1].pk)
+        self.assertEqual(feature['geometry'], {'type': 'Point', 'coordinates': [37.7, 55.8]})
+        self.assertEqual(feature['properties']['status'], 'cleaned')
+        self.assertNotIn('latitude', feature['properties'])
+
+    @skipUnless(exports.parquet_available(), "pyarrow не установлен")
+    def test_parquet(self):
+        import pyarrow.parquet
+
+        table = pyarrow.parquet.read_table(io.BytesIO(self.export(format='parquet')))
+        self.assertEqual(table.column_names, exports.DATA_NAMES)
+        self.assertEqual(table.column('id').to_pylist(), [point.pk for point in self.points])
+        self.assertEqual(str(table.schema.field('created_at').type), 'timestamp[us, tz=UTC]')
+        self.assertEqual(table.column('started_at').to_pylist()[0], None)
+
+    def test_parquet_unavailable(self):
+        with mock.patch.object(exports, 'parquet_available', return_value=False):
+            response = self.client.get(self.url, {'period': 'today', 'format': 'parquet'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_unknown_format(self):
+        self.assertEqual(self.client.get(self.url, {'period': 'today', 'format': 'pdf'}).status_code, 400)
+
+    def test_empty(self):
+        response = self.client.get(self.url, {'period': 'today', 'pollution_type': 'chemical'})
+        self.assertEqual(response.status_code, 404)
+
+    def csv_ids(self, **params):
+        rows = csv.DictReader(io.StringIO(self.export(format='csv', **params).decode()))
+        return [int(row['id']) for row in rows]
+
+    def test_filters(self):
+        oil, trash = self.points
+        self.assertEqual(self.csv_ids(pollution_type=['trash', 'chemical']), [trash.pk])
+        self.assertEqual(self.csv_ids(status='new'), [oil.pk])
+        self.assertEqual(self.csv_ids(handled_by=self.organization.pk), [trash.pk])
+        self.assertEqual(self.csv_ids(bbox='37.65,55.75,37.8,55.9'), [trash.pk])
+        self.assertEqual(self.client.get(self.url, {'status': 'lost'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'bbox': '1,2,3'}).status_code, 400)
+
+    def test_date_range(self):
+        oil, trash = self.points
+        week_ago = timezone.now() - timedelta(days=7)
+        PollutionPoint.objects.filter(pk=oil.pk).update(created_at=week_ago)
+        start = (week_ago - timedelta(hours=1)).isoformat()
+        self.assertEqual(self.csv_ids(**{'from': start}), [oil.pk, trash.pk])
+        self.assertEqual(self.csv_ids(**{'from': start, 'to': (week_ago + timedelta(hours=1)).isoformat()}), [oil.pk])
+        # По умолчанию — сегодняшний день
+        self.assertEqual(self.csv_ids(), [trash.pk])
+        response = self.client.get(self.url, {'from': timezone.now().isoformat(), 'to': start})
+        self.assertEqual(response.status_code, 400)
+
+    def test_daily_stats_only_for_whole_days(self):
+        midnight = exports.period_start('today')
+        query = exports.build_query({'from': midnight, 'to': midnight + timedelta(days=1), 'status': ['new']})
+        self.assertQuerySetEqual(query.points, [self.points[0]])
+        self.assertIsNotNone(query.stats)
+        self.assertEqual(query.stats.aggregate(total=Sum('count'))['total'], 1)
+        self.assertIsNone(exports.build_query({'from': midnight + timedelta(hours=1)}).stats)
+        self.assertIsNone(exports.build_query({'period': 'today', 'bbox': [37, 55, 38, 56]}).stats)
+
+
+class DailyStatTests(TestCase):
+    url = '/api/pollutions/points/stats/'
+
+    def setUp(self):
+        self.client = APIClient()
+        self.organization = Organization.objects.create(name='Чистый берег')
+        self.user = User.objects.create_user('operator', organization=self.organization)
+        self.client.force_authenticate(self.user)
+        self.points = [
+            PollutionPoint.objects.create(pollution_type=kind, latitude=55.7, longitude=37.6)
+            for kind in ('oil', 'oil', 'trash', 'plastic')
+        ]
+        self.yesterday = timezone.now() - timedelta(days=1)
+        PollutionPoint.objects.filter(pk=self.points[3].pk).update(created_at=self.yesterday)
+        stats.rebuild()
+
+    def snapshot(self):
+        return sorted(
+            DailyStat.objects.filter(count__gt=0)
+            .values_list('day', 'pollution_type', 'status', 'handled_by_id', 'count')
+        )
+
+    def test_incremental_matches_rebuild(self):
+        point = self.points[0]
+        point.status = 'in_progress'
+        point.handled_by = self.organization
+        point.save()
+        self.client.post(
+            '/api/pollutions/points/bulk-set-status/',
+            {'status': 'cleaned', 'ids': [self.points[1].pk, self.points[2].pk]}, format='json',
+        )
+        PollutionPoint.objects.get(pk=self.points[3].pk).delete()
+        ingest.ingest(io.BytesIO(b'{"pollution_type": "oil", "latitude": 55.7, "longitude": 37.6}\n'), 'jsonl', self.user)
+
+        incremental = self.snapshot()
+        stats.rebuild()
+        self.assertEqual(self.snapshot(), incremental)
+        self.assertEqual(sum(row[-1] for row in incremental), 4)
+
+    def test_organization_deleted(self):
+        for point in self.points[:2]:
+            point.handled_by = self.organization
+            point.save()
+        other = Organization.objects.create(name='Другая')
+        point = self.points[2]
+        point.pollution_type = 'oil'
+        point.handled_by = other
+        point.save()
+        self.organization.delete()
+        other.delete()
+        # Ссылки обнулены без points_changed; дальнейшие изменения меняют одну строку «без организации»
+        point = PollutionPoint.objects.get(pk=self.points[0].pk)
+        point.status = 'cleaned'
+        point.save()
+
+        incremental = self.snapshot()
+        today = timezone.localdate()
+        self.assertEqual(DailyStat.objects.filter(day=today, pollution_type='oil', status='new').count(), 1)
+        self.assertIn((today, 'oil', 'new', None, 2), incremental)
+        stats.rebuild()
+        self.assertEqual(self.snapshot(), incremental)
+
+    def test_unassigned_rows_unique(self):
+        row = DailyStat.objects.get(pollution_type='trash')
+        self.assertIsNone(row.handled_by_id)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            DailyStat.objects.create(day=row.day, pollution_type='trash', status=row.status)
+
+    def test_grouped(self):
+        response = self.client.get(self.url, {'group_by': 'pollution_type'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(row['pollution_type'], row['total']) for row in response.json()],
+            [('oil', 2), ('plastic', 1), ('trash', 1)],
+        )
+        today = timezone.localdate().isoformat()
+        response = self.client.get(self.url, {'from': today, 'group_by': 'day,status'})
+        self.assertEqual(response.json(), [{'day': today, 'status': 'new', 'total': 3}])
+
+    def test_invalid_params(self):
+        for params in ({'group_by': 'reporter'}, {'group_by': ','}, {'from': '2026-13-01'}, {'to': 'yesterday'}):
+            self.assertEqual(self.client.get(self.url, params).status_code, 400, params)
+
+
+class BulkSetStatusTests(TestCase):
+    url = '/api/pollutions/points/bulk-set-status/'
+
+    def setUp(self):
+        self.client = APIClient()
+        self.organization = Organization.objects.create(name='Чистый берег')
+        self.user = User.objects.create_user('operator', organization=self.organization)
+        self.client.force_authenticate(self.user)
+        self.started = timezone.now() - timedelta(days=2)
+        self.points = [
+            PollutionPoint.objects.create(pollution_type='oil', latitude=55.7, longitude=37.6),
+            PollutionPoint.objects.create(
+                pollution_type='trash', latitude=55.71, longitude=37.61, status='in_progress', started_at=self.started,
+            ),
+            PollutionPoint.objects.create(pollution_type='plastic', latitude=60.0, longitude=30.3),
+        ]
+
+    def post(self, data):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(self.url, data, format='json')
+
+    def test_results_per_id(self):
+        first, second, _ = self.points
+        missing = PollutionPoint.objects.latest('pk').pk + 1
+        response = self.post({'status': 'cleaned', 'ids': [second.pk, missing, first.pk, second.pk]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'updated': 2, 'results': [
+            {'id': second.pk, 'result': 'updated'},
+            {'id': missing, 'result': 'not_found'},
+            {'id': first.pk, 'result': 'updated'},
+        ]})
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.status, first.handled_by), ('cleaned', self.organization))
+        # Как у set-status: дата начала сохраняется, очистка — сейчас
+        self.assertEqual(second.started_at, self.started)
+        self.assertIsNotNone(first.started_at)
+        self.assertEqual(first.started_at, first.cleaned_at)
+        self.assertEqual(PollutionPoint.objects.get(pk=self.points[2].pk).status, 'new')
+
+    def test_bbox(self):
+        response = self.post({'status': 'in_progress', 'bbox': '37.5,55.6,37.7,55.8'})
+        self.assertEqual(response.json(), {'updated': 2, 'results': [
+            {'id': point.pk, 'result': 'updated'} for point in self.points[:2]
+        ]})
+        first = PollutionPoint.objects.get(pk=self.points[0].pk)
+        self.assertEqual(first.status, 'in_progress')
+        self.assertIsNone(first.cleaned_at)
+
+    def test_too_many_points(self):
+        with mock.patch.object(BulkStatusSerializer, 'MAX_POINTS', 2):
+            response = self.post({'status': 'cleaned', 'bbox': '-180,-90,180,90'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(PollutionPoint.objects.filter(status='cleaned').exists())
+
+    def test_invalid(self):
+        for data in ({'status': 'cleaned'}, {'status': 'cleaned', 'ids': []}, {'status': 'lost', 'ids': [1]}):
+            self.assertEqual(self.post(data).status_code, 400, data)
+        self.client.force_authenticate(None)
+        self.assertEqual(self.post({'status': 'cleaned', 'ids': [1]}).status_code, 403)
+
+
+class SyncTests(TestCase):
+    url = '/api/pollutions/points/changes/'
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user('reporter')
+        self.points = [
+            PollutionPoint.objects.create(pollution_type='oil', latitude=55.7 + index / 100, longitude=37.6)
+            for index in range(3)
+        ]
+        self.comment = Comment.objects.create(point=self.points[0], author=self.user, text='Пятно растёт')
+        # Без задержки ленты записи видны сразу
+        self.enterContext(mock.patch.object(sync, 'LAG', timedelta(0)))
+
+    def feed(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200, getattr(response, 'data', None))
+        return response.json()
+
+    def test_pages_and_tokens(self):
+        first = self.feed(limit=2)
+        self.assertEqual([point['id'] for point in first['points']], [point.pk for point in self.points[:2]])
+        self.assertEqual([comment['id'] for comment in first['comments']], [self.comment.pk])
+        self.assertTrue(first['has_more'])
+
+        second = self.feed(since=first['next'], limit=2)
+        self.assertEqual([point['id'] for point in second['points']], [self.points[2].pk])
+        self.assertEqual(second['comments'], [])
+        self.assertFalse(second['has_more'])
+
+        self.assertEqual(self.feed(since=second['next'])['points'], [])
+        point = self.points[1]
+        point.description = 'Уточнение'
+        point.save()
+        changed = self.feed(since=second['next'])
+        self.assertEqual([point['id'] for point in changed['points']], [point.pk])
+        self.assertEqual(changed['deleted'], {'points': [], 'comments': []})
+
+    def test_tombstones(self):
+        token = self.feed()['next']
+        comment_id, point_id = self.comment.pk, self.points[0].pk
+        self.points[0].delete()
+        self.assertEqual(self.feed()['deleted'], {'points': [], 'comments': []})
+        changes = self.feed(since=token)
+        self.assertEqual(changes['deleted'], {'points': [point_id], 'comments': [comment_id]})
+        self.assertEqual(self.feed(since=changes['next'])['deleted'], {'points': [], 'comments': []})
+
+    def test_lag(self):
+        with mock.patch.object(sync, 'LAG', timedelta(minutes=1)):
+            self.assertEqual(self.feed()['points'], [])
+
+    def test_late_commit(self):
+        lag = timedelta(seconds=2)
+        issued = timezone.now() + timedelta(seconds=10)
+        with mock.patch.object(sync, 'LAG', lag), mock.patch('pollution.sync.timezone.now', return_value=issued):
+            token = self.feed()['next']
+        # Обе транзакции закоммичены после выдачи токена, но записали время раньше
+        within, beyond = (
+            PollutionPoint.objects.create(pollution_type='oil', latitude=55.7, longitude=37.6) for _ in range(2)
+        )
+        PollutionPoint.objects.filter(pk=within.pk).update(updated_at=issued - lag / 2)
+        PollutionPoint.objects.filter(pk=beyond.pk).update(updated_at=issued - lag * 2)
+        with mock.patch.object(sync, 'LAG', lag), \
+                mock.patch('pollution.sync.timezone.now', return_value=issued + lag * 5):
+            points = self.feed(since=token)['points']
+        # Задержка коммита больше LAG — известное ограничение ленты (см. pollution.sync)
+        self.assertEqual([point['id'] for point in points], [within.pk])
+
+    def test_invalid_tokens(self):
+        for token in ('garbage', base64.urlsafe_b64encode(b'[1,2]').decode()):
+            response = self.client.get(self.url, {'since': token})
+            self.assertEqual(response.status_code, 400, token)
+        old = timezone.now() - sync.TOMBSTONE_RETENTION - timedelta(days=1)
+        token = sync.encode_token({stream: [old.isoformat(), 0] for stream in sync.STREAMS})
+        self.assertEqual(self.client.get(self.url, {'since': token}).status_code, 410)
+        self.assertEqual(self.client.get(self.url, {'limit': 0}).status_code, 400)
+
+    def test_prune(self):
+        self.points[2].delete()
+        Tombstone.objects.update(deleted_at=timezone.now() - sync.TOMBSTONE_RETENTION - timedelta(days=1))
+        point_id = self.points[1].pk
+        self.points[1].delete()
+        self.assertEqual(sync.prune(), 1)
+        self.assertEqual(list(Tombstone.objects.values_list('object_id', flat=True)), [point_id])
+
+
+class EventTests(TestCase):
+    url = '/api/pollutions/events/'
+    MOSCOW = (37.5, 55.6, 37.7, 55.8)
+
+    async def next_event(self, stream):
+        frame = await asyncio.wait_for(anext(stream), 1)
+        data = next(line for line in frame.splitlines() if line.startswith('data: '))
+        event = json.loads(data[len('data: '):])
+        return event['type'], event['point']
+
+    def write(self):
+        user = User.objects.create_user('reporter')
+        with self.captureOnCommitCallbacks(execute=True):
+            moscow = PollutionPoint.objects.create(pollution_type='oil', latitude=55.7, longitude=37.6)
+            spb = PollutionPoint.objects.create(pollution_type='trash', latitude=59.9, longitude=30.3)
+            spb.status = 'cleaned'
+            spb.save()
+            Comment.objects.create(point=moscow, author=user, text='Пятно растёт')
+        return moscow.pk, spb.pk
+
+    async def test_bbox(self):
+        everywhere, moscow_only = events.stream(), events.stream(self.MOSCOW)
+        for stream in (everywhere, moscow_only):
+            self.assertIn(': connected', await anext(stream))
+        moscow, spb = await sync_to_async(self.write)()
+
+        received = [await self.next_event(everywhere) for _ in range(4)]
+        self.assertEqual(received, [
+            ('point.created', moscow), ('point.created', spb), ('point.status_changed', spb),
+            ('comment.created', moscow),
+        ])
+        received = [await self.next_event(moscow_only) for _ in range(2)]
+        self.assertEqual(received, [('point.created', moscow), ('comment.created', moscow)])
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(anext(moscow_only), 0.1)
+
+        await everywhere.aclose()
+        await moscow_only.aclose()
+        self.assertFalse(events.broker)
+
+    async def test_invalid_bbox(self):
+        self.assertEqual((await self.async_client.get(self.url, {'bbox': '37,55,38'})).status_code, 400)
+        self.assertEqual((await self.async_client.get(self.url, {'bbox': '38,55,37,56'})).status_code, 400)
+
+    def test_requires_asgi(self):
+        self.assertEqual(self.client.get(self.url).status_code, 501)
+
+    async def test_connection_limit(self):
+        stream = events.stream()
+        await anext(stream)
+        with mock.patch.object(events, 'MAX_SUBSCRIBERS', 1):
+            response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '30')
+        await stream.aclose()
+        self.assertFalse(events.broker)
+
+
+class AnalyticsTests(TestCase):
+    url = '/api/pollutions/points/analytics/'
+    CLEAN_HOURS = [1, 2, 4, 10, 50]
+
+    def setUp(self):
+        caches['default'].clear()
+        self.client = APIClient()
+        self.created = timezone.now() - timedelta(days=30)
+        self.window = {
+            'from': (self.created - timedelta(days=1)).isoformat(),
+            'to': (self.created + timedelta(days=1)).isoformat(),
+        }
+        for hours in self.CLEAN_HOURS:
+            self.point('oil', started=hours / 2, cleaned=hours)
+        self.point('trash', started=3)
+        self.point('trash')
+        # Повторное сообщение не учитывается
+        original = PollutionPoint.objects.filter(pollution_type='trash').first()
+        self.point('trash', started=1000, cleaned=1000, duplicate_of=original)
+
+    def point(self, pollution_type, started=None, cleaned=None, **fields):
+        point = PollutionPoint.objects.create(pollution_type=pollution_type, latitude=55.7, longitude=37.6, **fields)
+        PollutionPoint.objects.filter(pk=point.pk).update(
+            created_at=self.created,
+            started_at=self.created + timedelta(hours=started) if started is not None else None,
+            cleaned_at=self.created + timedelta(hours=cleaned) if cleaned is not None else None,
+        )
+
+    def report(self, **params):
+        response = self.client.get(self.url, {**self.window, **params})
+        self.assertEqual(response.status_code, 200, getattr(response, 'data', None))
+        return response.json()
+
+    def test_percentiles(self):
+        groups = {group['key']['pollution_type']: group for group in self.report(group_by='pollution_type')['groups']}
+        self.assertEqual(set(groups), {'oil', 'trash'})
+
+        oil = groups['oil']
+        self.assertEqual(oil['points'], 5)
+        self.assertEqual(oil['time_to_clean']['count'], 5)
+        self.assertEqual(oil['time_to_clean']['mean'], 13.4)
+        self.assertEqual(oil['time_to_clean']['percentiles'], {'p50': 4.0, 'p75': 10.0, 'p90': 34.0, 'p95': 42.0})
+        self.assertEqual(oil['time_to_start']['percentiles']['p50'], 2.0)
+
+        trash = groups['trash']
+        self.assertEqual(trash['points'], 2)
+        self.assertEqual(trash['time_to_start']['count'], 1)
+        self.assertEqual(trash['time_to_clean'], {
+            'count': 0, 'mean': None, 'percentiles': {'p50': None, 'p75': None, 'p90': None, 'p95': None},
+            'histogram': [0] * len(analytics.BINS_HOURS),
+        })
+
+    def test_histogram(self):
+        report = self.report()
+        self.assertEqual(report['bins_hours'], list(analytics.BINS_HOURS))
+        [group] = report['groups']
+        self.assertEqual(group['key'], {})
+        self.assertEqual(group['points'], 7)
+        # Корзины [0,1) [1,3) [3,6) [6,12) [12,24) [24,48) [48,72) ...
+        self.assertEqual(group['time_to_clean']['histogram'][:7], [0, 2, 1, 1, 0, 0, 1])
+        self.assertEqual(sum(group['time_to_clean']['histogram']), 5)
+
+    def test_cached_per_version(self):
+        self.assertEqual(self.report()['groups'][0]['points'], 7)
+        PollutionPoint.objects.filter(pollution_type='trash').delete()
+        self.assertEqual(self.report()['groups'][0]['points'], 7)
+        with self.captureOnCommitCallbacks(execute=True):
+            versions.bump()
+        self.assertEqual(self.report()['groups'][0]['points'], 5)
+
+    def test_invalid_params(self):
+        for params in ({'group_by': 'reporter'}, {'period': 'decade'}, {'from': 'вчера'}):
+            self.assertEqual(self.client.get(self.url, params).status_code, 400, params)
+
+
+class HeatmapTests(TestCase):
+    url = '/api/pollutions/points/heatmap/'
+
+    def setUp(self):
+        caches['default'].clear()
+        self.client = APIClient()
+        for latitude, longitude, kind in ((55.2, 37.2, 'oil'), (55.7, 37.2, 'oil'), (55.7, 37.8, 'oil'),
+                                          (55.8, 37.9, 'trash'), (59.9, 30.3, 'trash')):
+            PollutionPoint.objects.create(pollution_type=kind, latitude=latitude, longitude=longitude)
+
+    def heatmap(self, **params):
+        response = self.client.get(self.url, {'bbox': '37,55,38,56', 'cell_size': 0.5, **params})
+        self.assertEqual(response.status_code, 200, getattr(response, 'data', None))
+        return response.json()
+
+    def test_binning(self):
+        # Строки с севера: [СЗ, СВ], [ЮЗ, ЮВ]
+        self.assertEqual(self.heatmap(), {
+            'bbox': [37.0, 55.0, 38.0, 56.0], 'rows': 2, 'cols': 2, 'cell_size': 0.5,
+            'total': 4, 'max': 2, 'indices': [0, 1, 2], 'values': [1, 2, 1],
+        })
+        # Область выравнивается по сетке
+        shifted = self.heatmap(bbox='37.1,55.1,37.9,55.9')
+        self.assertEqual((shifted['bbox'], shifted['indices'], shifted['values']),
+                         ([37.0, 55.0, 38.0, 56.0], [0, 1, 2], [1, 2, 1]))
+
+    def test_filters(self):
+        self.assertEqual(self.heatmap(type='trash')['values'], [1])
+        self.assertEqual(self.heatmap(type=['oil', 'trash'])['total'], 4)
+        self.assertEqual(self.heatmap(status='cleaned')['values'], [])
+
+    def test_half_life(self):
+        PollutionPoint.objects.filter(latitude=55.2).update(created_at=timezone.now() - timedelta(days=2))
+        data = self.heatmap(half_life_days=1)
+        values = dict(zip(data['indices'], data['values']))
+        # Срок отсчитывается от начала часа: вклад двухдневной точки — около четверти
+        self.assertAlmostEqual(values[2], 0.25, delta=0.01)
+        self.assertAlmostEqual(values[1], 2, delta=0.01)
+
+    def test_default_cell_size(self):
+        self.assertEqual(heatmap.default_cell_size((37, 55, 38, 56)), 360 / 2 ** 15)
+        data = self.client.get(self.url).json()
+        self.assertEqual(data['cell_size'], 360 / 2 ** 7)
+        self.assertEqual(data['total'], 5)
+
+    def test_invalid(self):
+        response = self.client.get(self.url, {'cell_size': heatmap.MIN_CELL_SIZE})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('cell_size', response.json())
+        for params in ({'bbox': '37,55'}, {'cell_size': 0}, {'half_life_days': 0}, {'type': 'mud'}):
+            self.assertEqual(self.client.get(self.url, params).status_code, 400, params)
@@ -0,0 +1,238 @@
+"""
+Векторные тайлы (Mapbox Vector Tile) с точками загрязнения.
+
+Тайл содержит один слой ``pollution`` с точками и атрибутами ``id``,
+``pollution_type`` и ``status``. Готовые тайлы кешируются на диске по пути
+``{TILE_CACHE_DIR}/{z}/{x}/{y}.mvt``; при изменении точки удаляются только
+тайлы, в которые она попадала до и после изменения, — один раз, после
+коммита, и только на масштабах, для которых в кеше что-то есть.
+
+Кешируются только непустые тайлы масштабов до ``CACHE_MAX_ZOOM``, поэтому
+число файлов ограничено числом точек, а не запросами: пустые и более
+крупные тайлы рисуются на каждый запрос.
+
+Тайл, который рисовался по данным до коммита, не должен остаться в кеше
+после удаления: перед удалением увеличивается версия ``tiles``
+(pollution.versions), а ``get_tile()`` сверяет её до отрисовки и после
+записи файла и при расхождении удаляет свой файл.
+"""
+import math
+import os
+import tempfile
+
+from django.conf import settings
+from django.db import transaction
+from django.dispatch import receiver
+
+from . import clusters, versions
+from .models import PollutionPoint
+from .signals import points_changed
+
+LAYER_NAME = 'pollution'
+EXTENT = 4096
+MAX_ZOOM = 22
+MAX_LATITUDE = 85.05112878
+VERSION = 'tiles'
+# Масштаб, с которого кластеры перестают укрупняться; крупнее тайлы дёшевы и не кешируются
+CACHE_MAX_ZOOM = min(z for z in range(MAX_ZOOM + 1) if clusters.precision_for_zoom(z) == clusters.MAX_PRECISION)
+
+
+def cache_dir():
+    return getattr(settings, 'TILE_CACHE_DIR', os.path.join(settings.BASE_DIR, 'tile_cache'))
+
+
+def cache_path(z, x, y):
+    return os.path.join(cache_dir(), str(z), str(x), f'{y}.mvt')
+
+
+def project(latitude, longitude, z):
+    """Координаты точки в тайловой сетке масштаба ``z`` (дробные)."""
+    n = 1 << z
+    latitude = max(-MAX_LATITUDE, min(MAX_LATITUDE, latitude))
+    lat_rad = math.radians(latitude)
+    fx = (longitude + 180.0) / 360.0 * n
+    fy = (1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n
+    return min(fx, n - 1e-9), min(fy, n - 1e-9)
+
+
+def tile_for(latitude, longitude, z):
+    fx, fy = project(latitude, longitude, z)
+    return int(fx), int(fy)
+
+
+def tile_bbox(z, x, y):
+    """Границы тайла: (min_lon, min_lat, max_lon, max_lat)."""
+    n = 1 << z
+
+    def lat(ty):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * ty / n))))
+
+    return x / n * 360.0 - 180.0, lat(y + 1), (x + 1) / n * 360.0 - 180.0, lat(y)
+
+
+# --- Кодирование protobuf ---
+
+def _varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _zigzag(value):
+    return (value << 1) ^ (value >> 31)
+
+
+def _field(number, wire_type, payload):
+    return _varint((number << 3) | wire_type) + payload
+
+
+def _uint_field(number, value):
+    return _field(number, 0, _varint(value))
+
+
+def _bytes_field(number, data):
+    return _field(number, 2, _varint(len(data)) + data)
+
+
+def _packed_field(number, values):
+    return _bytes_field(number, b''.join(_varint(v) for v in values))
+
+
+def encode_tile(z, x, y, points):
+    """
+    Закодировать тайл. ``points`` — итерируемое из кортежей
+    ``(id, latitude, longitude, pollution_type, status)``.
+    """
+    keys = ['pollution_type', 'status']
+    values = []
+    value_index = {}
+
+    def value_ref(value):
+        if value not in value_index:
+            value_index[value] = len(values)
+            values.append(value)
+        return value_index[value]
+
+    features = []
+    for point_id, latitude, longitude, pollution_type, status in points:
+        fx, fy = project(latitude, longitude, z)
+        px = int(round((fx - x) * EXTENT))
+        py = int(round((fy - y) * EXTENT))
+        tags = [0, value_ref(pollution_type), 1, value_ref(status)]
+        geometry = [(1 << 3) | 1, _zigzag(px), _zigzag(py)]  # MoveTo(1)
+        features.append(_bytes_field(2, b''.join([
+            _uint_field(1, point_id),
+            _packed_field(2, tags),
+            _uint_field(3, 1),  # POINT
+            _packed_field(4, geometry),
+        ])))
+
+    layer = b''.join([
+        _uint_field(15, 2),
+        _bytes_field(1, LAYER_NAME.encode()),
+        *features,
+        *(_bytes_field(3, key.encode()) for key in keys),
+        *(_bytes_field(4, _bytes_field(1, str(value).encode())) for value in values),
+        _uint_field(5, EXTENT),
+    ])
+    return _bytes_field(3, layer)
+
+
+EMPTY_TILE = encode_tile(0, 0, 0, [])
+
+
+def render_tile(z, x, y):
+    min_lon, min_lat, max_lon, max_lat = tile_bbox(z, x, y)
+    rows = (
+        PollutionPoint.objects
+        .filter(duplicate_of__isnull=True)
+        .in_bbox(min_lon, min_lat, max_lon, max_lat)
+        .order_by('id')
+        .values_list('id', 'latitude', 'longitude', 'pollution_type', 'status')
+    )
+    # Точки на общей границе тайлов относим только к одному из них
+    points = [row for row in rows.iterator() if tile_for(row[1], row[2], z) == (x, y)]
+    return encode_tile(z, x, y, points)
+
+
+def get_tile(z, x, y):
+    """Тайл из дискового кеша или свежеотрисованный (непустой тайл записывается в кеш)."""
+    if z > CACHE_MAX_ZOOM:
+        return render_tile(z, x, y)
+    path = cache_path(z, x, y)
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+
+    version, _ = versions.current(VERSION)
+    data = render_tile(z, x, y)
+    if data == EMPTY_TILE:
+        return data
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    # Пока рисовали, точки изменились и invalidate() мог пройти раньше записи
+    if versions.current(VERSION)[0] != version:
+        _remove(path)
+    return data
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _cached_zooms():
+    try:
+        return {int(name) for name in os.listdir(cache_dir()) if name.isdigit()}
+    except FileNotFoundError:
+        return set()
+
+
+def invalidate(states):
+    """Удалить из кеша тайлы всех масштабов, содержащие данные точки."""
+    zooms = sorted(_cached_zooms() & set(range(CACHE_MAX_ZOOM + 1)))
+    tiles = set()
+    for state in states:
+        for z in zooms:
+            tiles.add((z, *tile_for(state.latitude, state.longitude, z)))
+    for z, x, y in tiles:
+        _remove(cache_path(z, x, y))
+
+
+def _tile_attrs(state):
+    if state is None or state.duplicate_of_id is not None:
+        return None
+    return state.latitude, state.longitude, state.pollution_type, state.status
+
+
+def _invalidate_committed(states):
+    versions.increment(VERSION)
+    invalidate(states)
+
+
+@receiver(points_changed)
+def invalidate_tiles(sender, changes, **kwargs):
+    states = [
+        state
+        for old, new in changes
+        if _tile_attrs(old) != _tile_attrs(new)
+        for state in (old, new)
+        if state is not None
+    ]
+    if states:
+        # До коммита тайл всё равно перерисовали бы по старым данным
+        transaction.on_commit(lambda: _invalidate_committed(states))
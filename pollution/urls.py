@@ -1,5 +1,7 @@
+from django.urls import path
 from rest_framework_nested import routers
-from .views import PollutionPointViewSet, CommentViewSet
+from .async_reads import route
+from .views import PollutionPointViewSet, CommentViewSet, point_events, point_tile
 
 router = routers.SimpleRouter()
 router.register(r'points', PollutionPointViewSet, basename='points')
@@ -7,5 +9,8 @@ router.register(r'points', PollutionPointViewSet, basename='points')
 points_router = routers.NestedSimpleRouter(router, r'points', lookup='point')
 points_router.register(r'comments', CommentViewSet, basename='point-comments')
 
-urlpatterns = router.urls + points_router.urls
+urlpatterns = [
+    path('events/', point_events, name='point-events'),
+    path('tiles/<int:z>/<int:x>/<int:y>.mvt', point_tile, name='point-tile'),
+] + route(router.urls) + points_router.urls
 
@@ -0,0 +1,280 @@
+"""
+Версии данных карты для условных запросов (ETag / Last-Modified).
+
+Одна строка ``CollectionVersion`` на коллекцию:
+
+* ``points`` — точки (и число комментариев в списке);
+* ``comments:<id точки>`` — комментарии одной точки;
+* ``users`` и ``organizations`` — поля авторов и организаций, которые
+  попадают в ответы.
+
+Ответ зависит от нескольких коллекций (``POINT_LIST``, ``point_detail()``,
+``comment_list()``), его ETag составлен из их номеров. Запись увеличивает
+номера только затронутых коллекций (receivers ниже, плюс ``points_changed``
+для массовых операций) и только после фиксации транзакции, так что строка
+версии блокируется на один короткий UPDATE. Сохранения пользователей и
+организаций, не меняющие полей из ответов (вход, пароль), версий не трогают.
+
+Проверка ``If-None-Match`` стоит одного запроса и выполняется до обращения
+к данным и сериализатора: если версии не изменились, ответ — 304.
+``If-None-Match`` важнее ``If-Modified-Since`` (RFC 9110, 13.2.2), а
+Last-Modified с точностью до секунды отдаётся, только когда эта секунда уже
+прошла: иначе запись в ту же секунду осталась бы незамеченной.
+
+Запись через ``update()`` мимо сигналов должна вызывать ``bump()`` сама.
+"""
+import functools
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from .models import CollectionVersion, Comment, PollutionPoint
+from .signals import points_changed
+
+POINTS = 'points'
+USERS = 'users'
+ORGANIZATIONS = 'organizations'
+
+POINT_LIST = (POINTS, USERS, ORGANIZATIONS)
+
+# Поля, которые выводят сериализаторы пользователя и организации
+USER_FIELDS = {'username', 'photo', 'photo_variants', 'email', 'role', 'organization'}
+ORGANIZATION_FIELDS = {'name', 'kind', 'contact_email', 'description', 'region', 'is_active'}
+
+
+def comments(point_id):
+    """Коллекция комментариев точки; None, если id не число (ответом будет 404)."""
+    point_id = str(point_id)
+    return f'comments:{int(point_id)}' if point_id.isdigit() else None
+
+
+def point_detail(point_id):
+    name = comments(point_id)
+    return (*POINT_LIST, name) if name else None
+
+
+def comment_list(point_id):
+    name = comments(point_id)
+    return (name, USERS) if name else None
+
+
+def _increment(name, now):
+    if CollectionVersion.objects.filter(name=name).update(version=F('version') + 1, updated_at=now):
+        return
+    try:
+        with transaction.atomic():
+            CollectionVersion.objects.create(name=name, version=1, updated_at=now)
+    except IntegrityError:
+        CollectionVersion.objects.filter(name=name).update(version=F('version') + 1, updated_at=now)
+
+
+def increment(*names):
+    """Увеличить версии сразу, не дожидаясь коммита."""
+    now = timezone.now()
+    for name in sorted(set(names)):
+        _increment(name, now)
+
+
+def bump(*names):
+    """Увеличить версии коллекций (по умолчанию ``points``) после фиксации транзакции."""
+    transaction.on_commit(functools.partial(increment, *(names or (POINTS,))))
+
+
+def bump_object(model, pk):
+    """bump() для объекта, изменённого через ``update()``."""
+    if model is PollutionPoint:
+        bump(POINTS)
+    elif model is Comment:
+        point_id = Comment.objects.filter(pk=pk).values_list('point_id', flat=True).first()
+        if point_id is not None:
+            bump(comments(point_id))
+    elif model._meta.label == settings.AUTH_USER_MODEL:
+        bump(USERS)
+    else:
+        bump(ORGANIZATIONS)
+
+
+def _combine(names, rows):
+    versions = dict((name, (version, updated_at)) for name, version, updated_at in rows)
+    if not versions:
+        return 0, None
+    version = '.'.join(str(versions.get(name, (0, None))[0]) for name in names)
+    return version, max(updated_at for _, updated_at in versions.values())
+
+
+def current(*names):
+    """(версия, время изменения) набора коллекций; если их ещё нет — (0, None)."""
+    names = names or (POINTS,)
+    rows = CollectionVersion.objects.filter(name__in=names).values_list('name', 'version', 'updated_at')
+    return _combine(names, list(rows))
+
+
+async def acurrent(*names):
+    names = names or (POINTS,)
+    rows = CollectionVersion.objects.filter(name__in=names).values_list('name', 'version', 'updated_at')
+    return _combine(names, [row async for row in rows])
+
+
+def for_request(request, names):
+    """current(*names), прочитанная один раз за запрос."""
+    cache = getattr(request, '_collection_versions', None)
+    if cache is None:
+        cache = request._collection_versions = {}
+    if names not in cache:
+        cache[names] = current(*names)
+    return cache[names]
+
+
+def etag(version, renderer=None):
+    # Ответ зависит от формата (json / browsable API)
+    return f'"{version}-{renderer.format if renderer else ""}"'
+
+
+def _point_saved(sender, **kwargs):
+    bump(POINTS)
+
+
+def _points_changed(sender, changes, **kwargs):
+    bump(POINTS)
+
+
+def _comment_saved(sender, instance, created=False, **kwargs):
+    # Новый или удалённый комментарий меняет comments_count в списке точек
+    if created:
+        bump(POINTS, comments(instance.point_id))
+    else:
+        bump(comments(instance.point_id))
+
+
+def _comment_deleted(sender, instance, **kwargs):
+    bump(POINTS, comments(instance.point_id))
+
+
+def _remember_fields(fields):
+    def receiver(sender, instance, update_fields=None, **kwargs):
+        # Для полного save() сравниваем с базой: иначе не отличить правку профиля от смены пароля
+        instance._versioned_changed = None
+        if update_fields is None and instance.pk is not None:
+            old = sender.objects.filter(pk=instance.pk).values(*[_attname(sender, name) for name in fields]).first()
+            if old is not None:
+                instance._versioned_changed = any(
+                    _plain(old[_attname(sender, name)]) != _plain(getattr(instance, _attname(sender, name)))
+                    for name in fields
+                )
+    return receiver
+
+
+def _attname(model, name):
+    return model._meta.get_field(name).attname
+
+
+def _plain(value):
+    # FieldFile сравнивается по имени файла; пустое фото в базе — ''
+    if hasattr(value, 'name'):
+        value = value.name
+    return '' if value is None else value
+
+
+def _saved(collection, fields):
+    def receiver(sender, instance, created=False, update_fields=None, **kwargs):
+        # Новый пользователь или организация ещё не попали ни в один ответ
+        if created:
+            return
+        if update_fields is not None and not fields & set(update_fields):
+            return
+        if getattr(instance, '_versioned_changed', None) is False:
+            return
+        bump(collection)
+    return receiver
+
+
+def _deleted(collection):
+    def receiver(sender, **kwargs):
+        bump(collection)
+    return receiver
+
+
+_user_saving = _remember_fields(USER_FIELDS)
+_organization_saving = _remember_fields(ORGANIZATION_FIELDS)
+_user_saved = _saved(USERS, USER_FIELDS)
+_organization_saved = _saved(ORGANIZATIONS, ORGANIZATION_FIELDS)
+_user_deleted = _deleted(USERS)
+_organization_deleted = _deleted(ORGANIZATIONS)
+
+
+def connect():
+    point = 'pollution.PollutionPoint'
+    post_save.connect(_point_saved, sender=point, dispatch_uid='versions:save:points')
+    post_delete.connect(_point_saved, sender=point, dispatch_uid='versions:delete:points')
+    points_changed.connect(_points_changed, sender=PollutionPoint, dispatch_uid='versions:points_changed')
+
+    comment = 'pollution.Comment'
+    post_save.connect(_comment_saved, sender=comment, dispatch_uid='versions:save:comments')
+    post_delete.connect(_comment_deleted, sender=comment, dispatch_uid='versions:delete:comments')
+
+    user, organization = settings.AUTH_USER_MODEL, 'users.Organization'
+    pre_save.connect(_user_saving, sender=user, dispatch_uid='versions:pre_save:users')
+    post_save.connect(_user_saved, sender=user, dispatch_uid='versions:save:users')
+    post_delete.connect(_user_deleted, sender=user, dispatch_uid='versions:delete:users')
+    pre_save.connect(_organization_saving, sender=organization, dispatch_uid='versions:pre_save:organizations')
+    post_save.connect(_organization_saved, sender=organization, dispatch_uid='versions:save:organizations')
+    post_delete.connect(_organization_deleted, sender=organization, dispatch_uid='versions:delete:organizations')
+
+
+def conditional(view_method):
+    """
+    GET/HEAD action'а отвечает 304, если версии коллекций из
+    ``view.version_collections()`` совпадают с If-None-Match (или, без него,
+    не новее If-Modified-Since); тело не строится.
+    """
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        names = self.version_collections() if request.method in ('GET', 'HEAD') else None
+        if names is None:
+            return view_method(self, request, *args, **kwargs)
+
+        validators, not_modified = prepare(request, *for_request(request, names))
+        if not_modified is not None:
+            return not_modified
+        return validators.stamp(view_method(self, request, *args, **kwargs))
+
+    return wrapper
+
+
+def prepare(request, version, modified):
+    """Validators для запроса DRF и готовый ответ 304 (или None)."""
+    validators = Validators(version, modified, getattr(request, 'accepted_renderer', None))
+    return validators, validators.not_modified(request._request)
+
+
+class Validators:
+    """ETag и Last-Modified ответа для версии коллекций."""
+
+    def __init__(self, version, modified, renderer=None):
+        self.etag = etag(version, renderer)
+        self.last_modified = None
+        # В текущей секунде ещё возможна запись с тем же Last-Modified
+        if modified and int(modified.timestamp()) < int(time.time()):
+            self.last_modified = int(modified.timestamp())
+
+    def not_modified(self, request):
+        """Ответ 304 для запроса Django или None (If-None-Match проверяется первым)."""
+        response = get_conditional_response(request, etag=self.etag, last_modified=self.last_modified)
+        if response is not None:
+            response['ETag'] = self.etag
+        return response
+
+    def stamp(self, response):
+        # Ответ из кеша мог быть собран для предыдущей версии и несёт свой ETag
+        if response.status_code == 200 and not response.has_header('ETag'):
+            response['ETag'] = self.etag
+            if self.last_modified is not None:
+                response['Last-Modified'] = http_date(self.last_modified)
+            response['Cache-Control'] = 'no-cache'
+        return response
@@ -1,14 +1,38 @@
-import datetime
-from django.http import HttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.dateparse import parse_date
+from django.views.decorators.http import require_GET
 from rest_framework import viewsets, permissions, status, serializers
 from rest_framework.decorators import action
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.parsers import BaseParser, MultiPartParser
 from rest_framework.response import Response
-import pandas as pd
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Coalesce
 from django.utils import timezone
-from .models import PollutionPoint, Comment
-from .serializers import PollutionPointSerializer, CommentSerializer, PollutionStatusSerializer
-from openpyxl.utils import get_column_letter
-from openpyxl.styles import Alignment, Font
+from . import analytics, duplicates, events, exports, heatmap, ingest, jobs, response_cache, search, stats, sync, tiles, versions
+from .clusters import clusters_in_bbox
+from .params import parse_bbox, parse_id, parse_limit, parse_near
+from .models import PollutionPoint, PointState, Comment, ExportJob, DailyStat
+from .signals import points_changed
+from .serializers import PollutionPointSerializer, CommentSerializer, PollutionStatusSerializer, \
+    PollutionPointListSerializer, ExportJobSerializer, ExportParamsSerializer, BulkStatusSerializer, \
+    SyncCommentSerializer, AnalyticsParamsSerializer, HeatmapParamsSerializer
+
+class ExportContentNegotiation(DefaultContentNegotiation):
+    """У экспорта ?format= выбирает формат файла, а не рендерер DRF."""
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+class BulkUploadParser(BaseParser):
+    """Тело запроса передаётся во view потоком, без разбора (см. pollution.ingest)."""
+    media_type = '*/*'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        return {'stream': stream, 'media_type': media_type}
 
 
 class PollutionPointViewSet(viewsets.ModelViewSet):
@@ -16,11 +40,81 @@ class PollutionPointViewSet(viewsets.ModelViewSet):
     serializer_class = PollutionPointSerializer
     permission_classes = [permissions.AllowAny]
 
+    def get_queryset(self):
+        """
+        Для списка поддерживается выборка по области карты:
+        ?bbox=minLon,minLat,maxLon,maxLat или ?near=lat,lon&radius_m=
+        Сообщения одного пользователя: ?reporter=<id>.
+        Поиск по описанию и комментариям: ?q= (результаты по релевантности).
+        Повторные сообщения (duplicate_of) в список не попадают, если не указано ?duplicates=1.
+        """
+        queryset = super().get_queryset()
+        if self.action != 'list':
+            return queryset.with_details()
+
+        queryset = queryset.for_list()
+        params = self.request.query_params
+        if params.get('duplicates') not in ('1', 'true'):
+            queryset = queryset.filter(duplicate_of__isnull=True)
+        if 'reporter' in params:
+            queryset = queryset.filter(reporter_id=parse_id(params['reporter'], 'reporter'))
+        if 'bbox' in params:
+            queryset = queryset.in_bbox(*parse_bbox(params['bbox']))
+        if params.get('q', '').strip():
+            queryset = search.filter_queryset(queryset, params['q'])
+            if search.available():
+                self.pagination_ordering = ('search_rank', '-id')
+        if 'near' in params:
+            queryset = queryset.near(*parse_near(params))
+        return queryset
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return PollutionPointListSerializer
+        return super().get_serializer_class()
+
+    def version_collections(self):
+        """Коллекции, от которых зависит ответ action'а (см. pollution.versions)."""
+        if self.action == 'list':
+            return versions.POINT_LIST
+        if self.action == 'retrieve':
+            return versions.point_detail(self.kwargs['pk'])
+        if self.action == 'comments':
+            return versions.comment_list(self.kwargs['pk'])
+        return None
+
+    @versions.conditional
+    @response_cache.cached
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @versions.conditional
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    def perform_update(self, serializer):
+        serializer.save()
+        # Перечитываем точку с планом запроса: UpdateModelMixin сбрасывает prefetch-кеш
+        serializer.instance = self.get_queryset().get(pk=serializer.instance.pk)
+
+    def create(self, request, *args, **kwargs):
+        """
+        Повторное сообщение о той же точке (см. pollution.duplicates) не создаёт
+        новую: ответ 200 с исходной точкой. Если повтор несёт новое фото,
+        точка создаётся со ссылкой duplicate_of.
+        """
+        self.merged = False
+        response = super().create(request, *args, **kwargs)
+        if self.merged:
+            response.status_code = status.HTTP_200_OK
+        return response
+
     def perform_create(self, serializer):
         user = self.request.user
+        extra = {}
 
         if user.is_authenticated:
-            serializer.save(reporter=user)
+            extra['reporter'] = user
 
         else:
             anonymous_name = self.request.data.get('anonymous_name')
@@ -28,9 +122,62 @@ class PollutionPointViewSet(viewsets.ModelViewSet):
                 raise serializers.ValidationError({
                     "anonymous_name": "Поле 'anonymous_name' обязательно для анонимных пользователей."
                 })
-            serializer.save(anonymous_name=anonymous_name)
+            extra['anonymous_name'] = anonymous_name
+
+        data = serializer.validated_data
+        match = duplicates.find(
+            data['pollution_type'], data['latitude'], data['longitude'],
+            photo=data.get('photo'),
+            description=data.get('description', ''),
+            can_comment=user.is_authenticated,
+        )
+        if match is not None and match.merge:
+            duplicates.merge(match.point, user, data.get('description', ''))
+            self.merged = True
+            serializer.instance = self.get_queryset().get(pk=match.point.pk)
+            return
+        if match is not None:
+            extra.update(duplicate_of=match.point, photo_phash=match.photo_phash)
+        serializer.save(**extra)
+
+    @action(
+        detail=False,
+        methods=['post'],
+        permission_classes=[permissions.IsAuthenticated],
+        parser_classes=[MultiPartParser, BulkUploadParser],
+    )
+    def bulk(self, request):
+        """
+        Массовая загрузка точек организацией: тело запроса или файл ``file``
+        в формате JSON Lines, CSV или GeoJSON. Повторная загрузка с теми же
+        ключами (поле ``key`` или заголовок Idempotency-Key) дублей не создаёт.
+        """
+        user = request.user
+        if not user.organization_id and user.role != 'admin':
+            return Response({"detail": "Массовая загрузка доступна только участникам организаций."},
+                            status=status.HTTP_403_FORBIDDEN)
+
+        upload = request.FILES.get('file')
+        if upload is not None:
+            stream = upload
+            fmt = ingest.detect_format(upload.content_type, upload.name)
+        else:
+            stream = request.data.get('stream')
+            fmt = ingest.detect_format(request.data.get('media_type'))
+        if stream is None:
+            return Response({"detail": "Пустой запрос."}, status=status.HTTP_400_BAD_REQUEST)
+        if fmt is None:
+            return Response({"detail": "Неизвестный формат. Используйте JSON Lines, CSV или GeoJSON."},
+                            status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+        try:
+            report = ingest.ingest(stream, fmt, user, request.headers.get('Idempotency-Key'))
+        except ingest.IngestError as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(report.as_dict())
 
     @action(detail=True, methods=['get', 'post'], permission_classes=[permissions.IsAuthenticated])
+    @versions.conditional
     def comments(self, request, pk=None):
         """
         GET: список комментариев к точке
@@ -42,9 +189,10 @@ class PollutionPointViewSet(viewsets.ModelViewSet):
             return Response({"detail": "PollutionPoint not found"}, status=status.HTTP_404_NOT_FOUND)
 
         if request.method == 'GET':
-            comments = point.comments.all().order_by('-created_at')
-            serializer = CommentSerializer(comments, many=True)
-            return Response(serializer.data)
+            comments = point.comments.select_related('author')
+            page = self.paginate_queryset(comments)
+            serializer = CommentSerializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
 
         elif request.method == 'POST':
             serializer = CommentSerializer(data=request.data)
@@ -83,110 +231,268 @@ class PollutionPointViewSet(viewsets.ModelViewSet):
         point.save()
         return Response(PollutionPointSerializer(point).data)
 
-    @action(detail=False, methods=['get'], url_path='export')
-    def export(self, request):
+    @action(
+        detail=False,
+        methods=['post'],
+        permission_classes=[permissions.IsAuthenticated],
+        url_path='bulk-set-status',
+        serializer_class=BulkStatusSerializer
+    )
+    def bulk_set_status(self, request):
         """
-        Красивый Excel-отчёт по загрязнениям.
-        ?period=today|week|month|year
-        """
-        period = request.query_params.get('period', 'today')
-        now = datetime.datetime.now()
-        start_date = None
-
-        if period == 'today':
-            start_date = now.date()
-        elif period == 'week':
-            start_date = now.date() - datetime.timedelta(days=7)
-        elif period == 'month':
-            start_date = now.date().replace(day=1)
-        elif period == 'year':
-            start_date = now.date().replace(month=1, day=1)
-        else:
-            return Response(
-                {"detail": "Неверный параметр period. Используйте: today, week, month, year."},
-                status=status.HTTP_400_BAD_REQUEST
+        Сменить статус многих точек одним UPDATE (семантика дат как у set-status).
+        Точки задаются списком ``ids`` или областью ``bbox``.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        new_status = data['status']
+        organization_id = request.user.organization_id
+
+        points = PollutionPoint.objects.all()
+        if data.get('ids'):
+            points = points.filter(pk__in=data['ids'])
+        if data.get('bbox'):
+            points = points.in_bbox(*data['bbox'])
+
+        now = timezone.now()
+        changes = {'status': new_status, 'handled_by_id': organization_id, 'updated_at': now,
+                   'started_at': Coalesce(F('started_at'), now)}
+        if new_status == 'cleaned':
+            changes['cleaned_at'] = now
+
+        with transaction.atomic():
+            # Прежние состояния нужны агрегатам (points_changed), строки блокируются до UPDATE
+            rows = points.select_for_update().order_by('pk').values_list(*PointState._fields)
+            old_states = [PointState(*row) for row in rows[:BulkStatusSerializer.MAX_POINTS + 1]]
+            if len(old_states) > BulkStatusSerializer.MAX_POINTS:
+                return Response(
+                    {"detail": f"Не больше {BulkStatusSerializer.MAX_POINTS} точек за один запрос."},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            found = [state.id for state in old_states]
+            PollutionPoint.objects.filter(pk__in=found).update(**changes)
+            points_changed.send(sender=PollutionPoint, changes=[
+                (state, state._replace(status=new_status, handled_by_id=organization_id)) for state in old_states
+            ])
+
+        found = set(found)
+        requested = data.get('ids') or sorted(found)
+        return Response({
+            'updated': len(found),
+            'results': [
+                {'id': pk, 'result': 'updated' if pk in found else 'not_found'}
+                for pk in dict.fromkeys(requested)
+            ],
+        })
+
+    @action(detail=False, methods=['get'])
+    def changes(self, request):
+        """
+        Изменения для офлайн-клиента: ?since=<токен из next>&limit=.
+        Без since — полная выгрузка; при has_more следующий запрос делается сразу.
+        """
+        limit = parse_limit(request.query_params, sync.DEFAULT_LIMIT, sync.MAX_LIMIT)
+        try:
+            result = sync.changes(request.query_params.get('since'), limit)
+        except sync.ExpiredToken as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_410_GONE)
+        except sync.InvalidToken as exc:
+            return Response({"since": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        context = self.get_serializer_context()
+        return Response({
+            'points': PollutionPointListSerializer(result['points'], many=True, context=context).data,
+            'comments': SyncCommentSerializer(result['comments'], many=True, context=context).data,
+            'deleted': result['deleted'],
+            'next': sync.encode_token(result['positions']),
+            'has_more': result['has_more'],
+        })
+
+    @action(detail=False, methods=['get'])
+    def clusters(self, request):
+        """
+        Кластеры точек для мелких масштабов карты.
+        ?bbox=minLon,minLat,maxLon,maxLat&zoom=N
+        """
+        bbox = parse_bbox(request.query_params.get('bbox', '-180,-90,180,90'))
+        try:
+            zoom = int(request.query_params.get('zoom', ''))
+        except ValueError:
+            zoom = -1
+        if not 0 <= zoom <= 22:
+            return Response({"detail": "Параметр zoom должен быть целым числом от 0 до 22."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        return Response(clusters_in_bbox(bbox, zoom))
+
+    @action(detail=False, methods=['get'])
+    def stats(self, request):
+        """
+        Статистика по дням из предрасчитанной таблицы.
+        ?from=YYYY-MM-DD&to=YYYY-MM-DD&group_by=day,pollution_type,status,organization
+        """
+        queryset = DailyStat.objects.all()
+        for param, lookup in (('from', 'day__gte'), ('to', 'day__lte')):
+            value = request.query_params.get(param)
+            if not value:
+                continue
+            try:
+                day = parse_date(value)
+            except ValueError:
+                day = None
+            if day is None:
+                raise serializers.ValidationError({param: "Ожидается дата в формате YYYY-MM-DD."})
+            queryset = queryset.filter(**{lookup: day})
+
+        group_by = [name for name in request.query_params.get('group_by', 'day').split(',') if name]
+        unknown = [name for name in group_by if name not in stats.GROUP_FIELDS]
+        if unknown or not group_by:
+            raise serializers.ValidationError({
+                "group_by": f"Допустимые значения: {', '.join(stats.GROUP_FIELDS)}."
+            })
+        return Response(list(stats.grouped(queryset, group_by)))
+
+    @action(detail=False, methods=['get'])
+    def analytics(self, request):
+        """
+        Сроки реакции: часы до начала работ и до очистки — процентили и гистограммы.
+        ?period=today|week|month|year (по умолчанию year) или ?from=<ISO 8601>&to=<ISO 8601>
+        ?group_by=pollution_type,organization,region,week
+        """
+        serializer = AnalyticsParamsSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return Response(analytics.report(serializer.validated_data))
+
+    @action(detail=False, methods=['get'])
+    def heatmap(self, request):
+        """
+        Плотность точек по сетке: ?bbox=minLon,minLat,maxLon,maxLat&cell_size=<градусы>
+        Фильтры ?type=&status= (можно повторять); ?half_life_days= — затухание по дате создания.
+        """
+        serializer = HeatmapParamsSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+        try:
+            result = heatmap.heatmap(
+                params['bbox'], params.get('cell_size'), params.get('type', ()), params.get('status', ()),
+                params.get('half_life_days'),
             )
+        except heatmap.GridTooLarge as exc:
+            return Response({"cell_size": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(result)
 
-        queryset = PollutionPoint.objects.filter(created_at__date__gte=start_date).order_by('created_at')
-
-        # --- Подготавливаем данные ---
-        data = []
-        for point in queryset:
-            started = point.started_at.strftime('%Y-%m-%d') if point.started_at else ''
-            cleaned = point.cleaned_at.strftime('%Y-%m-%d') if point.cleaned_at else ''
-
-            data.append({
-                'Дата создания': point.created_at.strftime('%Y-%m-%d'),
-                'Тип загрязнения': point.get_pollution_type_display(),
-                'Описание': point.description or '',
-                'Широта': point.latitude,
-                'Долгота': point.longitude,
-                'Статус': point.get_status_display(),
-                'Организация': point.handled_by.name if point.handled_by else '',
-                'Дата начала работ': started if point.status in ['in_progress', 'cleaned'] else '',
-                'Дата очистки': cleaned if point.status == 'cleaned' else '',
-                'Автор': point.reporter.username if point.reporter else point.anonymous_name or 'Аноним',
-            })
+    @action(detail=False, methods=['get'], url_path='export', content_negotiation_class=ExportContentNegotiation)
+    def export(self, request):
+        """
+        Отчёт по загрязнениям: красивый Excel или выгрузка для аналитики.
+        ?period=today|week|month|year или ?from=<ISO 8601>&to=<ISO 8601>
+        ?format=xlsx|csv|geojson|parquet
+        Фильтры: ?pollution_type=&status= (можно повторять), ?handled_by=<id>, ?bbox=
+        """
+        serializer = ExportParamsSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.params
 
-        if not data:
+        query = exports.build_query(params)
+        if not query.points.exists():
             return Response({"detail": "Нет данных за выбранный период."}, status=status.HTTP_404_NOT_FOUND)
 
-        df = pd.DataFrame(data)
-
-        # --- Добавляем агрегированную сводку по дням ---
-        summary = (
-            df.groupby(['Дата создания', 'Статус'])
-            .size()
-            .reset_index(name='Количество')
-            .sort_values(['Дата создания', 'Статус'])
-        )
+        # Файл собирается и отдаётся по частям по мере чтения строк из БД
+        fmt = exports.FORMATS[params['format']]
+        response = StreamingHttpResponse(fmt.build(query), content_type=fmt.content_type)
+        response['Content-Disposition'] = f'attachment; filename="{exports.filename(params)}"'
+        return response
 
-        # --- Создаём Excel ---
-        response = HttpResponse(
-            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    @action(
+        detail=False,
+        methods=['post'],
+        url_path='export-jobs',
+        permission_classes=[permissions.IsAuthenticated],
+        serializer_class=ExportParamsSerializer
+    )
+    def export_jobs(self, request):
+        """
+        Поставить отчёт в очередь фоновых заданий.
+        Тело — те же параметры, что у export: {"period": "year", "format": "csv", ...}
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        job, created = jobs.enqueue(serializer.params, user=request.user)
+        return Response(
+            ExportJobSerializer(job, context=self.get_serializer_context()).data,
+            status=status.HTTP_202_ACCEPTED if created else status.HTTP_200_OK
         )
-        response['Content-Disposition'] = f'attachment; filename="pollution_report_{period}.xlsx"'
-
-        with pd.ExcelWriter(response, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False, sheet_name='Детали')
-            summary.to_excel(writer, index=False, sheet_name='По дням')
-
-            # --- Украшаем таблицы ---
-            workbook = writer.book
-
-            for sheet_name in ['Детали', 'По дням']:
-                sheet = workbook[sheet_name]
-
-                # Заголовки — жирные, выравнивание по центру
-                for cell in sheet[1]:
-                    cell.font = Font(bold=True)
-                    cell.alignment = Alignment(horizontal='center')
-
-                # Подгон ширины столбцов под содержимое
-                for column_cells in sheet.columns:
-                    max_length = 0
-                    col_letter = get_column_letter(column_cells[0].column)
-                    for cell in column_cells:
-                        try:
-                            cell_len = len(str(cell.value))
-                            if cell_len > max_length:
-                                max_length = cell_len
-                        except Exception:
-                            pass
-                    adjusted_width = max_length + 2
-                    sheet.column_dimensions[col_letter].width = adjusted_width
 
-        return response
+    @action(
+        detail=False,
+        methods=['get'],
+        url_path=r'export-jobs/(?P<job_id>\d+)',
+        permission_classes=[permissions.IsAuthenticated],
+        serializer_class=ExportJobSerializer
+    )
+    def export_job(self, request, job_id=None):
+        """Состояние фонового отчёта и ссылка на файл, когда он готов (только для автора)."""
+        try:
+            job = ExportJob.objects.get(pk=job_id, created_by=request.user)
+        except ExportJob.DoesNotExist:
+            return Response({"detail": "ExportJob not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(self.get_serializer(job).data)
 
 
 class CommentViewSet(viewsets.ModelViewSet):
     serializer_class = CommentSerializer
     permission_classes = [permissions.IsAuthenticated]
 
+    def version_collections(self):
+        return versions.comment_list(self.kwargs.get('point_pk'))
+
+    @versions.conditional
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @versions.conditional
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
     def get_queryset(self):
         point_id = self.kwargs.get('point_pk')
-        return Comment.objects.filter(point_id=point_id).order_by('-created_at')
+        return Comment.objects.filter(point_id=point_id).select_related('author').order_by('-created_at')
 
     def perform_create(self, serializer):
         point_id = self.kwargs.get('point_pk')
         serializer.save(author=self.request.user, point_id=point_id)
+
+
+@require_GET
+def point_tile(request, z, x, y):
+    """Векторный тайл (MVT) с точками загрязнения."""
+    if z > tiles.MAX_ZOOM or x >= 1 << z or y >= 1 << z:
+        raise Http404("Тайл вне допустимого диапазона.")
+    response = HttpResponse(tiles.get_tile(z, x, y), content_type='application/vnd.mapbox-vector-tile')
+    response['Cache-Control'] = 'public, max-age=60'
+    return response
+
+
+@require_GET
+async def point_events(request):
+    """
+    Поток событий точек (Server-Sent Events), ?bbox= ограничивает область.
+    Только под ASGI; события приходят лишь из того же процесса (см. pollution.events).
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'detail': "Поток событий доступен только при запуске под ASGI."}, status=501)
+    if len(events.broker) >= events.MAX_SUBSCRIBERS:
+        response = JsonResponse({'detail': "Слишком много подключений, повторите позже."}, status=503)
+        response['Retry-After'] = '30'
+        return response
+    bbox = None
+    if request.GET.get('bbox'):
+        try:
+            bbox = parse_bbox(request.GET['bbox'])
+        except serializers.ValidationError as exc:
+            return JsonResponse(exc.detail, status=400)
+    response = StreamingHttpResponse(events.stream(bbox), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Не буферизовать поток на nginx
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,195 @@
+"""
+Потоковая запись XLSX с постоянным расходом памяти.
+
+Строки листа пишутся в XML сразу при поступлении во временный файл
+(в памяти до ``SPOOL_SIZE``, дальше на диске), ширины столбцов считаются на
+лету. Готовая книга отдаётся кусками через ``iter_bytes()`` — zip-архив
+пишется в поток без перемотки, поэтому весь файл никогда не лежит в памяти.
+"""
+import re
+import tempfile
+import zipfile
+from xml.sax.saxutils import escape, quoteattr
+
+SPOOL_SIZE = 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+STYLE_DEFAULT = 0
+STYLE_HEADER = 1
+
+_ILLEGAL_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+_NS_MAIN = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+_NS_REL = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+_NS_PKG_REL = 'http://schemas.openxmlformats.org/package/2006/relationships'
+_XML_DECL = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+
+_STYLES = (
+    _XML_DECL
+    + f'<styleSheet xmlns="{_NS_MAIN}">'
+    '<fonts count="2">'
+    '<font><sz val="11"/><name val="Calibri"/></font>'
+    '<font><b/><sz val="11"/><name val="Calibri"/></font>'
+    '</fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="2">'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1" applyAlignment="1">'
+    '<alignment horizontal="center"/></xf>'
+    '</cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+
+
+def column_letter(index):
+    """Буквенное имя столбца по индексу с нуля: 0 -> A, 26 -> AA."""
+    letters = ''
+    index += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+class _Sheet:
+    def __init__(self, title):
+        self.title = title
+        self.widths = []
+        self.rows = 0
+        self.body = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE, mode='w+b')
+
+    def append(self, values, style=STYLE_DEFAULT):
+        self.rows += 1
+        row = self.rows
+        cells = []
+        for index, value in enumerate(values):
+            if index >= len(self.widths):
+                self.widths.append(0)
+            if value is None:
+                value = ''
+            self.widths[index] = max(self.widths[index], len(str(value)))
+            ref = f'{column_letter(index)}{row}'
+            style_attr = f' s="{style}"' if style else ''
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                cells.append(f'<c r="{ref}"{style_attr}><v>{value!r}</v></c>')
+            else:
+                text = escape(_ILLEGAL_XML_CHARS.sub('', str(value)))
+                cells.append(f'<c r="{ref}"{style_attr} t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>')
+        self.body.write(f'<row r="{row}">{"".join(cells)}</row>'.encode('utf-8'))
+
+    def iter_xml(self):
+        yield f'{_XML_DECL}<worksheet xmlns="{_NS_MAIN}">'.encode()
+        if self.widths:
+            cols = ''.join(
+                f'<col min="{i}" max="{i}" width="{width + 2}" customWidth="1"/>'
+                for i, width in enumerate(self.widths, start=1)
+            )
+            yield f'<cols>{cols}</cols>'.encode()
+        yield b'<sheetData>'
+        self.body.seek(0)
+        while True:
+            chunk = self.body.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+        yield b'</sheetData></worksheet>'
+        self.body.close()
+
+
+class _Sink:
+    """Неперематываемый поток, из которого забираются записанные zip-данные."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+class StreamingWorkbook:
+    """
+    Книга из нескольких листов. Строки добавляются через ``append`` листа,
+    результат читается генератором ``iter_bytes()``.
+    """
+
+    def __init__(self):
+        self.sheets = []
+
+    def add_sheet(self, title, header=None):
+        sheet = _Sheet(title)
+        if header:
+            sheet.append(header, style=STYLE_HEADER)
+        self.sheets.append(sheet)
+        return sheet
+
+    def _static_parts(self):
+        sheets = ''.join(
+            f'<sheet name={quoteattr(sheet.title)} sheetId="{i}" r:id="rId{i}"/>'
+            for i, sheet in enumerate(self.sheets, start=1)
+        )
+        workbook = f'{_XML_DECL}<workbook xmlns="{_NS_MAIN}" xmlns:r="{_NS_REL}"><sheets>{sheets}</sheets></workbook>'
+
+        rels = ''.join(
+            f'<Relationship Id="rId{i}" Type="{_NS_REL}/worksheet" Target="worksheets/sheet{i}.xml"/>'
+            for i in range(1, len(self.sheets) + 1)
+        )
+        rels += f'<Relationship Id="rId{len(self.sheets) + 1}" Type="{_NS_REL}/styles" Target="styles.xml"/>'
+        workbook_rels = f'{_XML_DECL}<Relationships xmlns="{_NS_PKG_REL}">{rels}</Relationships>'
+
+        overrides = ''.join(
+            f'<Override PartName="/xl/worksheets/sheet{i}.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+            for i in range(1, len(self.sheets) + 1)
+        )
+        content_types = (
+            f'{_XML_DECL}<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            '<Override PartName="/xl/styles.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+            f'{overrides}</Types>'
+        )
+        root_rels = (
+            f'{_XML_DECL}<Relationships xmlns="{_NS_PKG_REL}">'
+            f'<Relationship Id="rId1" Type="{_NS_REL}/officeDocument" Target="xl/workbook.xml"/>'
+            '</Relationships>'
+        )
+        return [
+            ('[Content_Types].xml', content_types),
+            ('_rels/.rels', root_rels),
+            ('xl/workbook.xml', workbook),
+            ('xl/_rels/workbook.xml.rels', workbook_rels),
+            ('xl/styles.xml', _STYLES),
+        ]
+
+    def iter_bytes(self):
+        return (chunk for chunk in self._iter_zip() if chunk)
+
+    def _iter_zip(self):
+        sink = _Sink()
+        with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            for name, content in self._static_parts():
+                archive.writestr(name, content)
+                yield sink.drain()
+            for i, sheet in enumerate(self.sheets, start=1):
+                with archive.open(f'xl/worksheets/sheet{i}.xml', 'w', force_zip64=True) as entry:
+                    for chunk in sheet.iter_xml():
+                        entry.write(chunk)
+                        yield sink.drain()
+                yield sink.drain()
+        yield sink.drain()
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:22
+
+import config.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_user_photo_variants'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='photo',
+            field=models.ImageField(blank=True, null=True, storage=config.storage.photo_storage, upload_to='profile_photos/', verbose_name='Фото профиля'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('users', '0006_photo_storage'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['organization', 'username'], name='users_org_username_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.7 on 2026-10-18 11:00
+
+from django.db import migrations, models
+
+
+def fill_username_key(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+    users = list(User.objects.only('id', 'username'))
+    for user in users:
+        user.username_key = user.username.lower()
+    User.objects.bulk_update(users, ['username_key'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('users', '0007_org_username_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='username_key',
+            field=models.CharField(blank=True, default='', editable=False, max_length=150),
+        ),
+        migrations.RunPython(fill_username_key, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['organization', 'username_key'], name='users_org_username_key_idx'),
+        ),
+    ]
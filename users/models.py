@@ -3,6 +3,8 @@ import uuid
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 
+from config.storage import AtomicSaveMixin, photo_storage
+
 
 class Organization(models.Model):
     name = models.CharField(max_length=200, unique=True)
@@ -26,7 +28,7 @@ class Organization(models.Model):
         return self.user_set.all()
 
 
-class User(AbstractUser):
+class User(AtomicSaveMixin, AbstractUser):
     ROLE_CHOICES = (
         ('citizen', 'Обычный пользователь / волонтёр'),
         ('ngo', 'Экоактивист / НКО'),
@@ -43,14 +45,31 @@ class User(AbstractUser):
 
     photo = models.ImageField(
         upload_to='profile_photos/',
+        storage=photo_storage,
         blank=True,
         null=True,
         verbose_name='Фото профиля'
     )
+    # Уменьшенные копии фото без EXIF, строятся в фоне (pollution.images)
+    photo_variants = models.JSONField(default=dict, blank=True, editable=False)
+    # username в нижнем регистре: поиск по началу имени без учёта регистра идёт по индексу
+    username_key = models.CharField(max_length=150, blank=True, default='', editable=False)
 
     def __str__(self):
         return f"{self.username}"
 
+    def save(self, *args, **kwargs):
+        self.username_key = self.username.lower()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'username' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'username_key'}
+        super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = 'Пользователь'
         verbose_name_plural = 'Пользователи'
+        indexes = [
+            # Участники организации по алфавиту и поиск по началу имени
+            models.Index(fields=['organization', 'username'], name='users_org_username_idx'),
+            models.Index(fields=['organization', 'username_key'], name='users_org_username_key_idx'),
+        ]
@@ -1,41 +1,84 @@
 from django.contrib.auth import authenticate
+from django.urls import reverse
+from config.storage import photo_storage
 from rest_framework import serializers
 from users.models import User, Organization
 
 
+class PhotoVariantsField(serializers.Field):
+    """Ссылки на уменьшенные копии фото: {thumb, medium, full}; пусто, пока они не готовы."""
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        request = self.context.get('request')
+        urls = {}
+        for name, path in (value or {}).items():
+            if name == 'source':
+                continue
+            url = photo_storage().url(path)
+            urls[name] = request.build_absolute_uri(url) if request else url
+        return urls
+
+
 class UserSerializer(serializers.ModelSerializer):
     organization = serializers.PrimaryKeyRelatedField(
         read_only=True
     )
+    photo_variants = PhotoVariantsField()
+
+    class Meta:
+        model = User
+        fields = ['id', 'username', 'photo', 'photo_variants', 'email', 'role', 'organization']
+
+
+class UserShortSerializer(serializers.ModelSerializer):
+    """Краткое представление пользователя для списков."""
+    photo_variants = PhotoVariantsField()
 
     class Meta:
         model = User
-        fields = ['id', 'username', 'photo', 'email', 'role', 'organization']
+        fields = ['id', 'username', 'photo', 'photo_variants']
+
+
+class OrganizationShortSerializer(serializers.ModelSerializer):
+    """Организация без списка участников."""
+
+    class Meta:
+        model = Organization
+        fields = ['id', 'name', 'kind']
 
 
 class OrganizationSerializer(serializers.ModelSerializer):
-    members = UserSerializer(read_only=True, many=True)
+    """Организация; участники — постранично через organizations/{id}/members/."""
 
     class Meta:
         model = Organization
         fields = [
             'id', 'name', 'kind', 'contact_email',
-            'description', 'region', 'is_active', 'members'
+            'description', 'region', 'is_active'
         ]
 
 
 class UserProfileSerializer(serializers.ModelSerializer):
     organization = OrganizationSerializer(read_only=True)
     pollution_reports = serializers.SerializerMethodField()
+    photo_variants = PhotoVariantsField()
 
     class Meta:
         model = User
-        fields = ['id', 'username', 'email', 'role', 'photo', 'organization', 'pollution_reports']
+        fields = ['id', 'username', 'email', 'role', 'photo', 'photo_variants', 'organization', 'pollution_reports']
 
     def get_pollution_reports(self, obj):
-        from pollution.serializers import PollutionPointSerializer
-        pollution_points = obj.pollution_reports.all()
-        return PollutionPointSerializer(pollution_points, many=True).data
+        """Счётчики из pollution.stats и ссылка на сами точки постранично."""
+        from pollution.stats import reporter_summary
+        summary = reporter_summary(obj.pk)
+        url = f"{reverse('points-list')}?reporter={obj.pk}"
+        request = self.context.get('request')
+        summary['url'] = request.build_absolute_uri(url) if request else url
+        return summary
 
 
 class AddMemberSerializer(serializers.Serializer):
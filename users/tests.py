@@ -1,3 +1,255 @@
+import io
+from datetime import timedelta
+
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from pollution import ingest, stats
+from pollution.models import PollutionPoint, Comment, ReporterStat
+from users.models import User, Organization
+
+
+class QueryCountTestCase(TestCase):
+    """Число запросов эндпоинта не должно зависеть от объёма данных."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.organization = Organization.objects.create(name='Чистый берег')
+        self.user = User.objects.create_user('volunteer', password='secret', organization=self.organization)
+        self.client.force_authenticate(self.user)
+        self.grow()
+
+    def grow(self, count=1):
+        for i in range(count):
+            n = Organization.objects.count()
+            organization = Organization.objects.create(name=f'org-{n}')
+            User.objects.create_user(f'member-{n}', organization=organization)
+            User.objects.create_user(f'colleague-{n}', organization=self.organization)
+            point = PollutionPoint.objects.create(
+                reporter=self.user,
+                handled_by=organization,
+                pollution_type='plastic',
+                latitude=43.1,
+                longitude=131.9,
+            )
+            Comment.objects.create(point=point, author=User.objects.create_user(f'author-{n}'), text='+')
+
+    def assertConstantQueries(self, request):
+        with CaptureQueriesContext(connection) as small:
+            response = request()
+        self.assertLess(response.status_code, 400)
+        self.grow(5)
+        with CaptureQueriesContext(connection) as large:
+            response = request()
+        self.assertLess(response.status_code, 400)
+        self.assertEqual(
+            len(small), len(large),
+            "\n".join(query['sql'] for query in large.captured_queries),
+        )
+
+
+class UserViewSetQueryCountTests(QueryCountTestCase):
+
+    def test_me(self):
+        self.assertConstantQueries(lambda: self.client.get('/api/users/me/'))
+
+    def test_retrieve(self):
+        self.assertConstantQueries(lambda: self.client.get(f'/api/users/{self.user.pk}/'))
+
+
+class OrganizationViewSetQueryCountTests(QueryCountTestCase):
+
+    def test_list(self):
+        self.assertConstantQueries(lambda: self.client.get('/api/users/organizations/'))
+
+    def test_retrieve(self):
+        self.assertConstantQueries(lambda: self.client.get(f'/api/users/organizations/{self.organization.pk}/'))
+
+    def test_members(self):
+        self.assertConstantQueries(
+            lambda: self.client.get(f'/api/users/organizations/{self.organization.pk}/members/')
+        )
+
+
+class OrganizationPaginationTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user('volunteer')
+        self.client.force_authenticate(self.user)
+
+    def walk(self, url, params):
+        names = []
+        response = self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            names += [item.get('name') or item.get('username') for item in data['results']]
+            if not data['next']:
+                return names
+            response = self.client.get(data['next'])
+
+    def test_organizations(self):
+        for i in range(5):
+            Organization.objects.create(name=f'org-{i}')
+        names = self.walk('/api/users/organizations/', {'page_size': 2})
+        self.assertEqual(names, [f'org-{i}' for i in reversed(range(5))])
+
+    def test_members_by_username(self):
+        organization = Organization.objects.create(name='Чистый берег')
+        for name in ['delta', 'alpha', 'charlie', 'bravo', 'echo']:
+            User.objects.create_user(name, organization=organization)
+        url = f'/api/users/organizations/{organization.pk}/members/'
+        self.assertEqual(self.walk(url, {'page_size': 2}), ['alpha', 'bravo', 'charlie', 'delta', 'echo'])
+        self.assertEqual(self.walk(url, {'page_size': 2, 'search': 'ch'}), ['charlie'])
+
+    def test_members_search_ignores_case(self):
+        organization = Organization.objects.create(name='Чистый берег')
+        for name in ['Charlie', 'chris', 'Иван', 'игорь', 'ivan']:
+            User.objects.create_user(name, organization=organization)
+        url = f'/api/users/organizations/{organization.pk}/members/'
+        self.assertEqual(self.walk(url, {'search': 'CH'}), ['Charlie', 'chris'])
+        self.assertEqual(self.walk(url, {'search': 'иВ'}), ['Иван'])
+
+        renamed = User.objects.get(username='ivan')
+        renamed.username = 'Chuck'
+        renamed.save(update_fields=['username'])
+        self.assertEqual(self.walk(url, {'search': 'chu'}), ['Chuck'])
+        with CaptureQueriesContext(connection) as queries:
+            self.walk(url, {'search': 'chu'})
+        self.assertTrue(any('"username_key" >=' in query['sql'] for query in queries))
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/users/organizations/', {'cursor': 'WzFd'})
+        self.assertEqual(response.status_code, 404)
+
+
+class ProfileCountersTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user('volunteer')
+        self.client.force_authenticate(self.user)
+        self.points = [
+            PollutionPoint.objects.create(reporter=self.user, pollution_type=kind, latitude=55.7, longitude=37.6)
+            for kind in ('oil', 'oil', 'trash')
+        ]
+        PollutionPoint.objects.create(reporter=User.objects.create_user('other'), pollution_type='oil',
+                                      latitude=55.7, longitude=37.6)
+
+    def counters(self):
+        response = self.client.get('/api/users/me/')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['pollution_reports']
+
+    def test_profile(self):
+        self.points[0].status = 'cleaned'
+        self.points[0].save()
+        PollutionPoint.objects.get(pk=self.points[2].pk).delete()
+
+        counters = self.counters()
+        self.assertEqual(counters['total'], 2)
+        self.assertEqual(counters['by_status'], {'new': 1, 'in_progress': 0, 'cleaned': 1})
+        self.assertEqual(counters['by_type'], {
+            'trash': 0, 'oil': 2, 'industrial': 0, 'chemical': 0, 'plastic': 0, 'other': 0,
+        })
+        self.assertTrue(counters['url'].endswith(f'/api/pollutions/points/?reporter={self.user.pk}'))
+
+    def test_total_matches_linked_list(self):
+        PollutionPoint.objects.create(reporter=self.user, pollution_type='oil', latitude=55.7, longitude=37.6,
+                                      duplicate_of=self.points[0])
+        counters = self.counters()
+        self.assertEqual(counters['total'], 3)
+        listed = self.client.get(counters['url']).json()['results']
+        self.assertEqual(len(listed), counters['total'])
+
+        # Исходную точку удалили — повторное сообщение становится самостоятельным и входит в счётчики
+        self.points[0].delete()
+        counters = self.counters()
+        self.assertEqual(counters['total'], 3)
+        self.assertEqual(len(self.client.get(counters['url']).json()['results']), 3)
+
+    def test_incremental_matches_rebuild(self):
+        self.client.post(
+            '/api/pollutions/points/bulk-set-status/', {'status': 'in_progress', 'ids': [self.points[1].pk]},
+            format='json',
+        )
+        self.points[2].pollution_type = 'plastic'
+        self.points[2].save()
+        ingest.ingest(io.BytesIO(b'{"pollution_type": "chemical", "latitude": 55.7, "longitude": 37.6}\n'),
+                      'jsonl', self.user)
+        PollutionPoint.objects.create(reporter=self.user, pollution_type='oil', latitude=55.7, longitude=37.6,
+                                      duplicate_of=self.points[1])
+
+        incremental = self.snapshot()
+        self.assertEqual(stats.reporter_summary(self.user.pk)['total'], 4)
+        stats.rebuild_reporters()
+        self.assertEqual(self.snapshot(), incremental)
+
+    def test_deleted_user(self):
+        other = User.objects.get(username='other')
+        other_id = other.pk
+        self.assertTrue(ReporterStat.objects.filter(reporter_id=other_id).exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            other.delete()
+        self.assertFalse(ReporterStat.objects.filter(reporter_id=other_id).exists())
+        self.assertEqual(stats.reporter_summary(self.user.pk)['total'], 3)
+
+    @staticmethod
+    def snapshot():
+        return sorted(
+            ReporterStat.objects.filter(count__gt=0).values_list('reporter_id', 'pollution_type', 'status', 'count')
+        )
+
+
+class OrganizationWorkloadTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.organization = Organization.objects.create(name='Чистый берег')
+        self.user = User.objects.create_user('volunteer', organization=self.organization)
+        User.objects.create_user('colleague', organization=self.organization)
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/users/organizations/{self.organization.pk}/workload/'
+        self.start = timezone.now() - timedelta(days=3)
+
+    def point(self, status='new', hours=None, organization=None):
+        return PollutionPoint.objects.create(
+            pollution_type='oil', latitude=55.7, longitude=37.6, status=status,
+            handled_by=organization or self.organization,
+            started_at=self.start if status != 'new' else None,
+            cleaned_at=self.start + timedelta(hours=hours) if hours is not None else None,
+        )
+
+    def workload(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_counts_and_odd_median(self):
+        self.point()
+        self.point('in_progress')
+        for hours in (5, 1, 30):
+            self.point('cleaned', hours)
+        # Без даты начала длительность не считается
+        PollutionPoint.objects.create(pollution_type='oil', latitude=55.7, longitude=37.6, status='cleaned',
+                                      handled_by=self.organization, cleaned_at=self.start)
+        self.point('cleaned', 100, organization=Organization.objects.create(name='Другая'))
+        self.assertEqual(self.workload(), {
+            'organization': self.organization.pk, 'members': 2,
+            'open': 1, 'in_progress': 1, 'cleaned': 4, 'median_cleanup_hours': 5.0,
+        })
+
+    def test_even_median(self):
+        for hours in (2, 1, 8, 4.5):
+            self.point('cleaned', hours)
+        self.assertEqual(self.workload()['median_cleanup_hours'], 3.25)
 
-# Create your tests here.
+    def test_empty(self):
+        self.assertEqual(self.workload(), {
+            'organization': self.organization.pk, 'members': 2,
+            'open': 0, 'in_progress': 0, 'cleaned': 0, 'median_cleanup_hours': None,
+        })
@@ -1,9 +1,13 @@
+import sys
+
 from rest_framework import mixins, viewsets, status, permissions
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.decorators import action
 from django.contrib.auth import login, logout
 from django.contrib.auth import get_user_model
+from config.pagination import UsernameCursorPagination
+from pollution.stats import organization_workload
 from .models import User, Organization
 from .serializers import UserSerializer, RegisterSerializer, OrganizationSerializer, LoginSerializer, \
     AddMemberSerializer, UserProfileSerializer
@@ -52,9 +56,9 @@ class UserViewSet(mixins.CreateModelMixin,
     def me(self, request):
         user = request.user
         if request.method == 'GET':
-            serializer = UserProfileSerializer(user)
+            serializer = UserProfileSerializer(user, context={'request': request})
             return Response(serializer.data)
-        serializer = UserProfileSerializer(user, data=request.data, partial=True)
+        serializer = UserProfileSerializer(user, data=request.data, partial=True, context={'request': request})
         serializer.is_valid(raise_exception=True)
         serializer.save()
         return Response(serializer.data)
@@ -76,11 +80,10 @@ class UserViewSet(mixins.CreateModelMixin,
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        if user.photo:
-            user.photo.delete(save=False)
-
+        # Прежнее фото освобождает pollution.images после сохранения нового
         user.photo = photo
-        user.save()
+        # Только photo: photo_variants заполняет фоновая обработка
+        user.save(update_fields=['photo'])
 
         return Response(
             {
@@ -96,7 +99,7 @@ class OrganizationViewSet(viewsets.ModelViewSet):
     Управление организациями: просмотр списка, создание, редактирование,
     добавление участников.
     """
-    queryset = Organization.objects.all().order_by('-created_at')
+    queryset = Organization.objects.order_by('-created_at')
     serializer_class = OrganizationSerializer
     permission_classes = [permissions.IsAuthenticated]
 
@@ -125,12 +128,33 @@ class OrganizationViewSet(viewsets.ModelViewSet):
             status=status.HTTP_200_OK
         )
 
-    @action(detail=True, methods=['get'])
+    @action(detail=True, methods=['get'], pagination_class=UsernameCursorPagination)
     def members(self, request, pk=None):
         """
-        Получить список участников организации.
+        Участники организации постранично, по алфавиту.
+        ?search=<начало username>
         """
         org = self.get_object()
         members = org.members
-        serializer = UserSerializer(members, many=True)
-        return Response(serializer.data)
+        search = request.query_params.get('search', '').strip().lower()
+        if search:
+            # Диапазон по индексу (LIKE на Postgres его не использует), startswith уточняет
+            # границы при нелексикографических правилах сортировки
+            upper = search[:-1] + chr(min(ord(search[-1]) + 1, sys.maxunicode))
+            members = members.filter(username_key__gte=search, username_key__lt=upper, username_key__startswith=search)
+        page = self.paginate_queryset(members)
+        serializer = UserSerializer(page, many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=True, methods=['get'])
+    def workload(self, request, pk=None):
+        """
+        Нагрузка организации: точки по статусам (open / in_progress / cleaned),
+        медиана часов от начала работ до очистки, число участников.
+        """
+        org = self.get_object()
+        return Response({
+            'organization': org.pk,
+            'members': org.members.count(),
+            **organization_workload(org.pk),
+        })